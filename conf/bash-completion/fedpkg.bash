@@ -35,6 +35,8 @@ _fedpkg()
     module-scratch-build \
     new new-sources patch prep pull push retire request-branch request-repo \
     request-side-tag list-side-tags remove-side-tag \
+    dist-info prefetch-sources branches-report sync-branches foreach ws \
+    mass-rebuild mass-build onboard \
     scratch-build sources srpm switch-branch tag unused-patches update upload \
     verify-files verrel override"
 
@@ -92,11 +94,16 @@ _fedpkg()
     local options_target= options_arches= options_branch= options_string= options_file= options_dir= options_srpm= options_mroot= options_builder= options_namespace=
     local options_update_type= options_update_request=
     local options_yaml=
+    local options_clone_mode=
     local after= after_more=
 
     case $command in
         help|gimmespec|gitbuildhash|giturl|lint|new|push|unused-patches|verrel)
             ;;
+        branches-report)
+            options="--json"
+            options_string="--branches --parallel"
+            ;;
         build)
             options="--nowait --background --skip-tag --scratch --skip-remote-rules-validation --fail-fast"
             options_arches="--arches"
@@ -116,8 +123,12 @@ _fedpkg()
             options="--raw"
             ;;
         clone|co)
-            options="--branches --anonymous"
+            options="--branches --anonymous --prefetch-sources"
             options_branch="-b"
+            options_string="--parallel"
+            options_file="--batch"
+            options_dir="--reference"
+            options_clone_mode="--mode"
             after="package"
             ;;
         commit|ci)
@@ -142,6 +153,15 @@ _fedpkg()
             after="file"
             after_more=true
             ;;
+        dist-info)
+            options="--json"
+            options_string="--branches"
+            ;;
+        foreach)
+            options_string="--parallel --depth"
+            after="command"
+            after_more=true
+            ;;
         import)
             options="--create"
             options_branch="--branch"
@@ -160,13 +180,25 @@ _fedpkg()
             options_string="--with --without"
             options_dir="--builddir"
             ;;
+        mass-build)
+            options="--background --fail-fast --scratch --skip-nvr-check"
+            options_string="--depth"
+            options_target="--target"
+            after="dir"
+            after_more=true
+            ;;
+        mass-rebuild)
+            options="--override --restart --dry-run"
+            options_string="--side-tag --override-duration --depth --parallel"
+            options_file="--state"
+            ;;
         mock-config)
             options="--target"
             options_arch="--arch"
             ;;
         mockbuild)
-            options="--md5 --no-clean --no-cleanup-after --no-clean-all --shell"
-            options_string="--with --without"
+            options="--md5 --no-clean --no-cleanup-after --no-clean-all --shell --all-targets"
+            options_string="--with --without --parallel"
             options_mroot="--root --mock-config"
             ;;
         module-build)
@@ -191,10 +223,19 @@ _fedpkg()
             options_yaml="--file"
             options_srpm="--srpm"
             ;;
+        onboard)
+            options="--tests --no-clone"
+            options_string="--branch --parallel --timeout"
+            options_file="--batch"
+            after_more=true
+            ;;
         patch)
             options="--rediff"
             options_string="--suffix"
             ;;
+        prefetch-sources)
+            options_string="--branches"
+            ;;
         prep|verify-files)
             options_arch="--arch"
             options_dir="--builddir"
@@ -206,6 +247,8 @@ _fedpkg()
             after_more=true
             ;;
         retire)
+            options_string="--parallel"
+            options_file="--batch"
             after_more=true
             ;;
         request-branch)
@@ -236,6 +279,11 @@ _fedpkg()
             options="--list"
             after="branch"
             ;;
+        sync-branches)
+            options="--no-push"
+            options_string="--branches"
+            options_branch="--from"
+            ;;
         tag)
             options="--clog --raw --force --list --delete"
             options_string="--message"
@@ -252,13 +300,20 @@ _fedpkg()
             options_update_type="--type"
             options_update_request="--request"
             ;;
+        ws)
+            options="--head --json"
+            options_string="--depth --parallel --name --nvr --hash"
+            options_branch="--branch"
+            options_namespace="--namespace"
+            after="ws"
+            ;;
     esac
 
     local all_options="--help $options"
     local all_options_value="$options_target $options_arches $options_branch \
     $options_string $options_file $options_dir $options_srpm $options_mroot \
     $options_builder $options_namespace $options_update_type $options_update_request \
-    $options_yaml"
+    $options_yaml $options_clone_mode"
 
     # count non-option parameters
 
@@ -323,6 +378,9 @@ _fedpkg()
     elif [[ -n $options_update_request ]] && in_array "$prev" "$options_update_request"; then
         COMPREPLY=( $(compgen -W "testing stable" -- "$cur") )
 
+    elif [[ -n $options_clone_mode ]] && in_array "$prev" "$options_clone_mode"; then
+        COMPREPLY=( $(compgen -W "full blobless shallow" -- "$cur") )
+
     else
         local after_options=
 
@@ -330,8 +388,11 @@ _fedpkg()
             case $after in
                 file)    _filedir_exclude_paths ;;
                 srpm)    _filedir_exclude_paths "*.src.rpm" ;;
+                dir)     _filedir_exclude_paths -d ;;
                 branch)  after_options="$(_fedpkg_branch "$path")" ;;
                 package) after_options="$(_fedpkg_package "$cur")";;
+                command) after_options="$commands" ;;
+                ws)      after_options="update query" ;;
             esac
         fi
 
@@ -9,17 +9,37 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
+import io
+import fnmatch
 import pyrpkg
 import os
-import git
 import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from multiprocessing.dummy import Pool as ThreadPool
+
+import git
+import six
 
 from datetime import datetime, timedelta
 
 # doc/fedpkg_man_page.py uses the 'cli' import
 from . import cli  # noqa
-from .lookaside import FedoraLookasideCache
-from pyrpkg.utils import cached_property
+from .dist import is_release_branch, resolve_dist, resolve_dists
+from .hashing import HashCache
+from .lookaside import (FedoraLookasideCache, LocalLookasideStore,
+                        MirrorStats)
+from .manifest import SourcesManifest
+from .spec import SpecCache, macros_digest
+from .srpm import SRPMCache
+from .utils import get_cache_dir, parse_sources_line
+from pyrpkg.errors import (DownloadError, HashtypeMixingError,
+                           MalformedLineError)
+from pyrpkg.gitignore import GitIgnore
+from pyrpkg.sources import SourcesFile
+from pyrpkg.utils import cached_property, find_me
 
 try:
     from bodhi.client.bindings import BodhiClient as _BodhiClient
@@ -31,6 +51,9 @@ try:
 except ImportError:
     from platform import linux_distribution  # noqa
 
+# Parameters of pyrpkg.Commands.clone in order, handled by Commands.clone
+CLONE_PARAMS = ('path', 'branch', 'bare_dir', 'anon', 'target', 'depth')
+
 
 if _BodhiClient is not None:
     from fedora.client import AuthError
@@ -91,6 +114,42 @@ class Commands(pyrpkg.Commands):
         super(Commands, self).__init__(*args, **kwargs)
 
         self.source_entry_type = 'bsd'
+        # Versions of remote f## branches, filled by _remote_fedora_versions
+        self._remote_fedora_versions_cache = None
+        # Releases to run mockbuild for at once, and how many mock processes
+        # could run concurrently. See _mockbuild_releases.
+        self.mockbuild_releases = None
+        self.mockbuild_parallel = 1
+        # Limits of the SRPM cache. Size is in bytes and age in seconds.
+        self.srpm_cache_max_size = 1024 * 1024 * 1024
+        self.srpm_cache_max_age = 14 * 24 * 3600
+        # Local store of source files shared by checkouts. It is disabled
+        # unless a directory is configured. Size is in bytes.
+        self.lookaside_store_dir = None
+        self.lookaside_store_max_size = 10 * 1024 * 1024 * 1024
+        # Base URLs of mirrors of the lookaside cache, tried in order of
+        # measured speed. The lookaside URL is used if there are none.
+        self.lookaside_mirrors = []
+        # How many source files could be downloaded concurrently
+        self.sources_parallel = 4
+        # Git config set in clones, keyed by namespace, e.g. rpms. The
+        # clone_config is used for namespaces without their own.
+        self.clone_configs = {}
+        # How repositories are cloned, keyed by namespace, one of
+        # utils.CLONE_MODES. clone_mode overrides it for all namespaces.
+        self.clone_modes = {}
+        self.clone_mode = None
+        # Segmented download of large source files, see FedoraLookasideCache
+        self.segmented_download_min_size = 100 * 1024 * 1024
+        self.download_segments = 4
+        self.download_retries = 3
+        # How many files could be hashed concurrently
+        self.hash_parallel = 4
+        # How many files could be checked and uploaded concurrently
+        self.upload_parallel = 4
+        # Chunked upload of large source files, see FedoraLookasideCache
+        self.upload_chunk_size = 64 * 1024 * 1024
+        self.upload_retries = 3
         # un-block retirement of packages (module retirement is allowed by default)
         if 'rpms' in self.block_retire_ns:
             self.block_retire_ns.remove('rpms')
@@ -110,81 +169,1145 @@ class Commands(pyrpkg.Commands):
     def lookasidecache(self):
         """A helper to interact with the lookaside cache
 
-        We override this because we need a different download path.
+        We override this because we need a different download path, and to
+        download through the local lookaside store.
+        """
+        store = None
+        if self.lookaside_store_dir:
+            store = LocalLookasideStore(
+                os.path.expanduser(self.lookaside_store_dir),
+                max_size=self.lookaside_store_max_size)
+        lookaside = FedoraLookasideCache(
+            self.lookasidehash, self.lookaside, self.lookaside_cgi,
+            store=store)
+        lookaside.segmented_download_min_size = self.segmented_download_min_size
+        lookaside.download_segments = self.download_segments
+        lookaside.download_retries = self.download_retries
+        lookaside.partial_dir = get_cache_dir('partial')
+        lookaside.hashcache = self.hashcache
+        lookaside.upload_chunk_size = self.upload_chunk_size
+        lookaside.upload_retries = self.upload_retries
+        lookaside.upload_state_dir = get_cache_dir('uploads')
+        lookaside.mirrors = self.lookaside_mirrors
+        lookaside.mirror_stats = MirrorStats(get_cache_dir('mirrors.json'))
+        return lookaside
+
+    def _git_dir_file(self, filename):
+        """Return path of a fedpkg state file in the git directory
+
+        State files kept there are never committed. Return None outside of a
+        git repository.
+        """
+        try:
+            return os.path.join(self.repo.git_dir, filename)
+        except pyrpkg.rpkgError:
+            return None
+
+    @cached_property
+    def hashcache(self):
+        """Cache of digests of files in this checkout"""
+        return HashCache(self._git_dir_file('fedpkg-hashes.json'))
+
+    @cached_property
+    def sources_manifest(self):
+        """Manifest of source files downloaded and verified in this checkout"""
+        return SourcesManifest(self._git_dir_file('fedpkg-sources.json'))
+
+    def sources(self, outdir=None):
+        """Download source files
+
+        Only entries added or changed since the last run, according to the
+        sources manifest, are downloaded or verified. Files of entries
+        removed from sources file are deleted, unless they were modified.
+
+        Files are downloaded concurrently by sources_parallel workers. A
+        failed download does not stop the others, all failures are reported
+        once every file has been processed.
+        """
+        if not os.path.exists(self.sources_filename):
+            self.log.info("sources file doesn't exist. Source files download skipped.")
+            return
+
+        # Default to putting the files where the repository is
+        if not outdir:
+            outdir = self.path
+
+        sourcesf = SourcesFile(self.sources_filename, self.source_entry_type)
+
+        args = dict()
+        if self.lookaside_request_params:
+            if 'branch' in self.lookaside_request_params.split():
+                args['branch'] = self.branch_merge
+
+        name = self.ns_repo_name if self.lookaside_namespaced else self.repo_name
+        materialized = self.sources_manifest.get(outdir)
+        entries = []
+        for entry in sourcesf.entries:
+            if self._is_materialized(outdir, entry.file, entry.hashtype,
+                                     entry.hash, materialized):
+                self.log.debug('%s is up to date', entry.file)
+            else:
+                entries.append(entry)
+
+        listed = set(entry.file for entry in sourcesf.entries)
+        for filename in sorted(set(materialized) - listed):
+            hashtype, hash = materialized[filename]
+            if self._is_materialized(outdir, filename, hashtype, hash,
+                                     materialized):
+                self.log.info('Remove %s not listed in sources file anymore',
+                              filename)
+                os.unlink(os.path.join(outdir, filename))
+
+        try:
+            self._download_sources(name, entries, outdir, args)
+        finally:
+            self.sources_manifest.set(outdir, dict(
+                (entry.file, (entry.hashtype, entry.hash))
+                for entry in sourcesf.entries
+                if self._is_materialized(outdir, entry.file, entry.hashtype,
+                                         entry.hash)))
+            self.hashcache.save()
+            self.lookasidecache.mirror_stats.save()
+
+    def _is_materialized(self, outdir, filename, hashtype, hash,
+                         materialized=None):
+        """Check if a source file is in outdir unchanged since it was verified
+
+        :param dict materialized: if given, the file has to be recorded in
+            it with the same hash as well.
+        """
+        if (materialized is not None and
+                materialized.get(filename) != (hashtype, hash)):
+            return False
+        return self.hashcache.get(os.path.join(outdir, filename),
+                                  hashtype) == hash
+
+    def _download_sources(self, name, entries, outdir, args):
+        """Download entries of sources file into outdir"""
+        workers = min(self.sources_parallel, len(entries))
+        lookaside = self.lookasidecache
+
+        if workers <= 1:
+            for entry in entries:
+                lookaside.download(
+                    name, entry.file, entry.hash,
+                    os.path.join(outdir, entry.file),
+                    hashtype=entry.hashtype, **args)
+            return
+
+        def _download(entry):
+            try:
+                lookaside.download(
+                    name, entry.file, entry.hash,
+                    os.path.join(outdir, entry.file),
+                    hashtype=entry.hashtype, **args)
+            except (pyrpkg.rpkgError, IOError, OSError) as e:
+                self.log.error('Failed to download %s: %s', entry.file, e)
+                return entry.file
+            self.log.info('Downloaded %s', entry.file)
+
+        lookaside.show_progress = False
+        pool = ThreadPool(workers)
+        try:
+            failed = [filename for filename in pool.map(_download, entries)
+                      if filename]
+        finally:
+            pool.close()
+            pool.join()
+            lookaside.show_progress = True
+
+        if failed:
+            raise DownloadError(
+                'Failed to download {0}'.format(', '.join(failed)))
+
+    def _remote_release_branches(self):
+        """Find release branches existing in the default remote
+
+        :return: sorted list of branch names, e.g. ['epel8', 'f32', 'master'].
+        :rtype: list[str]
+        """
+        prefix = 'refs/remotes/{0}/'.format(self.default_branch_remote)
+        output = self.repo.git.for_each_ref('--format=%(refname)', prefix)
+        branches = [refname[len(prefix):] for refname in output.split()]
+        return sorted(branch for branch in branches
+                      if is_release_branch(branch))
+
+    def _branch_sources(self, ref):
+        """Read entries of sources file of a ref from git objects
+
+        Nothing is checked out, so this works for any branch regardless of
+        the working tree.
+
+        :param str ref: a git ref, e.g. origin/f32.
+        :return: list of source file entries. It is empty if the ref has no
+            sources file.
+        :rtype: list
+        """
+        try:
+            blob = self.repo.commit(ref).tree['sources']
+        except KeyError:
+            return []
+        entries = []
+        for line in blob.data_stream.read().decode('utf-8').splitlines():
+            entry = parse_sources_line(line)
+            if entry and entry not in entries:
+                entries.append(entry)
+        return entries
+
+    def prefetch_sources(self, branches=None):
+        """Download source files of release branches into the local store
+
+        Sources files are read from remote branches without checking them
+        out. Entries are deduplicated by hash, so a file shared by several
+        branches is downloaded once. A later sources command on any of the
+        branches then links files from the local store.
+
+        :param branches: names of remote branches to prefetch sources of. It
+            defaults to all release branches in the default remote.
+        :type branches: list[str]
+        :return: number of files downloaded.
+        :rtype: int
+        :raises rpkgError: if there is no local lookaside store configured.
+        """
+        if not self.lookaside_store_dir:
+            raise pyrpkg.rpkgError(
+                'Prefetching source files requires option lookaside_store '
+                'to be configured')
+        if branches is None:
+            branches = self._remote_release_branches()
+
+        pending = []
+        seen = set()
+        for branch in branches:
+            ref = '{0}/{1}'.format(self.default_branch_remote, branch)
+            try:
+                entries = self._branch_sources(ref)
+            except MalformedLineError as e:
+                self.log.warning('Skip sources of %s: %s', branch, e)
+                continue
+            for entry in entries:
+                if (entry.hashtype, entry.hash) not in seen:
+                    seen.add((entry.hashtype, entry.hash))
+                    pending.append((branch, entry))
+        if not pending:
+            self.log.info('No source files to prefetch')
+            return 0
+
+        use_branch = (self.lookaside_request_params and
+                      'branch' in self.lookaside_request_params.split())
+        name = self.ns_repo_name if self.lookaside_namespaced else self.repo_name
+        lookaside = self.lookasidecache
+
+        def _prefetch(item):
+            branch, entry = item
+            args = {'branch': branch} if use_branch else {}
+            try:
+                downloaded = lookaside.prefetch(
+                    name, entry.file, entry.hash, hashtype=entry.hashtype,
+                    **args)
+            except (pyrpkg.rpkgError, IOError, OSError) as e:
+                self.log.error('Failed to prefetch %s: %s', entry.file, e)
+                return False, entry.file
+            if downloaded:
+                self.log.info('Prefetched %s', entry.file)
+            return downloaded, None
+
+        lookaside.show_progress = False
+        pool = ThreadPool(min(max(self.sources_parallel, 1), len(pending)))
+        try:
+            results = pool.map(_prefetch, pending)
+        finally:
+            pool.close()
+            pool.join()
+            lookaside.show_progress = True
+            lookaside.mirror_stats.save()
+
+        failed = [filename for downloaded, filename in results if filename]
+        if failed:
+            raise DownloadError(
+                'Failed to prefetch {0}'.format(', '.join(failed)))
+        return len([downloaded for downloaded, filename in results
+                    if downloaded])
+
+    def _branch_spec(self, ref):
+        """Read the spec file of a ref from git objects
+
+        :param str ref: a git ref, e.g. origin/f32.
+        :return: pair of spec file name and its content, or None if there is
+            no spec file.
+        :rtype: tuple
+        """
+        specs = dict((blob.name, blob)
+                     for blob in self.repo.commit(ref).tree.blobs
+                     if blob.name.endswith('.spec'))
+        if not specs:
+            return None
+        name = '{0}.spec'.format(self.repo_name)
+        if name not in specs:
+            name = sorted(specs)[0]
+        return name, specs[name].data_stream.read()
+
+    def branches_report(self, branches=None, workers=4, local=False):
+        """Compare NVR and sources of release branches without checkout
+
+        Spec and sources files are read from remote branches in git objects.
+        Specs are evaluated by workers concurrently, each with rpm defines of
+        its branch, so NVRs are the same as verrel would print on the branch.
+
+        :param branches: names of remote branches to report. It defaults to
+            all release branches in the default remote.
+        :type branches: list[str]
+        :param int workers: how many specs are evaluated at once.
+        :param bool local: report local branches instead of remote ones.
+            Branches have to be given then.
+        :return: a list of mappings in the order of branches, each containing
+            branch name, nvr, number of commits the branch is behind master,
+            sources as a list of file names, entries of sources file as lists
+            of hash type, file name and hash, sources_group which is the same
+            number for branches with identical sources or None if there are
+            no sources, and error if the spec could not be evaluated.
+        :rtype: list[dict]
+        """
+        if branches is None:
+            branches = self._remote_release_branches()
+        if local:
+            refs_prefix = 'refs/heads/'
+        else:
+            refs_prefix = 'refs/remotes/{0}/'.format(self.default_branch_remote)
+
+        def _ref(branch):
+            return refs_prefix + branch
+
+        master_ref = _ref('master')
+        has_master = bool(self.repo.git.for_each_ref(master_ref))
+
+        # GitPython is not thread-safe, git objects are read first.
+        rows = []
+        groups = {}
+        for branch, dist in resolve_dists(branches, self.localarch,
+                                          rawhide=self._findmasterbranch):
+            ref = _ref(branch)
+            row = {'branch': branch, 'nvr': None, 'behind': None,
+                   'sources': [], 'entries': [], 'sources_group': None,
+                   'error': None}
+            rows.append(row)
+            try:
+                spec = self._branch_spec(ref)
+                entries = self._branch_sources(ref)
+                if has_master:
+                    row['behind'] = int(self.repo.git.rev_list(
+                        '--count', '{0}..{1}'.format(ref, master_ref)))
+            except (ValueError, git.BadName, git.GitCommandError,
+                    pyrpkg.rpkgError) as e:
+                row['error'] = str(e)
+                continue
+            if entries:
+                row['sources'] = [entry.file for entry in entries]
+                row['entries'] = [[entry.hashtype, entry.file, entry.hash]
+                                  for entry in entries]
+                key = tuple(sorted((entry.hashtype, entry.hash, entry.file)
+                                   for entry in entries))
+                row['sources_group'] = groups.setdefault(key, len(groups) + 1)
+            if dist is None:
+                row['error'] = 'Unknown release branch'
+            elif spec is None:
+                row['error'] = 'No spec file'
+            else:
+                row['spec'] = spec
+                row['rpmdefines'] = self._dist_rpmdefines(dist)
+
+        tmp_dir = tempfile.mkdtemp(prefix='fedpkg-branches-')
+
+        def _evaluate(row):
+            spec_name, content = row.pop('spec')
+            spec_dir = os.path.join(tmp_dir, row['branch'])
+            os.mkdir(spec_dir)
+            spec_file = os.path.join(spec_dir, spec_name)
+            with open(spec_file, 'wb') as f:
+                f.write(content)
+            try:
+                result = self._evaluate_spec_file(spec_file,
+                                                  row.pop('rpmdefines'))
+            except pyrpkg.rpkgError as e:
+                row['error'] = str(e)
+                return
+            row['nvr'] = '{0}-{1}-{2}'.format(
+                result['name'], result['version'], result['release'])
+
+        pending = [row for row in rows if 'spec' in row]
+        pool = ThreadPool(max(1, min(workers, len(pending))))
+        try:
+            pool.map(_evaluate, pending)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return rows
+
+    def sync_branches(self, branches, source='master', push=True):
+        """Fast-forward release branches to a source branch without checkout
+
+        Refs are compared and updated by git plumbing, so the working tree is
+        never touched. All updated branches are pushed to the default remote
+        at once. Local branches are updated after the push succeeded. When
+        not pushing, missing local branches are created tracking the remote
+        ones.
+
+        :param branches: names of branches to fast-forward.
+        :type branches: list[str]
+        :param str source: branch to fast-forward to. A local branch is
+            preferred to a remote one of the same name.
+        :param bool push: whether to push updated branches.
+        :return: list of pairs of branch name and result, which is one of
+            updated, up-to-date, not fast-forward, checked out and missing.
+        :rtype: list[tuple]
+        :raises rpkgError: if the source branch does not exist.
+        """
+        remote = self.default_branch_remote
+        output = self.repo.git.for_each_ref(
+            '--format=%(objectname) %(refname)',
+            'refs/heads', 'refs/remotes/{0}'.format(remote))
+        tips = {}
+        for line in output.splitlines():
+            sha, refname = line.split(' ', 1)
+            tips[refname] = sha
+
+        def local_ref(branch):
+            return 'refs/heads/{0}'.format(branch)
+
+        def remote_ref(branch):
+            return 'refs/remotes/{0}/{1}'.format(remote, branch)
+
+        target = tips.get(local_ref(source)) or tips.get(remote_ref(source))
+        if not target:
+            raise pyrpkg.rpkgError('Branch {0} does not exist'.format(source))
+        try:
+            current = self.repo.active_branch.name
+        except TypeError:
+            # Detached HEAD
+            current = None
+
+        results = []
+        updates = []
+        for branch in branches:
+            local_tip = tips.get(local_ref(branch))
+            remote_tip = tips.get(remote_ref(branch))
+            if remote_tip is None:
+                results.append((branch, 'missing'))
+                continue
+            branch_tips = [tip for tip in (remote_tip, local_tip) if tip]
+            if all(tip == target for tip in branch_tips):
+                results.append((branch, 'up-to-date'))
+            elif any(self.repo.git.merge_base(tip, target) != tip
+                     for tip in branch_tips):
+                results.append((branch, 'not fast-forward'))
+            elif branch == current:
+                results.append((branch, 'checked out'))
+            else:
+                results.append((branch, 'updated'))
+                updates.append((branch, local_tip))
+
+        if not updates:
+            return results
+
+        if push:
+            cmd = ['git', 'push']
+            if self.quiet:
+                cmd.append('-q')
+            cmd.append(remote)
+            cmd.extend('{0}:refs/heads/{1}'.format(target, branch)
+                       for branch, local_tip in updates)
+            self._run_command(cmd, cwd=self.path)
+        for branch, local_tip in updates:
+            if local_tip:
+                self.repo.git.update_ref(local_ref(branch), target, local_tip)
+            elif not push:
+                self.repo.git.branch('--track', branch,
+                                     '{0}/{1}'.format(remote, branch))
+                self.repo.git.update_ref(local_ref(branch), target)
+        return results
+
+    def _namespaced_repo(self, repo):
+        """Return repository name with namespace, rpms if there is none"""
+        if self.distgit_namespaced and '/' not in repo:
+            return 'rpms/{0}'.format(repo)
+        return repo
+
+    def _clone_config_options(self, repo):
+        """Return git clone options setting the clone config of a repository
+
+        Config is passed to git clone with -c, so that no git config process
+        has to run for every option after cloning.
+
+        :param str repo: repository name, with or without namespace.
+        :rtype: list[str]
+        """
+        options = [
+            'credential.helper={0}'.format(' '.join(find_me() + ['gitcred'])),
+            'credential.useHttpPath=true',
+        ]
+        ns_repo = self._namespaced_repo(repo)
+        namespace = ns_repo.split('/')[0] if '/' in ns_repo else None
+        clone_config = self.clone_configs.get(namespace, self.clone_config)
+        if clone_config:
+            base_repo = self.get_base_repo(repo)
+            clone_config = clone_config.strip() % {
+                'repo': base_repo,
+                'ns_repo': repo,
+                'base_module': base_repo,
+                'module': repo,
+            }
+            for confline in clone_config.splitlines():
+                key_value = confline.split(None, 1)
+                if len(key_value) == 2:
+                    options.append('='.join(key_value))
+        cmd = []
+        for option in options:
+            cmd.extend(['-c', option])
+        return cmd
+
+    def _clone_mode(self, repo):
+        """Return clone mode of a repository, see CLONE_MODES"""
+        ns_repo = self._namespaced_repo(repo)
+        namespace = ns_repo.split('/')[0] if '/' in ns_repo else None
+        return self.clone_mode or self.clone_modes.get(namespace) or 'full'
+
+    def _clone_mode_options(self, repo, depth=None):
+        """Return git clone options of the clone mode of a repository
+
+        :param str repo: repository name, with or without namespace.
+        :param str depth: number of commits to truncate history to. Shallow
+            clones have a single commit by default.
+        :rtype: list[str]
+        """
+        mode = self._clone_mode(repo)
+        options = []
+        if mode == 'blobless':
+            options.append('--filter=blob:none')
+        if mode == 'shallow':
+            options.extend(['--depth', depth or '1', '--single-branch'])
+        elif depth:
+            options.extend(['--depth', depth])
+        return options
+
+    def clone(self, repo, *args, **kwargs):
+        """Clone a repo, optionally check out a specific branch
+
+        Repositories are cloned partially if a blobless or shallow clone mode
+        is configured for their namespace. Clone config is passed to git clone
+        like in :meth:`clone_batch`, so that both configure checkouts alike.
+        See :meth:`pyrpkg.Commands.clone` for parameters. Bare clones, and
+        clones with options unknown to this method, are left to pyrpkg.
+        """
+        params = dict(zip(CLONE_PARAMS, args))
+        params.update(kwargs)
+        if (len(args) > len(CLONE_PARAMS) or
+                set(params) - set(CLONE_PARAMS) or params.get('bare_dir')):
+            return super(Commands, self).clone(repo, *args, **kwargs)
+
+        path = params.get('path')
+        branch = params.get('branch')
+        anon = params.get('anon', False)
+        target = params.get('target')
+        depth = params.get('depth')
+        if not path:
+            path = self.path
+            self._push_url = None
+            self._branch_remote = None
+        if anon:
+            giturl = self._get_namespace_anongiturl(repo)
+        else:
+            giturl = self._get_namespace_giturl(repo)
+        cmd = ['git', 'clone']
+        if self.quiet:
+            cmd.append('-q')
+        cmd.extend(self._clone_config_options(repo))
+        cmd.extend(self._clone_mode_options(repo, depth))
+        if branch:
+            cmd.extend(['-b', branch])
+        self.log.debug('Cloning %s (%s)', giturl, self._clone_mode(repo))
+        # Directory is named explicitly, git would derive it from the URL
+        target = target or self.get_base_repo(repo)
+        cmd.extend([giturl, '--origin', self.default_branch_remote, target])
+        self._run_command(cmd, cwd=path)
+
+        self._add_git_excludes(os.path.join(path, target))
+
+    def clone_batch(self, repos, path=None, anon=False, depth=None,
+                    reference_dir=None, workers=4, report=None):
+        """Clone many repositories concurrently
+
+        Every repository is cloned into a directory named by the repository
+        inside path. Existing directories are left alone.
+
+        :param repos: repository names, with or without namespace.
+        :type repos: list[str]
+        :param str path: directory to clone into. Defaults to current path.
+        :param bool anon: whether to clone anonymously.
+        :param str depth: create shallow clones with history truncated to
+            this number of commits. Clone mode of each repository applies
+            as well, see :meth:`clone`.
+        :param str reference_dir: optional directory of local mirrors of
+            repositories, e.g. reference_dir/rpms/foo.git. A clone borrows
+            objects from its mirror by git alternates, so that only objects
+            missing in the mirror are downloaded and stored.
+        :param int workers: maximum number of clones running at once.
+        :param report: optional callable called with repository name and
+            error message, or None on success, as soon as a clone is done.
+        :return: list of pairs of repository name and error message or None,
+            in the order of repos.
+        :rtype: list[tuple]
+        """
+        path = path or self.path
+
+        def _clone(repo):
+            target = os.path.join(path, self.get_base_repo(repo))
+            if os.path.exists(target):
+                error = 'Directory {0} exists'.format(target)
+            else:
+                error = self._clone_one(repo, target, anon, depth,
+                                        reference_dir)
+            if report is not None:
+                report(repo, error)
+            return repo, error
+
+        pool = ThreadPool(max(1, min(workers, len(repos))))
+        try:
+            return pool.map(_clone, repos)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _clone_one(self, repo, target, anon, depth, reference_dir):
+        """Clone a repository for clone_batch, return error message or None"""
+        if anon:
+            giturl = self._get_namespace_anongiturl(repo)
+        else:
+            giturl = self._get_namespace_giturl(repo)
+        cmd = ['git', 'clone', '-q', '--origin', self.default_branch_remote]
+        cmd.extend(self._clone_config_options(repo))
+        cmd.extend(self._clone_mode_options(repo, depth))
+        if reference_dir:
+            ns_repo = self._namespaced_repo(repo)
+            for mirror in (ns_repo + '.git', ns_repo):
+                mirror_dir = os.path.join(reference_dir, mirror)
+                if os.path.isdir(mirror_dir):
+                    cmd.extend(['--reference', mirror_dir])
+                    break
+        cmd.extend([giturl, target])
+        self.log.debug('Cloning %s', giturl)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        if proc.returncode:
+            return output.decode('utf-8', 'replace').strip() or \
+                'git clone exited with status {0}'.format(proc.returncode)
+        self._add_git_excludes(target)
+        return None
+
+    def upload(self, files, replace=False, offline=False):
+        """Upload source file(s) in the lookaside cache
+
+        Files are hashed in parallel first. Then it is checked concurrently
+        whether they are in the lookaside cache already, and only the
+        missing files are uploaded by upload_parallel workers.
+
+        Both file `sources` and `.gitignore` are updated with uploaded files
+        once all of them are uploaded, and added to index tree eventually.
+
+        :param iterable files: an iterable of files to upload.
+        :param bool replace: optionally replace the existing tracked sources.
+            Defaults to `False`.
+        :param bool offline: do all the steps except uploading into lookaside cache
+        :raises rpkgError: if failed to add a file to file `sources`.
+        """
+        files = list(files)
+        try:
+            hashes = self.hashcache.hash_files(files, self.lookasidehash,
+                                               workers=self.hash_parallel)
+        finally:
+            self.hashcache.save()
+
+        sourcesf = SourcesFile(self.sources_filename, self.source_entry_type,
+                               replace=replace)
+        gitignore = GitIgnore(os.path.join(self.path, '.gitignore'))
+
+        for f, file_hash in zip(files, hashes):
+            file_basename = os.path.basename(f)
+            try:
+                sourcesf.add_entry(self.lookasidehash, file_basename,
+                                   file_hash)
+            except HashtypeMixingError as e:
+                msg = '\n'.join([
+                    'Can not upload a new source file with a %(newhash)s '
+                    'hash, as the "%(sources)s" file contains at least one '
+                    'line with a %(existinghash)s hash.', '',
+                    'Please redo the whole "%(sources)s" file using:',
+                    '    `%(arg0)s new-sources file1 file2 ...`']) % {
+                        'newhash': e.new_hashtype,
+                        'existinghash': e.existing_hashtype,
+                        'sources': self.sources_filename,
+                        'arg0': sys.argv[0],
+                    }
+                raise pyrpkg.rpkgError(msg)
+            gitignore.add('/%s' % file_basename)
+
+        name = self.ns_repo_name if self.lookaside_namespaced else self.repo_name
+        if offline:
+            for f, file_hash in zip(files, hashes):
+                self.lookasidecache.upload(name, f, file_hash, offline=True)
+        else:
+            self._upload_missing(name, list(zip(files, hashes)))
+
+        sourcesf.write()
+        gitignore.write()
+
+        self.repo.index.add(['sources', '.gitignore'])
+
+    def _upload_missing(self, name, files):
+        """Upload files missing in the lookaside cache
+
+        :param str name: name of the module in the lookaside cache.
+        :param files: list of pairs of file path and its hash.
         """
-        return FedoraLookasideCache(
-            self.lookasidehash, self.lookaside, self.lookaside_cgi)
+        if not files:
+            return
+        lookaside = self.lookasidecache
+        pool = ThreadPool(max(1, min(self.upload_parallel, len(files))))
+        try:
+            statuses = pool.map(
+                lambda f: lookaside.remote_file_status(
+                    name, os.path.basename(f[0]), f[1]),
+                files)
+            missing = []
+            for (filepath, file_hash), (found, chunked) in zip(files,
+                                                               statuses):
+                if found:
+                    self.log.info("File already uploaded: %s", filepath)
+                else:
+                    missing.append((filepath, file_hash, chunked))
+
+            # The progress bar is garbled by concurrent uploads
+            lookaside.show_progress = len(missing) <= 1
+            try:
+                pool.map(lambda f: lookaside.upload_file(name, f[0], f[1],
+                                                         chunked=f[2]),
+                         missing)
+            finally:
+                lookaside.show_progress = True
+        finally:
+            pool.close()
+            pool.join()
+
+    @cached_property
+    def speccache(self):
+        """Cache of spec evaluation results shared by NVR and changelog"""
+        return SpecCache(get_cache_dir('specs'))
+
+    def evaluate_spec(self):
+        """Evaluate the spec file with rpm, or get the result from cache
+
+        Name, epoch, version, release and the latest changelog entry are
+        queried by a single rpm process, so that commands needing both NVR
+        and changelog, e.g. update, do not spawn rpm twice.
+
+        :return: a mapping containing name, epoch, version, release and
+            changelog text of the latest entry.
+        :rtype: dict
+        """
+        return self._evaluate_spec_file(os.path.join(self.path, self.spec),
+                                        self.rpmdefines)
+
+    def _evaluate_spec_file(self, spec_file, rpmdefines):
+        """Evaluate a spec file with given rpm options
+
+        :param str spec_file: path to the spec file.
+        :param rpmdefines: rpm options defining dist values and directories.
+        :type rpmdefines: list[str]
+        :return: a mapping like :meth:`evaluate_spec` returns.
+        :rtype: dict
+        """
+        key = self.speccache.make_key(spec_file, rpmdefines)
+        result = self.speccache.get(key) if key else None
+        if result is not None:
+            self.log.debug('Spec %s evaluation found in cache', spec_file)
+            return result
+
+        # Records of subpackages are printed after the main package. Only
+        # the first one is interesting. Records are terminated by form feed
+        # and NEVR is separated from changelog by vertical tab, which do not
+        # appear in changelog text, unlike any printable marker.
+        cmd = ['rpm'] + rpmdefines + [
+            '-q', '--qf',
+            '"%{NAME} %{EPOCH} %{VERSION} %{RELEASE}\\v%{CHANGELOGTEXT}\\n\\f"',
+            '--specfile', '"%s"' % spec_file]
+        joined_cmd = ' '.join(cmd)
+        proc = subprocess.Popen(joined_cmd, shell=True,
+                                universal_newlines=True,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        output, err = proc.communicate()
+        if six.PY2:
+            output = output.decode('utf-8')
+        if err:
+            self.log.debug('Errors occoured while running following command '
+                           'to evaluate spec:')
+            self.log.debug(joined_cmd)
+            self.log.error(err)
+        if proc.returncode > 0:
+            raise pyrpkg.rpkgError('Could not get n-v-r-e from %s' % spec_file)
+
+        fields = output.split('\f', 1)[0].split('\v', 1)
+        nevr = fields[0].split() if len(fields) == 2 else []
+        if len(nevr) != 4:
+            raise pyrpkg.rpkgError('Could not get n-v-r-e from %r' % output)
+        name, epoch, version, release = nevr
+
+        changelog = fields[1]
+        # (none) appears when the spec has no changelog at all.
+        if changelog == '(none)\n':
+            changelog = ''
+
+        result = {
+            'name': name,
+            # Most packages don't include a "Epoch: 0" line, in which case
+            # RPM returns '(none)'
+            'epoch': '0' if epoch == '(none)' else epoch,
+            'version': version,
+            'release': release,
+            'changelog': changelog,
+        }
+        if key:
+            self.speccache.set(key, result)
+        return result
+
+    def spec_dependencies(self):
+        """Query build requirements and provides of the spec file
+
+        :return: a mapping containing lists of buildrequires and provides of
+            all subpackages, as printed by rpmspec, e.g. ``foo >= 1.0``.
+        :rtype: dict
+        """
+        return self._spec_dependencies(os.path.join(self.path, self.spec),
+                                       self.rpmdefines)
+
+    def _spec_dependencies(self, spec_file, rpmdefines):
+        """Query dependencies of a spec file with given rpm options
+
+        :param str spec_file: path to the spec file.
+        :param rpmdefines: rpm options defining dist values and directories.
+        :type rpmdefines: list[str]
+        :return: a mapping like :meth:`spec_dependencies` returns.
+        :rtype: dict
+        """
+        result = {}
+        for key, option in (('buildrequires', '--buildrequires'),
+                            ('provides', '--provides')):
+            joined_cmd = ' '.join(['rpmspec'] + rpmdefines + [
+                '-q', option, '"%s"' % spec_file])
+            proc = subprocess.Popen(joined_cmd, shell=True,
+                                    universal_newlines=True,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            output, err = proc.communicate()
+            if proc.returncode > 0:
+                self.log.debug(joined_cmd)
+                self.log.error(err)
+                raise pyrpkg.rpkgError(
+                    'Could not query {0} of {1}'.format(key, spec_file))
+            result[key] = [line.strip() for line in output.splitlines()
+                           if line.strip()]
+        return result
+
+    def load_nameverrel(self):
+        """Set the name, epoch, version and release of a package"""
+        result = self.evaluate_spec()
+        self._package_name_spec = result['name']
+        self._epoch = result['epoch']
+        self._ver = result['version']
+        self._rel = result['release']
+
+    def changelog(self, raw=False):
+        """Get the latest spec changelog entry
+
+        :param bool raw: whether to keep the leading dash of each line.
+        :return: the changelog entry.
+        :rtype: six.text_type
+        """
+        lines = []
+        for line in six.StringIO(self.evaluate_spec()['changelog']):
+            if line == '\n' or line.startswith('$'):
+                continue
+            lines.append(line if raw else line.replace('- ', '', 1))
+        return ''.join(lines)
+
+    def clog(self, raw=False):
+        """Write the latest spec changelog entry to a clog file"""
+        with io.open(os.path.join(self.path, 'clog'), 'w',
+                     encoding='utf-8') as f:
+            f.write(self.changelog(raw))
+
+    @cached_property
+    def srpmcache(self):
+        """Cache of SRPMs built from this and other package repositories"""
+        return SRPMCache(get_cache_dir('srpms'),
+                         max_size=self.srpm_cache_max_size,
+                         max_age=self.srpm_cache_max_age)
+
+    def _srpm_cache_key(self, hashtype, define=None, arch=None):
+        """Make key of the SRPM cache for current repository content
+
+        Files known to git, tracked or untracked but not ignored, are part
+        of the key, and so are files listed in sources file, which are
+        usually ignored. Their content is used rather than their hash in
+        sources file, since they may be replaced locally before running
+        new-sources. Their digests come from the hash cache, so that large
+        source files are not read on every build. Build results, i.e. SRPMs, logs and files matching
+        git_excludes patterns, are never part of the key, even if they are
+        not ignored in the repository. Installed rpm macro files are part of
+        the key, defines referring to the repository path are not, so that
+        SRPMs are shared across checkouts.
+        """
+        lookaside_files = set()
+        if os.path.exists(self.sources_filename):
+            sourcesf = SourcesFile(self.sources_filename,
+                                   self.source_entry_type)
+            lookaside_files = set(entry.file for entry in sourcesf.entries)
+        excludes = [pattern.lstrip('/') for pattern in self.git_excludes]
+        excludes.extend(['*.src.rpm', '*.log'])
+
+        try:
+            known_files = self.repo.git.ls_files(
+                '--cached', '--others', '--exclude-standard', '-z')
+        except git.GitCommandError as e:
+            raise OSError('Cannot list files in repository: %s' % e)
+
+        files = []
+        sources = []
+        filenames = set(known_files.split('\0')) | lookaside_files
+        for filename in sorted(filenames):
+            path = os.path.join(self.path, filename)
+            # Only top-level files are passed to rpmbuild as sources
+            if (not filename or '/' in filename or filename.startswith('.') or
+                    not os.path.isfile(path)):
+                continue
+            if filename in lookaside_files:
+                sources.append(path)
+                continue
+            if any(fnmatch.fnmatch(filename, pattern) for pattern in excludes):
+                continue
+            files.append(path)
+
+        try:
+            digests = self.hashcache.hash_files(sources, self.lookasidehash,
+                                                workers=self.hash_parallel)
+        finally:
+            self.hashcache.save()
+        values = ['source {0} {1}'.format(os.path.basename(path), digest)
+                  for path, digest in zip(sources, digests)]
+        values.extend(define for define in self.rpmdefines
+                      if self.path not in define)
+        values.append('hashtype %s' % hashtype)
+        values.append('arch %s' % arch)
+        values.append('macros %s' % macros_digest())
+        values.extend(define or [])
+        return self.srpmcache.make_key(files, values)
+
+    def srpm(self, hashtype=None, define=None, builddir=None,
+             buildrootdir=None, arch=None):
+        """Create an srpm using hashtype from content
+
+        An SRPM built previously from same content with same dist defines is
+        taken from the SRPM cache instead of running rpmbuild again.
+        """
+        if not hashtype:
+            hashtype = self._guess_hashtype()
+        srpmname = os.path.join(self.path, '%s-%s-%s.src.rpm' % (
+            self.repo_name, self.ver, self.rel))
+
+        try:
+            key = self._srpm_cache_key(hashtype, define=define, arch=arch)
+        except (IOError, OSError) as e:
+            self.log.debug('Cannot use SRPM cache: %s', e)
+            key = None
+
+        cached_srpm = key and self.srpmcache.get(
+            key, os.path.basename(srpmname))
+        if cached_srpm:
+            self.log.info('Reuse SRPM built from same content: %s',
+                          os.path.basename(srpmname))
+            shutil.copyfile(cached_srpm, srpmname)
+            self.srpmname = srpmname
+            return
+
+        super(Commands, self).srpm(
+            hashtype=hashtype, define=define, builddir=builddir,
+            buildrootdir=buildrootdir, arch=arch)
+        if key and os.path.exists(self.srpmname):
+            self.srpmcache.put(key, self.srpmname)
 
     # Overloaded property loaders
     def load_rpmdefines(self):
         """Populate rpmdefines based on branch data"""
 
-        # Determine runtime environment
-        self._runtime_disttag = self._determine_runtime_env()
-
-        # We only match the top level branch name exactly.
-        # Anything else is too dangerous and --dist should be used
-        # This regex works until after Fedora 99.
-        if re.match(r'f\d\d$', self.branch_merge):
-            self._distval = self.branch_merge.split('f')[1]
-            self._distvar = 'fedora'
-            self._disttag = 'fc%s' % self._distval
-            self.mockconfig = 'fedora-%s-%s' % (self._distval, self.localarch)
-            self.override = 'f%s-override' % self._distval
-            self._distunset = 'rhel'
-        # Works until RHEL 10
-        elif re.match(r'el\d$', self.branch_merge) or \
-                re.match(r'epel\d$', self.branch_merge):
-            self._distval = self.branch_merge.split('el')[1]
-            self._distvar = 'rhel'
-            self._disttag = 'el%s' % self._distval
-            self.mockconfig = 'epel-%s-%s' % (self._distval, self.localarch)
-            self.override = 'epel%s-override' % self._distval
-            self._distunset = 'fedora'
-        elif re.match(r'epel\d+-playground$', self.branch_merge):
-            self._distval = re.search(r'\d+', self.branch_merge).group(0)
-            self._distvar = 'rhel'
-            self._disttag = 'epel%s.playground' % self._distval
-            self.mockconfig = 'epel-%s-%s' % (self._distval, self.localarch)
-            self.override = 'epel%s-override' % self._distval
-            self._distunset = 'fedora'
-        elif re.match(r'olpc\d$', self.branch_merge):
-            self._distval = self.branch_merge.split('olpc')[1]
-            self._distvar = 'olpc'
-            self._disttag = 'olpc%s' % self._distval
-            self.override = 'dist-olpc%s-override' % self._distval
-            self._distunset = 'rhel'
-        # master
-        elif re.match(r'master$', self.branch_merge):
-            self._distval = self._findmasterbranch()
-            self._distvar = 'fedora'
-            self._disttag = 'fc%s' % self._distval
-            self.mockconfig = 'fedora-rawhide-%s' % self.localarch
-            self.override = None
-            self._distunset = 'rhel'
-        # If we don't match one of the above, punt
-        else:
-            raise pyrpkg.rpkgError('Could not find the release/dist from branch name '
-                                   '%s\nPlease specify with --release' %
-                                   self.branch_merge)
-        self._rpmdefines = ["--define '_sourcedir %s'" % self.path,
-                            "--define '_specdir %s'" % self.path,
-                            "--define '_builddir %s'" % self.path,
-                            "--define '_srcrpmdir %s'" % self.path,
-                            "--define '_rpmdir %s'" % self.path,
-                            "--define 'dist %%{?distprefix}.%s'" % self._disttag,
-                            "--define '%s %s'" % (self._distvar,
-                                                  self._distval),
-                            "--eval '%%undefine %s'" % self._distunset,
-                            "--define '%s 1'" % self._disttag.replace(".", "_")]
+        dist = resolve_dist(self.branch_merge, self.localarch,
+                            rawhide=self._findmasterbranch)
+        self._distval = dist.distval
+        self._distvar = dist.distvar
+        self._disttag = dist.disttag
+        if dist.mockconfig:
+            self.mockconfig = dist.mockconfig
+        self.override = dist.override
+        self._distunset = dist.distunset
+        self._rpmdefines = self._dist_rpmdefines(dist)
+
+    def _dist_rpmdefines(self, dist):
+        """Return rpm options defining dist values of a release
+
+        :param DistInfo dist: dist values of the release.
+        :rtype: list[str]
+        """
+        rpmdefines = ["--define '_sourcedir %s'" % self.path,
+                      "--define '_specdir %s'" % self.path,
+                      "--define '_builddir %s'" % self.path,
+                      "--define '_srcrpmdir %s'" % self.path,
+                      "--define '_rpmdir %s'" % self.path,
+                      "--define 'dist %%{?distprefix}.%s'" % dist.disttag,
+                      "--define '%s %s'" % (dist.distvar, dist.distval),
+                      "--eval '%%undefine %s'" % dist.distunset,
+                      "--define '%s 1'" % dist.disttag.replace(".", "_")]
         # TODO: consider removing macro "%s 1; it has unknown/dubious functionality"
 
-        if self._runtime_disttag:
-            if self._disttag != self._runtime_disttag:
+        if self.runtime_disttag:
+            if dist.disttag != self.runtime_disttag:
                 # This means that the runtime is known, and is different from
                 # the target, so we need to unset the _runtime_disttag
-                self._rpmdefines.append("--eval '%%undefine %s'" %
-                                        self._runtime_disttag)
+                rpmdefines.append("--eval '%%undefine %s'" %
+                                  self.runtime_disttag)
+        return rpmdefines
+
+    @cached_property
+    def runtime_disttag(self):
+        """Dist tag of the runtime environment
+
+        It is determined once, as querying the distribution is not free and
+        the result does not change during a run.
+        """
+        return self._determine_runtime_env()
+
+    def _switch_release(self, release):
+        """Make following commands work on the given release
+
+        Everything derived from the release branch is reloaded lazily.
+        """
+        self.branch_merge = release
+        self.target = self.build_target(release)
+        self._mockconfig = None
+        self._ver = None
+        self._rel = None
+        self._nvr = None
+        self.load_rpmdefines()
+
+    def mockbuild(self, mockargs=[], root=None, hashtype=None, shell=None,
+                  **kwargs):
+        """Build the package in mock, using mockargs
+
+        If mockbuild_releases is set, build for all of the releases. See
+        _mockbuild_releases. Other keyword arguments are passed to rpkg.
+        """
+        if not self.mockbuild_releases:
+            return super(Commands, self).mockbuild(
+                mockargs, root=root, hashtype=hashtype, shell=shell, **kwargs)
+        if root or shell:
+            raise pyrpkg.rpkgError(
+                'Mock root and shell cannot be used to build for multiple '
+                'releases.')
+        if kwargs:
+            self.log.debug('Options %s do not apply to building for multiple '
+                           'releases', ', '.join(sorted(kwargs)))
+        self._mockbuild_releases(mockargs, hashtype=hashtype)
+
+    def _mockbuild_releases(self, mockargs, hashtype=None):
+        """Build the package in mock for every release in mockbuild_releases
+
+        Mock configs and SRPMs are prepared release by release, then mock runs
+        for all the releases concurrently, at most mockbuild_parallel at once.
+        Every release has its own result directory named by the mock root
+        inside the usual one, where mock output is logged into
+        mock-output.log. Releases with the same dist tag, e.g. master and
+        the branch of the same release, share one SRPM if it is created with
+        same hash type.
+        """
+        srpms = {}
+        config_dirs = []
+        jobs = []
+        try:
+            for release in self.mockbuild_releases:
+                self._switch_release(release)
+                release_hashtype = hashtype or self._guess_hashtype()
+                srpm_key = (self._disttag, release_hashtype)
+                if srpm_key in srpms:
+                    self.log.debug('Reuse SRPM %s for %s',
+                                   srpms[srpm_key], release)
+                else:
+                    self.srpm(hashtype=release_hashtype)
+                    srpms[srpm_key] = self.srpmname
+
+                root = self.mockconfig
+                cmd = ['mock'] + list(mockargs)
+                if self.quiet:
+                    cmd.append('--quiet')
+                if not os.path.exists('/etc/mock/%s.cfg' % root):
+                    self.log.debug('Mock config %s was not found. Going to'
+                                   ' request koji to create new one.', root)
+                    config_dir = self._config_dir_basic(root=root)
+                    config_dirs.append(config_dir)
+                    self._config_dir_other(config_dir)
+                    cmd.extend(['--configdir', config_dir])
+                resultdir = os.path.join(self.mock_results_dir, root)
+                cmd += ['-r', root, '--resultdir', resultdir,
+                        '--rebuild', srpms[srpm_key]]
+                jobs.append((release, resultdir, cmd))
+
+            self.log.info('Running mock for %s with %d parallel jobs',
+                          ', '.join(self.mockbuild_releases),
+                          self.mockbuild_parallel)
+            pool = ThreadPool(max(1, self.mockbuild_parallel))
+            try:
+                results = pool.map(self._run_mock_job, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            for config_dir in config_dirs:
+                self._cleanup_tmp_dir(config_dir)
+
+        failed = [release for release, ok in results if not ok]
+        if failed:
+            raise pyrpkg.rpkgError(
+                'Mock build failed for {0}'.format(', '.join(failed)))
+
+    def _run_mock_job(self, job):
+        """Run one mock command prepared by _mockbuild_releases"""
+        release, resultdir, cmd = job
+        if not os.path.isdir(resultdir):
+            os.makedirs(resultdir)
+        output_log = os.path.join(resultdir, 'mock-output.log')
+        self.log.debug('Run mock for %s: %s', release, ' '.join(cmd))
+        try:
+            with open(output_log, 'w') as f:
+                returncode = subprocess.call(
+                    cmd, stdout=f, stderr=subprocess.STDOUT)
+        except OSError as e:
+            self.log.error('Could not run mock for %s: %s', release, e)
+            return release, False
+        if returncode:
+            self.log.error('Mock build for %s failed. See %s',
+                           release, output_log)
+            return release, False
+        self.log.info('Mock build for %s finished. Results are in %s',
+                      release, resultdir)
+        return release, True
 
     def build_target(self, release):
         if release == 'master':
@@ -219,31 +1342,57 @@ class Commands(pyrpkg.Commands):
         else:
             return self._tag2version(rawhidetarget['dest_tag_name'])
 
-        # Create a list of "fedoras"
-        fedoras = []
-
-        # Create a regex to find branches that exactly match f##.  Should not
-        # catch branches such as f14-foobar
-        branchre = r'f\d\d$'
-
-        # Find the repo refs
-        for ref in self.repo.refs:
-            # Only find the remote refs
-            if type(ref) == git.RemoteReference:
-                # Search for branch name by splitting off the remote
-                # part of the ref name and returning the rest.  This may
-                # fail if somebody names a remote with / in the name...
-                if re.match(branchre, ref.name.split('/', 1)[1]):
-                    # Add just the simple f## part to the list
-                    fedoras.append(ref.name.split('/')[1])
+        fedoras = self._remote_fedora_versions()
         if fedoras:
-            # Sort the list
-            fedoras.sort()
-            # Start with the last item, strip the f, add 1, return it.
-            return(int(fedoras[-1].strip('f')) + 1)
+            # Start with the newest release and add 1
+            return fedoras[-1] + 1
         else:
             raise pyrpkg.rpkgError('Unable to find rawhide target')
 
+    def _remote_fedora_versions(self):
+        """Find versions of f## branches existing in remotes
+
+        Remote refs are filtered by git in a single for-each-ref call instead
+        of iterating self.repo.refs, which creates an object for every ref and
+        is slow in repositories with thousands of remote branches. Branches
+        such as f14-foobar are skipped. The result is cached per instance.
+
+        :return: sorted list of release versions as integers, e.g. [29, 30].
+        :rtype: list[int]
+        """
+        if self._remote_fedora_versions_cache is None:
+            # Wildcard does not match "/", hence only refs/remotes/<remote>/f*
+            output = self.repo.git.for_each_ref(
+                '--format=%(refname)', 'refs/remotes/*/f[0-9][0-9]*')
+            if self._is_single_branch_clone():
+                # Other branches are not fetched, ask the remote for them
+                try:
+                    output += '\n' + self.repo.git.ls_remote(
+                        '--heads', self.default_branch_remote,
+                        'refs/heads/f[0-9]*')
+                except git.GitCommandError as e:
+                    self.log.debug('Unable to list remote branches: %s', e)
+            versions = set()
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                # ls-remote prints object name before ref name
+                branch = line.split()[-1].rsplit('/', 1)[-1]
+                if re.match(r'f\d+$', branch):
+                    versions.add(int(branch[1:]))
+            self._remote_fedora_versions_cache = sorted(versions)
+        return self._remote_fedora_versions_cache
+
+    def _is_single_branch_clone(self):
+        """Whether only a single branch is fetched from the default remote"""
+        try:
+            refspecs = self.repo.git.config(
+                '--get-all',
+                'remote.{0}.fetch'.format(self.default_branch_remote))
+        except git.GitCommandError:
+            return False
+        return '*' not in refspecs
+
     def _determine_runtime_env(self):
         """Need to know what the runtime env is, so we can unset anything
            conflicting
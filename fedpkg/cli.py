@@ -19,9 +19,13 @@ import json
 import os
 import re
 import shutil
+import subprocess
+import sys
 import textwrap
 from datetime import datetime
+from multiprocessing.dummy import Pool as ThreadPool
 
+import git
 import pkg_resources
 import six
 from six.moves import configparser
@@ -29,14 +33,23 @@ from six.moves.configparser import NoOptionError, NoSectionError
 from six.moves.urllib_parse import urlparse
 
 from fedpkg.bugzilla import BugzillaClient
-from fedpkg.utils import (assert_new_tests_repo, assert_valid_epel_package,
-                          config_get_safely, do_add_remote, do_fork,
-                          expand_release, get_dist_git_url,
+from fedpkg.dist import resolve_dists
+from fedpkg.foreach import run_foreach, split_steps
+from fedpkg.massbuild import submit_builds
+from fedpkg.onboard import Onboarding
+from fedpkg.rebuild import RebuildScheduler, RebuildState
+from fedpkg.utils import (CLONE_MODES, assert_new_tests_repo,
+                          assert_valid_epel_package, config_get_safely,
+                          do_add_remote, do_fork, expand_release,
+                          get_cache_dir, get_dist_git_url,
                           get_fedora_release_state, get_release_branches,
-                          get_stream_branches, is_epel, new_pagure_issue,
-                          sl_list_to_dict, verify_sls)
+                          get_stream_branches, is_epel, new_branch_ticket,
+                          new_pagure_issue, new_repo_ticket, sl_list_to_dict,
+                          verify_sls)
+from fedpkg.workspace import WorkspaceIndex, find_checkouts
 from pyrpkg import rpkgError
 from pyrpkg.cli import cliClient
+from pyrpkg.utils import find_me
 
 RELEASE_BRANCH_REGEX = r'^(f\d+|el\d+|epel\d+)$'
 LOCAL_PACKAGE_CONFIG = 'package.cfg'
@@ -99,6 +112,58 @@ class fedpkgClient(cliClient):
         self.DEFAULT_CLI_NAME = 'fedpkg'
         super(fedpkgClient, self).__init__(config, name)
         self.setup_fed_subparsers()
+        # Files uploaded for builds in this run, see _upload_file_for_build
+        self._uploaded_files = {}
+
+    # Integer options of fedpkg section passed to Commands, as tuples of
+    # option name, Commands attribute and multiplier converting to the unit
+    # of the attribute.
+    INT_CMD_OPTIONS = (
+        ('srpm_cache_max_size', 'srpm_cache_max_size', 1024 * 1024),
+        ('srpm_cache_max_age', 'srpm_cache_max_age', 24 * 3600),
+        ('lookaside_store_max_size', 'lookaside_store_max_size', 1024 * 1024),
+        ('sources_parallel', 'sources_parallel', 1),
+        ('segmented_download_min_size', 'segmented_download_min_size',
+         1024 * 1024),
+        ('download_segments', 'download_segments', 1),
+        ('download_retries', 'download_retries', 1),
+        ('hash_parallel', 'hash_parallel', 1),
+        ('upload_parallel', 'upload_parallel', 1),
+        ('upload_chunk_size', 'upload_chunk_size', 1024 * 1024),
+        ('upload_retries', 'upload_retries', 1),
+    )
+
+    def load_cmd(self):
+        super(fedpkgClient, self).load_cmd()
+
+        for option, attr, unit in self.INT_CMD_OPTIONS:
+            if not self.config.has_option(self.name, option):
+                continue
+            try:
+                value = self.config.getint(self.name, option)
+            except ValueError as e:
+                raise rpkgError('Invalid value of option {0}: {1}'.format(
+                    option, e))
+            setattr(self._cmd, attr, value * unit)
+
+        if self.config.has_option(self.name, 'lookaside_store'):
+            self._cmd.lookaside_store_dir = self.config.get(
+                self.name, 'lookaside_store')
+        if self.config.has_option(self.name, 'lookaside_mirrors'):
+            self._cmd.lookaside_mirrors = self.config.get(
+                self.name, 'lookaside_mirrors').split()
+        self._cmd.clone_configs = dict(
+            (option[len('clone_config_'):], value)
+            for option, value in self.config.items(self.name, raw=True)
+            if option.startswith('clone_config_'))
+        for option, value in self.config.items(self.name, raw=True):
+            if not option.startswith('clone_mode_'):
+                continue
+            if value not in CLONE_MODES:
+                raise rpkgError(
+                    'Invalid value of option {0}: {1}, expected one of '
+                    '{2}'.format(option, value, ', '.join(CLONE_MODES)))
+            self._cmd.clone_modes[option[len('clone_mode_'):]] = value
 
     def setup_argparser(self):
         super(fedpkgClient, self).setup_argparser()
@@ -116,12 +181,21 @@ class fedpkgClient(cliClient):
         """Register the fedora specific targets"""
 
         self.register_releases_info()
+        self.register_dist_info()
         self.register_update()
         self.register_request_repo()
         self.register_request_tests_repo()
         self.register_request_branch()
         self.register_do_fork()
         self.register_override()
+        self.register_prefetch_sources()
+        self.register_branches_report()
+        self.register_sync_branches()
+        self.register_foreach()
+        self.register_ws()
+        self.register_mass_rebuild()
+        self.register_mass_build()
+        self.register_onboard()
 
     # Target registry goes here
     def register_update(self):
@@ -498,6 +572,490 @@ class fedpkgClient(cliClient):
 
         parser.set_defaults(command=self.show_releases_info)
 
+    def register_dist_info(self):
+        help_msg = 'Print dist values resolved from branch names'
+        description = textwrap.dedent('''
+            Print dist values resolved from branch names
+
+            Dist values are resolved in the same way as for rpm commands run in a package
+            repository, without touching the repository, so that many branches could be
+            resolved at once. If --branches is omitted, current branch is resolved.
+
+                {0} dist-info --branches master f31 epel8 el6
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'dist-info',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--branches',
+            nargs='+',
+            metavar='BRANCH',
+            help='Branches to resolve dist values for.')
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print dist values as JSON, which is easier to be read by '
+                 'other tools.')
+        parser.set_defaults(command=self.show_dist_info)
+
+    def register_prefetch_sources(self):
+        help_msg = 'Download source files of release branches in advance'
+        description = textwrap.dedent('''
+            Download source files of release branches in advance
+
+            Sources files of remote release branches are read from git objects without
+            checking them out, and the source files are downloaded into the local lookaside
+            store, each of them once. A later sources command on any of the branches does
+            not need to wait for network then. Option lookaside_store has to be configured.
+
+            Prefetch runs in background after clone with option --prefetch-sources, or if
+            option prefetch_sources is enabled in the config file.
+
+                {0} prefetch-sources --branches f32 epel8
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'prefetch-sources',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--branches',
+            nargs='+',
+            metavar='BRANCH',
+            help='Remote branches to prefetch source files of. Default is all '
+                 'release branches.')
+        parser.set_defaults(command=self.prefetch_sources)
+
+    def register_branches_report(self):
+        help_msg = 'Compare NVR and sources of release branches'
+        description = textwrap.dedent('''
+            Compare NVR and sources of release branches
+
+            Spec and sources files of remote release branches are read from git objects,
+            so nothing is checked out and the working tree is not touched. NVR of each
+            branch is evaluated with dist values of the branch. The report shows how many
+            commits each branch is behind master, and which branches ship identical
+            sources.
+
+                {0} branches-report
+                {0} branches-report --branches master f32 epel8 --json
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'branches-report',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--branches',
+            nargs='+',
+            metavar='BRANCH',
+            help='Remote branches to report. Default is all release branches.')
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of spec files evaluated at once. Default is 4.')
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON, which is easier to be read by '
+                 'other tools.')
+        parser.set_defaults(command=self.show_branches_report)
+
+    def register_sync_branches(self):
+        help_msg = 'Fast-forward release branches to master and push them'
+        description = textwrap.dedent('''
+            Fast-forward release branches to master and push them
+
+            Branches are fast-forwarded by git plumbing without checking them out, so the
+            working tree is not touched, and all updated branches are pushed at once.
+            Branches which cannot be fast-forwarded, or the one checked out currently, are
+            left as they are. If --branches is omitted, active Fedora and EPEL releases
+            are synced.
+
+                {0} sync-branches
+                {0} sync-branches --branches f32 f33 --no-push
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'sync-branches',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--branches',
+            nargs='+',
+            metavar='BRANCH',
+            help='Branches to fast-forward. Default is active releases.')
+        parser.add_argument(
+            '--from',
+            dest='source',
+            metavar='BRANCH',
+            default='master',
+            help='Branch to fast-forward to. Default is master.')
+        parser.add_argument(
+            '--no-push',
+            action='store_true',
+            help='Only update local branches, do not push.')
+        parser.set_defaults(command=self.sync_branches)
+
+    def register_foreach(self):
+        help_msg = 'Run commands in every package checkout under a directory'
+        description = textwrap.dedent('''
+            Run commands in every package checkout under a directory
+
+            Checkouts are searched in the directory given by --path, or the current
+            directory. Commands are separated by ";", which has to be quoted in shell, and
+            run in each checkout in order, stopping at the first failure. Checkouts are
+            processed by a pool of worker processes sharing the config and Koji sessions
+            of this fedpkg process. Output of each checkout is printed once it is done,
+            and failures are summarized at the end.
+
+                {0} --path ~/fedora foreach --parallel 8 pull ';' sources
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'foreach',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of checkouts processed at once. Default is 4.')
+        parser.add_argument(
+            '--depth',
+            type=int,
+            metavar='N',
+            default=2,
+            help='How many levels of directories are searched for checkouts. '
+                 'Default is 2, e.g. both pkg and rpms/pkg are found.')
+        parser.add_argument(
+            'steps',
+            nargs=argparse.REMAINDER,
+            metavar='COMMAND',
+            help='fedpkg command with its arguments to run in each checkout.')
+        parser.set_defaults(command=self.foreach)
+
+    def register_ws(self):
+        help_msg = 'Index package checkouts and query the index'
+        description = textwrap.dedent('''
+            Index package checkouts and query the index
+
+            The workspace index records branches of package checkouts under a directory
+            with their commits, NVRs and source files. "ws update" refreshes the index for
+            checkouts under the directory given by --path, or the current directory, and
+            evaluates again only branches whose commits changed since the last update.
+            "ws query" answers from the index without touching the checkouts. Patterns
+            accept shell wildcards.
+
+                {0} --path ~/fedora ws update
+                {0} ws query --branch f32 --nvr 'python-*'
+                {0} ws query --hash 0f7cd2a0d2bd2f4d2f0a37bd1a24e3ba
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'ws',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        ws_subparsers = parser.add_subparsers(
+            title='Workspace commands', dest='ws_command')
+        parser.set_defaults(command=parser.print_help)
+
+        update_parser = ws_subparsers.add_parser(
+            'update', help='Refresh index of checkouts under a directory')
+        update_parser.add_argument(
+            '--depth',
+            type=int,
+            metavar='N',
+            default=2,
+            help='How many levels of directories are searched for checkouts. '
+                 'Default is 2, e.g. both pkg and rpms/pkg are found.')
+        update_parser.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of specs evaluated at once. Default is 4.')
+        update_parser.set_defaults(command=self.ws_update)
+
+        query_parser = ws_subparsers.add_parser(
+            'query', help='Find indexed branches of checkouts')
+        query_parser.add_argument(
+            '--name', help='Pattern matching repository names.')
+        query_parser.add_argument(
+            '--namespace', help='Namespace of repositories, e.g. rpms.')
+        query_parser.add_argument(
+            '--branch', help='Pattern matching branch names.')
+        query_parser.add_argument(
+            '--nvr', help='Pattern matching NVRs.')
+        query_parser.add_argument(
+            '--hash', help='Hash of a source file in the sources file.')
+        query_parser.add_argument(
+            '--head',
+            action='store_true',
+            help='Only show branches currently checked out.')
+        query_parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the result as JSON including source files.')
+        query_parser.set_defaults(command=self.ws_query)
+
+    def register_mass_rebuild(self):
+        help_msg = 'Rebuild packages of many checkouts in dependency order'
+        description = textwrap.dedent('''
+            Rebuild packages of many checkouts in dependency order
+
+            Build requirements and provides are read from specs of checkouts under the
+            directory given by --path, or the current directory. Packages are split into
+            waves, each depending only on packages of former waves. Builds of a wave are
+            submitted by --parallel workers and run in Koji at once, and the next wave
+            starts when they are in the buildroot.
+
+            Builds go to the target of each checkout's branch, unless --side-tag is given.
+            With --override, buildroot overrides are created for builds of each wave.
+
+            Progress is saved into a state file. Running the command again continues the
+            rebuild, e.g. after fixing a failed build, unless --restart is given.
+
+                {0} --path ~/rebuild mass-rebuild --side-tag f33-build-side-1234
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'mass-rebuild',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        buildroot_group = parser.add_mutually_exclusive_group()
+        buildroot_group.add_argument(
+            '--side-tag',
+            metavar='TAG',
+            help='Build all packages in this side tag.')
+        buildroot_group.add_argument(
+            '--override',
+            action='store_true',
+            help='Create buildroot overrides in Bodhi for builds of a wave '
+                 'before building the next wave.')
+        parser.add_argument(
+            '--override-duration',
+            type=int,
+            metavar='DAYS',
+            default=7,
+            help='Duration of buildroot overrides in days. Default is 7.')
+        parser.add_argument(
+            '--state',
+            metavar='FILE',
+            help='State file of the rebuild. Default is fedpkg-rebuild.json '
+                 'in the directory of checkouts.')
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Plan the rebuild again instead of continuing from the state '
+                 'file.')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only plan the waves and print them.')
+        parser.add_argument(
+            '--depth',
+            type=int,
+            metavar='N',
+            default=2,
+            help='How many levels of directories are searched for checkouts. '
+                 'Default is 2, e.g. both pkg and rpms/pkg are found.')
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of specs read or builds submitted at once. '
+                 'Default is 4.')
+        parser.set_defaults(command=self.mass_rebuild)
+
+    def register_mass_build(self):
+        help_msg = 'Submit builds of many checkouts at once'
+        description = textwrap.dedent('''
+            Submit builds of many checkouts at once
+
+            Builds the latest pushed commit of every checkout given on command line, or
+            found in the directory given by --path. All builds are checked and submitted
+            through a single Koji session in a few multicalls, and task IDs of all builds
+            are reported. Builds are not waited for.
+
+                {0} --path ~/cve-fixes mass-build --background
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'mass-build',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            '--target',
+            help='Build target to build all packages into. By default, target '
+                 'is discovered from branch of each checkout.')
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Run the builds at a low priority')
+        parser.add_argument(
+            '--fail-fast',
+            action='store_true',
+            help='Fail a build immediately if any arch fails')
+        parser.add_argument(
+            '--scratch',
+            action='store_true',
+            help='Perform scratch builds')
+        parser.add_argument(
+            '--skip-nvr-check',
+            action='store_false',
+            dest='nvr_check',
+            help='Submit builds without checking if their NVRs were already '
+                 'built.')
+        parser.add_argument(
+            '--depth',
+            type=int,
+            metavar='N',
+            default=2,
+            help='How many levels of directories are searched for checkouts. '
+                 'Default is 2, e.g. both pkg and rpms/pkg are found.')
+        parser.add_argument(
+            'checkouts',
+            nargs='*',
+            metavar='CHECKOUT',
+            help='Checkouts to build. Checkouts in --path are built if none '
+                 'is given.')
+        parser.set_defaults(command=self.mass_build)
+
+    def register_onboard(self):
+        help_msg = 'Bring reviewed packages into dist-git'
+        description = textwrap.dedent('''
+            Bring reviewed packages into dist-git
+
+            Every package given as NAME:BUG goes through the whole onboarding on its
+            own: the review bug is validated, the repository is requested, and once
+            the SCM request is processed, the repository is cloned into --path and
+            the release branches are requested. Packages are onboarded at the same
+            time, a failure of one does not stop the others.
+
+            Pagure API token has to be configured, see request-repo. Example:
+
+                {0} onboard --branch f33 --branch epel8 foo:1234 bar:1235
+        '''.format(self.name))
+        parser = self.subparsers.add_parser(
+            'onboard',
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            help=help_msg,
+            description=description)
+        parser.add_argument(
+            'packages',
+            nargs='*',
+            metavar='NAME:BUG',
+            help='Package name and Bugzilla bug ID of its approved review.')
+        parser.add_argument(
+            '--batch',
+            metavar='FILE',
+            help='Onboard packages listed in a file, one NAME:BUG per line. '
+                 'Use - to read the list from stdin. Lines starting with # '
+                 'are ignored.')
+        parser.add_argument(
+            '--branch',
+            action='append',
+            dest='onboard_branches',
+            metavar='BRANCH',
+            default=[],
+            help='Release branch to request for every package. Can be given '
+                 'multiple times.')
+        parser.add_argument(
+            '--tests',
+            action='store_true',
+            help='Request a repository in the tests namespace for every '
+                 'package as well.')
+        parser.add_argument(
+            '--no-clone',
+            action='store_false',
+            dest='onboard_clone',
+            help='Do not clone the new repositories.')
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of packages onboarded at once. Default is 4.')
+        parser.add_argument(
+            '--timeout',
+            type=int,
+            metavar='HOURS',
+            default=24,
+            help='How long to wait for repository requests to be processed. '
+                 'Default is 24 hours.')
+        parser.set_defaults(command=self.onboard)
+
+    def register_clone(self):
+        super(fedpkgClient, self).register_clone()
+
+        # co is an alias copying options of clone when it is registered
+        for name in ('clone', 'co'):
+            parser = self.subparsers.choices[name]
+            parser.add_argument(
+                '--prefetch-sources',
+                action='store_true',
+                help='Download source files of all release branches into the '
+                     'local lookaside store in background after cloning.')
+            parser.add_argument(
+                '--mode',
+                dest='clone_mode',
+                choices=CLONE_MODES,
+                help='How to clone, overriding clone_mode_<namespace> '
+                     'config. blobless downloads file contents on demand, '
+                     'shallow clones only the tip of a single branch.')
+            # Repository is not given on command line when cloning a batch
+            for action in parser._actions:
+                if action.dest == 'repo':
+                    action.nargs = '?'
+            batch_group = parser.add_argument_group('batch clone')
+            batch_group.add_argument(
+                '--batch',
+                metavar='FILE',
+                help='Clone repositories listed in a file, one per line, into '
+                     'the current directory concurrently. Use - to read the '
+                     'list from stdin. Lines starting with # are ignored.')
+            batch_group.add_argument(
+                '--parallel',
+                type=int,
+                metavar='N',
+                default=4,
+                help='Maximum number of repositories cloned at once with '
+                     '--batch. Default is 4.')
+            batch_group.add_argument(
+                '--reference',
+                metavar='DIR',
+                help='Directory of local mirrors of repositories, e.g. '
+                     'DIR/rpms/foo.git, to borrow git objects from with '
+                     '--batch. Clones depend on the mirrors afterwards.')
+
+    def register_retire(self):
+        super(fedpkgClient, self).register_retire()
+
+        parser = self.subparsers.choices['retire']
+        batch_group = parser.add_argument_group('batch retire')
+        batch_group.add_argument(
+            '--batch',
+            metavar='FILE',
+            help='Retire packages listed in a file, one checkout or '
+                 'repository name per line, concurrently. Repositories '
+                 'without a checkout in --path are cloned there first. Use - '
+                 'to read the list from stdin. Lines starting with # are '
+                 'ignored.')
+        batch_group.add_argument(
+            '--parallel',
+            type=int,
+            metavar='N',
+            default=4,
+            help='Maximum number of packages retired at once with --batch. '
+                 'Default is 4.')
+
     def register_override(self):
         """Register command line parser for subcommand override
 
@@ -636,7 +1194,161 @@ class fedpkgClient(cliClient):
             targets to build the package for a particular stream.
         '''.format('\n'.join(textwrap.wrap(build_parser.description))))
 
+    def register_mockbuild(self):
+        super(fedpkgClient, self).register_mockbuild()
+
+        def validate_parallel(value):
+            error = argparse.ArgumentTypeError(
+                'Number of parallel builds must be an integer which is '
+                'greater than zero.')
+            try:
+                parallel = int(value)
+            except ValueError:
+                raise error
+            if parallel <= 0:
+                raise error
+            return parallel
+
+        mockbuild_parser = self.subparsers.choices['mockbuild']
+        mockbuild_parser.add_argument(
+            '--all-targets',
+            action='store_true',
+            help='Build for every release configured as build target in {0} '
+                 'of a stream branch. Mock runs for the releases '
+                 'concurrently and results of each release are put into a '
+                 'subdirectory named by the mock root.'.format(
+                     LOCAL_PACKAGE_CONFIG))
+        mockbuild_parser.add_argument(
+            '--parallel',
+            type=validate_parallel,
+            metavar='N',
+            default=2,
+            help='Maximum number of mock builds running at once with '
+                 '--all-targets. Default is 2.')
+
     # Target functions go here
+    def _upload_file_for_build(self, file, name=None):
+        """Upload a file for building, once per file content
+
+        When builds for several targets are submitted from the same SRPM,
+        path of the first upload is reused.
+        """
+        st = os.stat(file)
+        key = (os.path.abspath(file), name, st.st_size, st.st_mtime)
+        if key not in self._uploaded_files:
+            self._uploaded_files[key] = super(
+                fedpkgClient, self)._upload_file_for_build(file, name=name)
+        else:
+            self.log.debug('%s has been uploaded already to %s',
+                           file, self._uploaded_files[key])
+        return self._uploaded_files[key]
+
+    def _prefetch_on_clone(self):
+        """Check whether to prefetch source files after clone"""
+        if self.args.prefetch_sources:
+            return True
+        if not self.config.has_option(self.name, 'prefetch_sources'):
+            return False
+        try:
+            return self.config.getboolean(self.name, 'prefetch_sources')
+        except ValueError as e:
+            raise rpkgError('Invalid value of option prefetch_sources: '
+                            '{0}'.format(e))
+
+    def clone(self):
+        if self.args.clone_mode:
+            self.cmd.clone_mode = self.args.clone_mode
+        if self.args.batch:
+            return self.clone_batch()
+        if not self.args.repo:
+            raise rpkgError('Repository to clone is required.')
+        self.args.repo = [self.args.repo]
+        super(fedpkgClient, self).clone()
+
+        if self.args.branches or not self._prefetch_on_clone():
+            return
+        if not self.cmd.lookaside_store_dir:
+            self.log.warning('Source files are not prefetched, option '
+                             'lookaside_store is not configured.')
+            return
+        repo_dir = os.path.join(
+            self.cmd.path,
+            self.args.clone_target or self.cmd.get_base_repo(self.args.repo[0]))
+        self._start_prefetch(repo_dir)
+
+    def _read_batch(self, filename):
+        """Read repository names from a file, or stdin if it is -"""
+        if filename == '-':
+            lines = sys.stdin.readlines()
+        else:
+            try:
+                with open(filename, 'r') as f:
+                    lines = f.readlines()
+            except IOError as e:
+                raise rpkgError('Cannot read {0}: {1}'.format(filename, e))
+        repos = []
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#') and line not in repos:
+                repos.append(line)
+        return repos
+
+    def clone_batch(self):
+        if self.args.repo or self.args.clone_target or self.args.branch \
+                or self.args.branches:
+            raise rpkgError('--batch cannot be combined with a repository, '
+                            'target directory, --branch or --branches.')
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel clones must be greater than '
+                            'zero.')
+        if self.args.reference and not os.path.isdir(self.args.reference):
+            raise rpkgError('Reference directory {0} does not exist.'.format(
+                self.args.reference))
+        repos = self._read_batch(self.args.batch)
+        if not repos:
+            raise rpkgError('No repositories to clone.')
+        if self.args.prefetch_sources:
+            self.log.warning('Source files are not prefetched with --batch.')
+
+        def _report(repo, error):
+            if error:
+                self.log.error('Failed to clone %s: %s', repo, error)
+            else:
+                self.log.info('Cloned %s', repo)
+
+        results = self.cmd.clone_batch(
+            repos,
+            anon=self.args.anonymous,
+            depth=self.args.depth,
+            reference_dir=self.args.reference and os.path.abspath(
+                self.args.reference),
+            workers=self.args.parallel,
+            report=_report)
+        failed = [repo for repo, error in results if error]
+        print('Cloned {0} of {1} repositories.'.format(
+            len(results) - len(failed), len(results)))
+        if failed:
+            raise rpkgError('Failed to clone: {0}'.format(', '.join(failed)))
+
+    def _start_prefetch(self, repo_dir):
+        """Run prefetch-sources in a background process detached from us"""
+        log_file = os.path.join(repo_dir, '.git', 'fedpkg-prefetch.log')
+        cmd = find_me()
+        if self.args.user_config:
+            cmd += ['--user-config', self.args.user_config]
+        cmd += ['--path', repo_dir, 'prefetch-sources']
+        self.log.info('Prefetching source files in background, see %s',
+                      log_file)
+        with open(os.devnull, 'r') as devnull:
+            with open(log_file, 'a') as log:
+                subprocess.Popen(cmd, stdin=devnull, stdout=log,
+                                 stderr=subprocess.STDOUT, close_fds=True,
+                                 preexec_fn=getattr(os, 'setsid', None))
+
+    def prefetch_sources(self):
+        count = self.cmd.prefetch_sources(branches=self.args.branches)
+        self.log.info('Prefetched %d source files', count)
+
     def _format_update_clog(self, clog):
         ''' Format clog for the update template. '''
         lines = [ln for ln in clog.split('\n') if ln]
@@ -747,11 +1459,7 @@ class fedpkgClient(cliClient):
             bodhi_args['type_'] = ''
 
         try:
-            self.cmd.clog()
-            clog_file = os.path.join(self.cmd.path, 'clog')
-            with io.open(clog_file, encoding='utf-8') as f:
-                clog = f.read()
-            os.unlink(clog_file)
+            clog = self.cmd.changelog()
         except rpkgError:
             # Not an RPM, no changelog to work with
             clog = ""
@@ -910,34 +1618,11 @@ class fedpkgClient(cliClient):
             # check if tests repository does not exist already
             assert_new_tests_repo(repo_name, get_dist_git_url(anongiturl))
 
-            ticket_body = {
-                'action': 'new_repo',
-                'branch': 'master',
-                'bug_id': bug or '',
-                'monitor': 'no-monitoring',
-                'namespace': 'tests',
-                'repo': repo_name,
-                'description': description,
-            }
-        else:
-            ticket_body = {
-                'action': 'new_repo',
-                'branch': branch,
-                'bug_id': bug or '',
-                'description': description or '',
-                'exception': exception,
-                'monitor': monitor,
-                'namespace': ns,
-                'repo': repo_name,
-                'summary': summary or summary_from_bug,
-                'upstreamurl': upstreamurl or ''
-            }
-            if not initial_commit:
-                ticket_body['initial_commit'] = False
-
-        ticket_body = json.dumps(ticket_body, indent=True)
-        ticket_body = '```\n{0}\n```'.format(ticket_body)
-        ticket_title = 'New Repo for "{0}/{1}"'.format(ns, repo_name)
+        ticket_title, ticket_body = new_repo_ticket(
+            repo_name, ns, branch=branch, bug=bug, description=description,
+            summary=summary or summary_from_bug, upstreamurl=upstreamurl,
+            monitor=monitor, exception=exception,
+            initial_commit=initial_commit)
 
         pagure_section = '{0}.pagure'.format(name)
         pagure_url = config_get_safely(config, pagure_section, 'url')
@@ -1078,20 +1763,9 @@ class fedpkgClient(cliClient):
             branches = [branch]
 
         for b in sorted(list(branches), reverse=True):
-            ticket_body = {
-                'action': 'new_branch',
-                'branch': b,
-                'namespace': ns,
-                'repo': repo_name,
-                'create_git_branch': not no_git_branch
-            }
-            if service_levels:
-                ticket_body['sls'] = sl_dict
-
-            ticket_body = json.dumps(ticket_body, indent=True)
-            ticket_body = '```\n{0}\n```'.format(ticket_body)
-            ticket_title = 'New Branch "{0}" for "{1}/{2}"'.format(
-                b, ns, repo_name)
+            ticket_title, ticket_body = new_branch_ticket(
+                repo_name, ns, b, create_git_branch=not no_git_branch,
+                sls=sl_dict if service_levels else None)
 
             print(new_pagure_issue(
                 logger, pagure_url, pagure_token, ticket_title, ticket_body,
@@ -1300,6 +1974,22 @@ class fedpkgClient(cliClient):
             task_ids.append(task_id)
         return task_ids
 
+    def mockbuild(self):
+        if self.args.all_targets:
+            if self.args.root or self.args.shell:
+                raise rpkgError(
+                    'Options --root and --shell cannot be used with '
+                    '--all-targets.')
+            server_url = self.config.get('{0}.pdc'.format(self.name), 'url')
+            releases = self.read_releases_from_local_config(
+                get_release_branches(server_url))
+            if not releases:
+                raise rpkgError('No build target is configured in {0}.'
+                                .format(LOCAL_PACKAGE_CONFIG))
+            self.cmd.mockbuild_releases = releases
+            self.cmd.mockbuild_parallel = self.args.parallel
+        super(fedpkgClient, self).mockbuild()
+
     def show_releases_info(self):
         server_url = self.config.get('{0}.pdc'.format(self.name), 'url')
         releases = get_release_branches(server_url)
@@ -1318,11 +2008,382 @@ class fedpkgClient(cliClient):
             print('Fedora: {0}'.format(_join(releases['fedora'])))
             print('EPEL: {0}'.format(_join(releases['epel'])))
 
+    def show_dist_info(self):
+        branches = self.args.branches or [self.cmd.branch_merge]
+        dists = resolve_dists(branches, self.cmd.localarch,
+                              rawhide=self.cmd._findmasterbranch)
+
+        if self.args.json:
+            print(json.dumps(
+                dict((branch, dict(dist._asdict()) if dist else None)
+                     for branch, dist in dists),
+                indent=2, sort_keys=True))
+            return
+
+        for branch, dist in dists:
+            if dist is None:
+                print('{0}: unknown'.format(branch))
+                continue
+            print('{0}: {1}'.format(branch, ' '.join(
+                '{0}={1}'.format(field, getattr(dist, field))
+                for field in dist._fields)))
+
+    def show_branches_report(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel evaluations must be greater '
+                            'than zero.')
+        rows = self.cmd.branches_report(branches=self.args.branches,
+                                        workers=self.args.parallel)
+        if self.args.json:
+            print(json.dumps(rows, indent=2, sort_keys=True))
+            return
+
+        def _cell(value):
+            return '-' if value is None else str(value)
+
+        table = [('BRANCH', 'NVR', 'BEHIND', 'SOURCES')]
+        for row in rows:
+            table.append((row['branch'],
+                          row['nvr'] or 'error: {0}'.format(row['error']),
+                          _cell(row['behind']),
+                          _cell(row['sources_group'])))
+        widths = [max(len(line[i]) for line in table) for i in range(3)]
+        for line in table:
+            print('  '.join(
+                [cell.ljust(width) for cell, width in zip(line, widths)] +
+                [line[3]]))
+
+        groups = {}
+        for row in rows:
+            if row['sources_group'] is not None:
+                groups.setdefault(row['sources_group'], []).append(
+                    row['branch'])
+        shared = [(group, branches) for group, branches in sorted(groups.items())
+                  if len(branches) > 1]
+        if shared:
+            print('')
+            print('Branches with identical sources:')
+            for group, branches in shared:
+                print('  {0}: {1}'.format(group, ' '.join(branches)))
+
+    def sync_branches(self):
+        branches = self.args.branches
+        if not branches:
+            server_url = self.config.get('{0}.pdc'.format(self.name), 'url')
+            releases = get_release_branches(server_url)
+            branches = releases.get('fedora', []) + releases.get('epel', [])
+        results = self.cmd.sync_branches(branches, source=self.args.source,
+                                         push=not self.args.no_push)
+        for branch, result in results:
+            print('{0}: {1}'.format(branch, result))
+        failed = [branch for branch, result in results
+                  if result in ('not fast-forward', 'checked out')]
+        if failed:
+            raise rpkgError('Branches not synced: {0}'.format(
+                ', '.join(failed)))
+
+    def foreach(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel checkouts must be greater '
+                            'than zero.')
+        args = self.args.steps
+        if args and args[0] == '--':
+            args = args[1:]
+        steps = split_steps(args)
+        if not steps:
+            raise rpkgError('No command to run in checkouts.')
+        if 'foreach' in [step[0] for step in steps]:
+            raise rpkgError('Command foreach cannot be nested.')
+
+        paths = find_checkouts(self.args.path, max_depth=self.args.depth)
+        if not paths:
+            raise rpkgError('No package checkouts found in {0}'.format(
+                self.args.path))
+        # Catch mistakes in the commands before running them anywhere
+        for step in steps:
+            self.parser.parse_args(['--path', paths[0]] + step)
+
+        def _report(path, error, output):
+            print('==> {0} <=='.format(path))
+            if output:
+                print(output.rstrip('\n'))
+            if error:
+                print('FAILED: {0}'.format(error))
+
+        results = run_foreach(self, paths, steps, self.args.parallel,
+                              report=_report)
+        failed = sorted((path, error) for path, error, output in results
+                        if error)
+        print('')
+        print('{0} of {1} checkouts succeeded.'.format(
+            len(results) - len(failed), len(results)))
+        for path, error in failed:
+            print('  {0}: {1}'.format(path, error))
+        if failed:
+            raise rpkgError('{0} checkouts failed.'.format(len(failed)))
+
+    def ws_update(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel evaluations must be greater '
+                            'than zero.')
+        root = os.path.abspath(self.args.path)
+        paths = find_checkouts(root, max_depth=self.args.depth)
+
+        def _commands(path):
+            # Commands are loaded from --path, point it to each checkout
+            self.args.path = path
+            self._cmd = None
+            return self.cmd
+
+        index = WorkspaceIndex(get_cache_dir('workspace.sqlite'))
+        try:
+            refreshed, unchanged, failed, removed = index.update(
+                root, paths, _commands, workers=self.args.parallel)
+        finally:
+            index.close()
+            self.args.path = root
+            self._cmd = None
+        print('Indexed {0} checkouts: {1} refreshed, {2} unchanged, '
+              '{3} failed, {4} removed.'.format(
+                  len(paths), refreshed, unchanged, failed, removed))
+        if failed:
+            raise rpkgError('{0} checkouts could not be indexed.'.format(
+                failed))
+
+    def ws_query(self):
+        index = WorkspaceIndex(get_cache_dir('workspace.sqlite'))
+        try:
+            rows = index.query(name=self.args.name,
+                               namespace=self.args.namespace,
+                               branch=self.args.branch,
+                               nvr=self.args.nvr,
+                               hash=self.args.hash,
+                               head_only=self.args.head)
+        finally:
+            index.close()
+        if self.args.json:
+            print(json.dumps(rows, indent=2, sort_keys=True))
+            return
+
+        table = [('PATH', 'BRANCH', 'NVR')]
+        for row in rows:
+            table.append((row['path'],
+                          row['branch'] + (' *' if row['head'] else ''),
+                          row['nvr'] or 'error: {0}'.format(row['error'])))
+        widths = [max(len(line[i]) for line in table) for i in range(2)]
+        for line in table:
+            print('  '.join(
+                [cell.ljust(width) for cell, width in zip(line, widths)] +
+                [line[2]]))
+
+    def mass_rebuild(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel evaluations must be greater '
+                            'than zero.')
+        root = os.path.abspath(self.args.path)
+        state_file = self.args.state or os.path.join(root,
+                                                     'fedpkg-rebuild.json')
+        root_cmd = self.cmd
+
+        override = None
+        if self.args.override:
+            check_bodhi_version()
+            bodhi_config = self._get_bodhi_config()
+
+            def _override(nvr):
+                root_cmd.create_buildroot_override(
+                    bodhi_config, build=nvr,
+                    duration=self.args.override_duration,
+                    notes='Rebuild of dependent packages')
+            override = _override
+
+        def _commands(path):
+            # Commands are loaded from --path, point it to each checkout
+            self.args.path = path
+            self._cmd = None
+            return self.cmd
+
+        state = None if self.args.restart else RebuildState.load(state_file)
+        session = root_cmd.anon_kojisession if self.args.dry_run \
+            else root_cmd.kojisession
+        scheduler = RebuildScheduler(
+            session, _commands, state or RebuildState(state_file),
+            side_tag=self.args.side_tag, override=override,
+            report=print, workers=self.args.parallel)
+        try:
+            if state is None:
+                paths = find_checkouts(root, max_depth=self.args.depth)
+                if not paths:
+                    raise rpkgError(
+                        'No package checkouts found in {0}'.format(root))
+                scheduler.plan(paths, workers=self.args.parallel)
+            else:
+                print('Continuing rebuild from {0}'.format(state_file))
+            if self.args.dry_run:
+                packages = scheduler.state.packages
+                for index, wave in enumerate(scheduler.state.waves):
+                    print('Wave {0}: {1}'.format(index + 1, ' '.join(
+                        packages[path]['nvr'] for path in wave)))
+                return
+            scheduler.run()
+        finally:
+            self.args.path = root
+            self._cmd = root_cmd
+        print('All {0} packages are built.'.format(
+            len(scheduler.state.packages)))
+
+    def mass_build(self):
+        root = os.path.abspath(self.args.path)
+        paths = [os.path.abspath(path) for path in self.args.checkouts] or \
+            find_checkouts(root, max_depth=self.args.depth)
+        if not paths:
+            raise rpkgError('No package checkouts found in {0}'.format(root))
+        root_cmd = self.cmd
+        session = root_cmd.kojisession
+
+        # GitPython and spec evaluation run here, Koji is called in bulk
+        builds = []
+        try:
+            for path in paths:
+                build = {'path': path, 'nvr': None}
+                builds.append(build)
+                self.args.path = path
+                self._cmd = None
+                cmd = self.cmd
+                cmd._kojisession = session
+                try:
+                    cmd.check_repo()
+                    build.update(nvr=cmd.nvr,
+                                 url=cmd.construct_build_url(),
+                                 target=self.args.target or cmd.target)
+                except (rpkgError, git.GitError) as e:
+                    build['error'] = str(e)
+        finally:
+            self.args.path = root
+            self._cmd = root_cmd
+
+        opts = {}
+        if self.args.scratch:
+            opts['scratch'] = True
+        if self.args.fail_fast:
+            opts['fail_fast'] = True
+        submit_builds(session, builds, opts=opts,
+                      priority=5 if self.args.background else None,
+                      nvr_check=self.args.nvr_check and not self.args.scratch)
+
+        table = [('CHECKOUT', 'NVR', 'TASK')]
+        for build in builds:
+            table.append((build['path'], build['nvr'] or '-',
+                          str(build['task_id']) if build.get('task_id')
+                          else 'error: {0}'.format(build['error'])))
+        widths = [max(len(line[i]) for line in table) for i in range(2)]
+        for line in table:
+            print('  '.join(
+                [cell.ljust(width) for cell, width in zip(line, widths)] +
+                [line[2]]))
+        failed = [build for build in builds if build.get('error')]
+        print('')
+        print('Submitted {0} of {1} builds.'.format(
+            len(builds) - len(failed), len(builds)))
+        if failed:
+            raise rpkgError('{0} builds were not submitted.'.format(
+                len(failed)))
+
+    def _onboard_packages(self):
+        entries = list(self.args.packages)
+        if self.args.batch:
+            entries.extend(self._read_batch(self.args.batch))
+        packages = []
+        for entry in entries:
+            parts = re.split(r'[:\s]+', entry.strip())
+            if len(parts) != 2 or not parts[1].isdigit():
+                raise rpkgError('Invalid package {0}, expected NAME:BUG.'
+                                .format(entry))
+            packages.append((parts[0], int(parts[1])))
+        if not packages:
+            raise rpkgError('No packages to onboard.')
+        return packages
+
+    def _onboard_branches(self):
+        """Return branches to request, checked against release branches"""
+        if not self.args.onboard_branches:
+            return []
+        pdc_url = self.config.get('{0}.pdc'.format(self.name), 'url')
+        release_branches = list(itertools.chain(
+            *list(get_release_branches(pdc_url).values())))
+        branches = []
+        for branch in self.args.onboard_branches:
+            if branch not in release_branches:
+                raise rpkgError('{0} is not a release branch.'.format(branch))
+            if branch not in branches:
+                branches.append(branch)
+            # Same as request-branch, epel8 and later come with playground
+            match = re.match(r'^epel(\d+)$', branch)
+            if match and int(match.group(1)) >= 8:
+                branches.append(branch + '-playground')
+        return branches
+
+    def onboard(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel onboardings must be greater '
+                            'than zero.')
+        packages = self._onboard_packages()
+        branches = self._onboard_branches()
+        pagure_section = '{0}.pagure'.format(self.name)
+        pagure_url = config_get_safely(self.config, pagure_section, 'url')
+        pagure_token = config_get_safely(self.config, pagure_section, 'token')
+
+        clone = None
+        if self.args.onboard_clone:
+            root = os.path.abspath(self.args.path)
+            cmd = self.cmd
+
+            def _clone(repo):
+                for _, error in cmd.clone_batch([repo], path=root):
+                    if error:
+                        raise rpkgError(error)
+
+            clone = _clone
+
+        onboarding = Onboarding(
+            self.name,
+            self.config.get('{0}.bugzilla'.format(self.name), 'url'),
+            pagure_url,
+            pagure_token,
+            branches,
+            clone=clone,
+            dist_git_url=get_dist_git_url(self.cmd.anongiturl)
+            if self.args.tests else None,
+            workers=self.args.parallel,
+            timeout=self.args.timeout * 3600,
+            report=self.log.info)
+        results = onboarding.run(packages)
+
+        table = [('NAME', 'REPOSITORY REQUEST', 'STATUS')]
+        for package in results:
+            table.append((package['name'], package['repo_ticket'] or '-',
+                          'error: {0}'.format(package['error'])
+                          if package['error'] else 'onboarded'))
+        widths = [max(len(line[i]) for line in table) for i in range(2)]
+        for line in table:
+            print('  '.join(
+                [cell.ljust(width) for cell, width in zip(line, widths)] +
+                [line[2]]))
+        failed = [package for package in results if package['error']]
+        print('')
+        print('Onboarded {0} of {1} packages.'.format(
+            len(results) - len(failed), len(results)))
+        if failed:
+            raise rpkgError('{0} packages were not onboarded.'.format(
+                len(failed)))
+
     def retire(self):
         """
         Runs the rpkg retire command after check. Check includes reading the state
         of Fedora release.
         """
+        if self.args.batch:
+            return self.retire_batch()
         # Allow retiring in epel
         if is_epel(self.cmd.branch_merge):
             super(fedpkgClient, self).retire()
@@ -1335,3 +2396,127 @@ class fedpkgClient(cliClient):
             else:
                 self.log.error("Fedora release (%s) is in state '%s' - retire operation "
                                "is not allowed." % (self.cmd.branch_merge, state))
+
+    def _retire_checkouts(self, root, entries):
+        """Return checkouts of packages to retire, cloning missing ones"""
+        paths = []
+        missing = []
+        for entry in entries:
+            if os.path.isdir(entry):
+                paths.append(os.path.abspath(entry))
+                continue
+            path = os.path.join(root, self.cmd.get_base_repo(entry))
+            paths.append(path)
+            if not os.path.isdir(path):
+                missing.append(entry)
+        if missing:
+            results = self.cmd.clone_batch(missing, path=root,
+                                           workers=self.args.parallel)
+            failed = [repo for repo, error in results if error]
+            if failed:
+                raise rpkgError('Failed to clone: {0}'.format(
+                    ', '.join(failed)))
+        return paths
+
+    def retire_batch(self):
+        if self.args.parallel <= 0:
+            raise rpkgError('Number of parallel retirements must be greater '
+                            'than zero.')
+        root = os.path.abspath(self.args.path)
+        entries = self._read_batch(self.args.batch)
+        if not entries:
+            raise rpkgError('No packages to retire.')
+        paths = self._retire_checkouts(root, entries)
+
+        refused = []
+        candidates = []
+        root_cmd = self.cmd
+        try:
+            for path in paths:
+                self.args.path = path
+                self._cmd = None
+                cmd = self.cmd
+                if os.path.isfile(os.path.join(path, 'dead.package')) or \
+                        os.path.isfile(os.path.join(path, 'dead.module')):
+                    refused.append((path, 'already retired'))
+                    continue
+                try:
+                    if cmd.ns in cmd.block_retire_ns:
+                        raise rpkgError('retirement not allowed in the {0} '
+                                        'namespace'.format(cmd.ns))
+                    candidates.append((path, cmd, cmd.branch_merge))
+                except (rpkgError, git.GitError) as e:
+                    refused.append((path, str(e)))
+        finally:
+            self.args.path = root
+            self._cmd = root_cmd
+
+        # Every distinct release is looked up in Bodhi once
+        releases = sorted(set(release for path, cmd, release in candidates
+                              if not is_epel(release)))
+
+        def _state(release):
+            try:
+                return release, get_fedora_release_state(
+                    self.config, self.name, release), None
+            except rpkgError as e:
+                return release, None, str(e)
+
+        states = {}
+        if releases:
+            pool = ThreadPool(min(self.args.parallel, len(releases)))
+            try:
+                for release, state, error in pool.map(_state, releases):
+                    states[release] = (state, error)
+            finally:
+                pool.close()
+                pool.join()
+
+        allowed = []
+        for path, cmd, release in candidates:
+            state, error = states.get(release, (None, None))
+            # Allow retiring in Rawhide and Branched until Final Freeze
+            if error:
+                refused.append((path, error))
+            elif state is not None and state != 'pending':
+                refused.append((path, "Fedora release ({0}) is in state '{1}'"
+                                      .format(release, state)))
+            else:
+                allowed.append((path, cmd))
+
+        if self.oidc_configured:
+            extra_config = {
+                'credential.helper': ' '.join(find_me() + ['gitcred']),
+                'credential.useHttpPath': 'true'}
+        else:
+            extra_config = {}
+
+        def _retire(item):
+            path, cmd = item
+            try:
+                cmd.retire(self.args.reason)
+                cmd.push(False, extra_config)
+            except (rpkgError, git.GitError, OSError) as e:
+                return path, str(e)
+            return path, None
+
+        failed = []
+        if allowed:
+            pool = ThreadPool(min(self.args.parallel, len(allowed)))
+            try:
+                failed = [(path, error) for path, error
+                          in pool.map(_retire, allowed) if error]
+            finally:
+                pool.close()
+                pool.join()
+
+        print('Retired {0} of {1} packages.'.format(
+            len(allowed) - len(failed), len(paths)))
+        for title, items in (('Refused', refused), ('Failed', failed)):
+            if items:
+                print('{0}:'.format(title))
+                for path, error in sorted(items):
+                    print('  {0}: {1}'.format(path, error))
+        if refused or failed:
+            raise rpkgError('{0} packages were not retired.'.format(
+                len(refused) + len(failed)))
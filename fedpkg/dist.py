@@ -0,0 +1,149 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Resolve dist values of Fedora dist-git branches
+
+Branch names are matched against a table of precompiled rules rather than a
+chain of regular expressions, and the results are memoized per branch, so
+that resolving many branches at once stays cheap.
+"""
+
+
+import collections
+import re
+
+from pyrpkg import rpkgError
+
+DistInfo = collections.namedtuple(
+    'DistInfo',
+    ['distval', 'distvar', 'disttag', 'mockconfig', 'override', 'distunset'])
+
+# Each rule is a tuple of (regex, distvar, disttag, mockconfig, override,
+# distunset). Templates are expanded with distval and arch. The regex captures
+# distval, except the one of master whose distval is the rawhide version.
+# We only match the top level branch name exactly. Anything else is too
+# dangerous and --dist should be used.
+DIST_RULES = [
+    (re.compile(r'f(?P<distval>\d{2,})$'),
+     'fedora', 'fc%(distval)s', 'fedora-%(distval)s-%(arch)s',
+     'f%(distval)s-override', 'rhel'),
+    # Works until RHEL 10
+    (re.compile(r'(?:el|epel)(?P<distval>\d)$'),
+     'rhel', 'el%(distval)s', 'epel-%(distval)s-%(arch)s',
+     'epel%(distval)s-override', 'fedora'),
+    (re.compile(r'epel(?P<distval>\d+)-playground$'),
+     'rhel', 'epel%(distval)s.playground', 'epel-%(distval)s-%(arch)s',
+     'epel%(distval)s-override', 'fedora'),
+    (re.compile(r'olpc(?P<distval>\d)$'),
+     'olpc', 'olpc%(distval)s', None,
+     'dist-olpc%(distval)s-override', 'rhel'),
+    (re.compile(r'master$'),
+     'fedora', 'fc%(distval)s', 'fedora-rawhide-%(arch)s',
+     None, 'rhel'),
+]
+
+# Memoized DistInfo of branches not depending on rawhide, keyed by
+# (branch, arch).
+_resolved = {}
+
+
+def _expand(template, values):
+    return template % values if template else template
+
+
+def is_release_branch(branch):
+    """Check whether a branch is a release branch, e.g. f30, epel8, master
+
+    :param str branch: branch name.
+    :rtype: bool
+    """
+    return any(rule[0].match(branch) for rule in DIST_RULES)
+
+
+def resolve_dist(branch, arch, rawhide=None):
+    """Resolve dist values of a branch
+
+    :param str branch: branch name, e.g. f30, epel8, master.
+    :param str arch: local architecture used in the mock config name.
+    :param rawhide: a callable returning the rawhide release version. It is
+        only called when branch is master.
+    :return: the dist values of the branch.
+    :rtype: DistInfo
+    :raises rpkgError: if the branch does not match any rule, or branch is
+        master and rawhide is not given.
+    """
+    try:
+        return _resolved[(branch, arch)]
+    except KeyError:
+        pass
+
+    for regex, distvar, disttag, mockconfig, override, distunset in DIST_RULES:
+        match = regex.match(branch)
+        if match:
+            break
+    else:
+        raise rpkgError('Could not find the release/dist from branch name '
+                        '%s\nPlease specify with --release' % branch)
+
+    values = match.groupdict()
+    cacheable = 'distval' in values
+    if not cacheable:
+        if rawhide is None:
+            raise rpkgError('Unable to find rawhide target')
+        values['distval'] = rawhide()
+    values['arch'] = arch
+
+    info = DistInfo(distval=values['distval'],
+                    distvar=distvar,
+                    disttag=_expand(disttag, values),
+                    mockconfig=_expand(mockconfig, values),
+                    override=_expand(override, values),
+                    distunset=distunset)
+    if cacheable:
+        _resolved[(branch, arch)] = info
+    return info
+
+
+def resolve_dists(branches, arch, rawhide=None):
+    """Resolve dist values of a batch of branches
+
+    Unlike :func:`resolve_dist`, unknown branches do not raise an error, and
+    rawhide is called at most once for the whole batch. Errors of rawhide
+    are raised, so that master is not taken for an unknown branch when the
+    rawhide release cannot be found.
+
+    :param branches: branch names to resolve.
+    :type branches: list[str]
+    :param str arch: local architecture used in the mock config name.
+    :param rawhide: a callable returning the rawhide release version.
+    :return: list of pairs of branch name and its DistInfo, or None if the
+        branch is unknown. Duplicate branches are resolved once and the order
+        of branches is kept.
+    :rtype: list[tuple]
+    :raises rpkgError: if the rawhide release cannot be found.
+    """
+    rawhide_version = []
+
+    def _rawhide():
+        if not rawhide_version:
+            rawhide_version.append(rawhide())
+        return rawhide_version[0]
+
+    result = []
+    seen = set()
+    for branch in branches:
+        if branch in seen:
+            continue
+        seen.add(branch)
+        dist = None
+        if is_release_branch(branch):
+            dist = resolve_dist(
+                branch, arch, rawhide=_rawhide if rawhide else None)
+        result.append((branch, dist))
+    return result
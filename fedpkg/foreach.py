@@ -0,0 +1,192 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Run fedpkg commands across many package checkouts
+
+Commands run in a pool of worker processes forked from the fedpkg process, so
+that the config is read and the command line parser is built once. Each worker
+reuses the forked client for every checkout it processes, and passes Koji
+sessions from one checkout to the next, so that it logs in once.
+"""
+
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import six
+from pyrpkg import rpkgError
+
+# Separator of commands run in each checkout, e.g. pull ; sources
+STEP_SEPARATOR = ';'
+
+# Commands attributes holding sessions reused across checkouts
+SESSION_ATTRS = ('_kojisession', '_anon_kojisession')
+
+# Client forked into the worker process, set by _init_worker
+_client = None
+# Sessions created in the worker process, keyed by SESSION_ATTRS
+_sessions = {}
+
+
+def split_steps(argv):
+    """Split command line into commands separated by STEP_SEPARATOR
+
+    :param argv: command line arguments, e.g. ['pull', ';', 'sources'].
+    :type argv: list[str]
+    :return: list of commands, each as a list of arguments. Empty commands
+        are dropped.
+    :rtype: list[list[str]]
+    """
+    steps = [[]]
+    for arg in argv:
+        if arg == STEP_SEPARATOR:
+            steps.append([])
+        else:
+            steps[-1].append(arg)
+    return [step for step in steps if step]
+
+
+def _run_step(client, path, step):
+    """Run one fedpkg command in a checkout with the client"""
+    client.args = client.parser.parse_args(['--path', path] + step)
+    client._cmd = None
+    cmd = client.cmd
+    for attr in SESSION_ATTRS:
+        if _sessions.get(attr) and not getattr(cmd, attr, None):
+            setattr(cmd, attr, _sessions[attr])
+    try:
+        return client.args.command()
+    finally:
+        for attr in SESSION_ATTRS:
+            if getattr(cmd, attr, None):
+                _sessions[attr] = getattr(cmd, attr)
+
+
+def _text_stream(fd):
+    """Return text stream writing to a file descriptor, leaving it open"""
+    if six.PY2:
+        return os.fdopen(os.dup(fd), 'w', 1)
+    return io.open(fd, 'w', 1, encoding='utf-8', errors='replace',
+                   closefd=False)
+
+
+@contextlib.contextmanager
+def _redirected_output(f):
+    """Redirect stdout and stderr at file descriptor level into f
+
+    Output of subprocesses, e.g. git and rpm, is captured as well.
+    sys.stdout and sys.stderr are replaced too, since they might not write
+    to the file descriptors, e.g. when replaced by a test runner.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    saved_streams = sys.stdout, sys.stderr
+    os.dup2(f.fileno(), 1)
+    os.dup2(f.fileno(), 2)
+    sys.stdout = _text_stream(1)
+    sys.stderr = _text_stream(2)
+    try:
+        yield
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.close()
+            except (IOError, OSError, ValueError):
+                pass
+        sys.stdout, sys.stderr = saved_streams
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved:
+            os.close(fd)
+
+
+def _run_checkout(task):
+    """Run commands in a checkout, stopping at the first failure
+
+    :return: tuple of path, error message or None, and captured output.
+    """
+    path, steps = task
+    error = None
+    with tempfile.TemporaryFile() as output:
+        with _redirected_output(output):
+            try:
+                for step in steps:
+                    rv = _run_step(_client, path, step)
+                    if rv:
+                        raise rpkgError('{0} exited with status {1}'.format(
+                            step[0], rv))
+            except SystemExit as e:
+                # Raised by argparse and by commands calling sys.exit
+                if e.code:
+                    error = 'exited with status {0}'.format(e.code)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+        output.seek(0)
+        text = output.read().decode('utf-8', 'replace')
+    return path, error, text
+
+
+def _init_worker(client):
+    """Set the client used by a worker process for all its checkouts"""
+    global _client
+    _client = client
+    _sessions.clear()
+
+
+def _fork_pool(processes, client):
+    """Return pool of processes forked with the client
+
+    The client holds the parser and config which cannot be pickled, so the
+    workers must be forked whatever the default start method is.
+    """
+    get_context = getattr(multiprocessing, 'get_context', None)
+    # Python 2 always forks
+    context = get_context('fork') if get_context else multiprocessing
+    return context.Pool(processes, initializer=_init_worker,
+                        initargs=(client,))
+
+
+def run_foreach(client, paths, steps, workers, report=None):
+    """Run commands in checkouts by a pool of worker processes
+
+    :param client: the fedpkg client forked into workers. Its config and
+        parser are reused for all checkouts.
+    :type client: fedpkgClient
+    :param paths: paths to checkouts.
+    :type paths: list[str]
+    :param steps: commands to run in each checkout in order, as returned from
+        :func:`split_steps`.
+    :type steps: list[list[str]]
+    :param int workers: maximum number of checkouts processed at once.
+    :param report: optional callable called with path, error and output of
+        each checkout as soon as it is done.
+    :return: list of tuples of path, error message or None, and output, in
+        the order checkouts were done.
+    :rtype: list[tuple]
+    """
+    results = []
+    pool = _fork_pool(max(1, min(workers, len(paths))), client)
+    try:
+        for result in pool.imap_unordered(
+                _run_checkout, [(path, steps) for path in paths]):
+            results.append(result)
+            if report is not None:
+                report(*result)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
@@ -0,0 +1,191 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Hash source files
+
+Source files are hashed whenever they are downloaded, verified or uploaded.
+Large files are read through mmap, several files are hashed in parallel, and
+digests are cached by path, inode, size and modification time, so unchanged
+files are not hashed again by later commands.
+"""
+
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+from pyrpkg.errors import InvalidHashType
+
+# Files of at least this size are read through mmap
+MMAP_MIN_SIZE = 1024 * 1024
+
+# A file modified this recently might be modified again within the
+# granularity of its modification time, so its digest is not cached.
+RACY_PERIOD = 2
+
+
+def hash_file(filename, hashtype):
+    """Compute the hash of a file
+
+    :param str filename: path to the file.
+    :param str hashtype: the hash algorithm, e.g. sha512.
+    :return: the hex digest.
+    :rtype: str
+    :raises InvalidHashType: if hashtype is not supported.
+    """
+    try:
+        sum = hashlib.new(hashtype)
+    except ValueError:
+        raise InvalidHashType(hashtype)
+
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_MIN_SIZE:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                sum.update(m)
+            finally:
+                m.close()
+        else:
+            sum.update(f.read())
+    return sum.hexdigest()
+
+
+class HashCache(object):
+    """Cache of digests of files keyed by path and file status
+
+    Device, inode, size and mtime of a file must match its cached status.
+    A changed ctime invalidates the digest only within RACY_PERIOD of the
+    change. That catches a file just rewritten by a tool restoring its
+    mtime, while files hardlinked from the local lookaside store, whose
+    ctime changes whenever another checkout links them, are not hashed
+    again and again.
+
+    :param str cache_file: JSON file to persist the cache in. If it is None,
+        digests are cached in memory only.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries = None
+        self._changed = False
+
+    @property
+    def entries(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries
+
+    def _load(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, 'r') as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    @staticmethod
+    def _stat_key(st):
+        return [st.st_dev, st.st_ino, st.st_size, st.st_mtime]
+
+    def get(self, filename, hashtype):
+        """Get cached digest of a file
+
+        :return: the digest, or None if the file changed since it was cached
+            or it is not cached at all.
+        :rtype: str
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        entry = self.entries.get(os.path.abspath(filename))
+        if not entry or entry['stat'] != self._stat_key(st):
+            return None
+        if (entry.get('ctime') != st.st_ctime and
+                time.time() - st.st_ctime < RACY_PERIOD):
+            return None
+        return entry['hashes'].get(hashtype)
+
+    def set(self, filename, hashtype, digest):
+        """Cache digest of a file in its current state"""
+        st = os.stat(filename)
+        if time.time() - st.st_mtime < RACY_PERIOD:
+            return
+        path = os.path.abspath(filename)
+        stat_key = self._stat_key(st)
+        entries = self.entries
+        with self._lock:
+            entry = entries.get(path)
+            if (not entry or entry['stat'] != stat_key or
+                    entry.get('ctime') != st.st_ctime):
+                entry = entries[path] = {'stat': stat_key,
+                                         'ctime': st.st_ctime, 'hashes': {}}
+            entry['hashes'][hashtype] = digest
+            self._changed = True
+
+    def hash_file(self, filename, hashtype):
+        """Return digest of a file, computing it only if it is not cached"""
+        digest = self.get(filename, hashtype)
+        if digest is None:
+            digest = hash_file(filename, hashtype)
+            self.set(filename, hashtype, digest)
+        return digest
+
+    def hash_files(self, filenames, hashtype, workers=4):
+        """Return digests of files, hashing those not cached in parallel
+
+        :param filenames: paths to the files.
+        :type filenames: list[str]
+        :param int workers: how many files are hashed at once.
+        :return: digests in the same order as filenames.
+        :rtype: list[str]
+        """
+        workers = min(workers, len(filenames))
+        if workers <= 1:
+            return [self.hash_file(filename, hashtype)
+                    for filename in filenames]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(lambda filename: self.hash_file(filename, hashtype),
+                            filenames)
+        finally:
+            pool.close()
+            pool.join()
+
+    def save(self):
+        """Write cached digests of existing files to the cache file
+
+        Failures to write the cache file are ignored.
+        """
+        if not self.cache_file or not self._changed:
+            return
+        with self._lock:
+            entries = dict((path, entry) for path, entry in self._entries.items()
+                           if os.path.exists(path))
+            self._changed = False
+        try:
+            # Write to a temporary file and rename, so that concurrent fedpkg
+            # processes never read a partially written cache.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.cache_file), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp_path, self.cache_file)
+        except (IOError, OSError):
+            pass
@@ -14,13 +14,1253 @@ download path.
 """
 
 
+import contextlib
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.dummy import Pool as ThreadPool
+
+import pycurl
+import six
+from pyrpkg.errors import (DownloadError, InvalidHashType, UploadError,
+                           rpkgError)
 from pyrpkg.lookaside import CGILookasideCache
 
+from .hashing import hash_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request cloning a whole file on Linux filesystems supporting reflinks,
+# e.g. btrfs and XFS.
+FICLONE = 0x40049409
+
+log = logging.getLogger(__name__)
+
+
+def clone_file(src, dst):
+    """Make dst a copy of src sharing its data blocks (reflink)
+
+    :raises OSError: or IOError if the filesystem does not support reflinks.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported')
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                os.unlink(dst)
+                raise
+
+
+@contextlib.contextmanager
+def _locked(lock_file):
+    """Hold an exclusive lock of lock_file shared with other processes
+
+    The lock file is left behind, removing it would race with processes
+    waiting for the lock.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(lock_file, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _segmentable_size(headers):
+    """Return size of a file from headers of a response to its download
+
+    :param headers: lines of headers of a response to a GET request.
+    :type headers: list[bytes]
+    :return: size of the file in bytes, or None if it is unknown or the
+        server does not accept range requests.
+    :rtype: int
+    """
+    if not headers or not re.match(br'HTTP/\S+\s+200\b', headers[0]):
+        return None
+    size = None
+    accept_ranges = False
+    for line in headers[1:]:
+        line = line.lower()
+        match = re.match(br'content-length:\s*(\d+)', line)
+        if match:
+            size = int(match.group(1))
+        elif re.match(br'accept-ranges:\s*bytes', line):
+            accept_ranges = True
+    return size if accept_ranges and size else None
+
+
+class LocalLookasideStore(object):
+    """Local store of source files shared by all package checkouts
+
+    Files are addressed by hash type and hash, so a file is downloaded once
+    no matter how many checkouts or branches refer to it. Each entry is a
+    directory holding the file, and modification time of the directory tells
+    when the entry was used last. Least recently used entries are evicted
+    when total size exceeds max_size bytes.
+
+    Files are put in the store by renaming them into place, so concurrent
+    fedpkg processes never see a partial file. They are read-only, because
+    checkouts may hardlink them.
+
+    :param str store_dir: directory of the store.
+    :param int max_size: maximum size of all stored files in bytes.
+    """
+
+    def __init__(self, store_dir, max_size):
+        self.store_dir = store_dir
+        self.max_size = max_size
+
+    def _entry_dir(self, hashtype, hash):
+        return os.path.join(self.store_dir, hashtype, hash)
+
+    def path(self, hashtype, hash):
+        """Return path of a file in the store, regardless it exists"""
+        return os.path.join(self._entry_dir(hashtype, hash), 'data')
+
+    def get(self, hashtype, hash):
+        """Get path of a stored file and mark it as recently used
+
+        :return: path to the stored file, or None if it is not stored.
+        :rtype: str
+        """
+        path = self.path(hashtype, hash)
+        if not os.path.isfile(path):
+            return None
+        try:
+            os.utime(self._entry_dir(hashtype, hash), None)
+        except OSError:
+            pass
+        return path
+
+    def mkstemp(self):
+        """Create a temporary file in the store to download a file into
+
+        Being on the same filesystem, it could be added by :meth:`add`
+        without copying.
+
+        :return: path to the temporary file.
+        :rtype: str
+        """
+        if not os.path.isdir(self.store_dir):
+            try:
+                os.makedirs(self.store_dir)
+            except OSError as e:
+                # Created by another process meanwhile
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, path = tempfile.mkstemp(dir=self.store_dir, prefix='.tmp-')
+        os.close(fd)
+        return path
+
+    def partial_path(self, hashtype, hash):
+        """Return path prefix of partially downloaded segments of a file
+
+        Unlike :meth:`mkstemp`, the path is stable, so that an interrupted
+        download could be resumed by a later fedpkg run.
+        """
+        return os.path.join(self.store_dir,
+                            '.partial-{0}-{1}'.format(hashtype, hash))
+
+    def add(self, hashtype, hash, filename):
+        """Move a verified file into the store and evict old entries
+
+        :param str filename: path to the file created by :meth:`mkstemp`.
+        :return: path to the stored file.
+        :rtype: str
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.store_dir, prefix='.tmp-')
+        os.chmod(filename, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(filename, os.path.join(tmp_dir, 'data'))
+        entry_dir = self._entry_dir(hashtype, hash)
+        try:
+            if not os.path.isdir(os.path.dirname(entry_dir)):
+                os.makedirs(os.path.dirname(entry_dir))
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Entry has been added by another process meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=entry_dir)
+        return self.path(hashtype, hash)
+
+    def link(self, path, outfile):
+        """Make outfile the stored file at path
+
+        A reflink is preferred, so that the checkout gets an independent
+        writable file. Otherwise, the file is hardlinked, and copied as the
+        last resort, e.g. when the store is on another filesystem.
+
+        :raises OSError: if the stored file does not exist anymore.
+        """
+        if os.path.lexists(outfile):
+            os.unlink(outfile)
+        try:
+            clone_file(path, outfile)
+        except (IOError, OSError):
+            try:
+                os.link(path, outfile)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    raise
+                shutil.copyfile(path, outfile)
+        os.chmod(outfile, 0o644)
+        st = os.stat(path)
+        os.utime(outfile, (st.st_mtime, st.st_mtime))
+
+    def _entries(self):
+        """Return list of (last use, size, entry_dir) of all stored files"""
+        entries = []
+        for hashtype in os.listdir(self.store_dir):
+            hashtype_dir = os.path.join(self.store_dir, hashtype)
+            if hashtype.startswith('.') or not os.path.isdir(hashtype_dir):
+                continue
+            for hash in os.listdir(hashtype_dir):
+                entry_dir = os.path.join(hashtype_dir, hash)
+                try:
+                    size = os.stat(os.path.join(entry_dir, 'data')).st_size
+                    entries.append((os.stat(entry_dir).st_mtime, size,
+                                    entry_dir))
+                except OSError:
+                    continue
+        return entries
+
+    def evict(self, keep=None):
+        """Remove least recently used entries exceeding the size limit
+
+        :param str keep: entry directory which is never evicted, e.g. the one
+            just added, even if it alone exceeds the limit.
+        """
+        try:
+            entries = sorted(self._entries(), reverse=True)
+        except OSError:
+            return
+        total_size = 0
+        for mtime, size, entry_dir in entries:
+            total_size += size
+            if total_size > self.max_size and entry_dir != keep:
+                log.debug('Evict %s from local lookaside store', entry_dir)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+
+class MirrorStats(object):
+    """Measured latency and throughput of lookaside cache mirrors
+
+    Stats are kept in memory and, when stats_file is given, in a JSON file
+    shared by fedpkg runs. A mirror is probed again once its latency is older
+    than probe_interval seconds. A mirror which failed is considered unhealthy
+    for failure_timeout seconds. Methods are thread-safe.
+
+    :param str stats_file: path to the JSON file holding the stats.
+    :param int probe_interval: how long the latency is valid in seconds.
+    :param int failure_timeout: how long a failed mirror is avoided in
+        seconds.
+    """
+
+    # Mirrors are compared by the estimated time of downloading a file of
+    # this size in bytes.
+    TYPICAL_SIZE = 10 * 1024 * 1024
+    # Throughput of smaller transfers is dominated by latency, it is not
+    # recorded.
+    MIN_TRANSFER_SIZE = 1024 * 1024
+
+    def __init__(self, stats_file=None, probe_interval=3600,
+                 failure_timeout=600):
+        self.stats_file = stats_file
+        self.probe_interval = probe_interval
+        self.failure_timeout = failure_timeout
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._changed = False
+        if stats_file:
+            try:
+                with open(stats_file, 'r') as f:
+                    stats = json.load(f)
+                if isinstance(stats, dict):
+                    self._stats = stats
+            except (IOError, OSError, ValueError):
+                pass
+
+    def _entry(self, url):
+        self._changed = True
+        return self._stats.setdefault(url, {})
+
+    def needs_probe(self, url):
+        """Check whether latency of a mirror is unknown or outdated"""
+        with self._lock:
+            probed = self._stats.get(url, {}).get('probed', 0)
+        return time.time() - probed > self.probe_interval
+
+    def record_probe(self, url, latency):
+        """Record result of probing a mirror
+
+        :param str url: base URL of the mirror.
+        :param float latency: response time in seconds, or None if the mirror
+            did not respond properly.
+        """
+        with self._lock:
+            entry = self._entry(url)
+            entry['probed'] = time.time()
+            if latency is None:
+                entry['failed'] = entry['probed']
+            else:
+                entry['latency'] = latency
+                entry.pop('failed', None)
+
+    def record_transfer(self, url, size, seconds):
+        """Record a successful download from a mirror
+
+        Throughput is a moving average, so that a single slow transfer does
+        not push a mirror to the end.
+        """
+        with self._lock:
+            entry = self._entry(url)
+            entry.pop('failed', None)
+            if size < self.MIN_TRANSFER_SIZE or seconds <= 0:
+                return
+            throughput = size / float(seconds)
+            if 'throughput' in entry:
+                throughput = 0.7 * entry['throughput'] + 0.3 * throughput
+            entry['throughput'] = throughput
+
+    def record_failure(self, url):
+        """Record a failed download from a mirror"""
+        with self._lock:
+            self._entry(url)['failed'] = time.time()
+
+    def is_healthy(self, url):
+        """Check that a mirror has not failed recently"""
+        with self._lock:
+            failed = self._stats.get(url, {}).get('failed')
+        return failed is None or time.time() - failed > self.failure_timeout
+
+    def estimate(self, url):
+        """Estimate time of downloading a typical file from a mirror
+
+        :return: time in seconds, or None if the mirror was never measured.
+        :rtype: float
+        """
+        with self._lock:
+            entry = self._stats.get(url, {})
+            latency = entry.get('latency')
+            throughput = entry.get('throughput')
+        if latency is None and throughput is None:
+            return None
+        estimate = latency or 0
+        if throughput:
+            estimate += self.TYPICAL_SIZE / throughput
+        return estimate
+
+    def order(self, urls):
+        """Sort mirrors from the most preferred one
+
+        Healthy mirrors go first, the fastest of them first. Mirrors which
+        were never measured follow and keep their configured order.
+
+        :param urls: base URLs of mirrors in configured order.
+        :type urls: list[str]
+        :rtype: list[str]
+        """
+        keys = []
+        for index, url in enumerate(urls):
+            estimate = self.estimate(url)
+            keys.append((not self.is_healthy(url), estimate is None,
+                         estimate or 0, index, url))
+        return [key[-1] for key in sorted(keys)]
+
+    def save(self):
+        """Write stats to stats_file if they changed"""
+        if not self.stats_file or not self._changed:
+            return
+        with self._lock:
+            stats = json.dumps(self._stats)
+            self._changed = False
+        try:
+            stats_dir = os.path.dirname(self.stats_file)
+            if not os.path.isdir(stats_dir):
+                os.makedirs(stats_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=stats_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(stats)
+            os.rename(tmp_path, self.stats_file)
+        except (IOError, OSError):
+            pass
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return six.text_type(value).encode('utf-8')
+
+
+class MultipartBody(object):
+    """Streamed multipart/form-data request body with a file
+
+    Form fields are followed by the file, which is read from disk in pieces
+    requested by curl, so memory use does not depend on its size. When hash
+    is given, the file is hashed as it is sent, and the upload is aborted if
+    the hash does not match, e.g. because the file changed after it was
+    hashed.
+
+    :param fields: list of pairs of form field name and value.
+    :param str file_field: form field name of the file.
+    :param str filename: file name sent to the server.
+    :param fileobj: the file opened in binary mode. It is sent from its
+        current position.
+    :param str hash: optional expected hash of the file.
+    :param str hashtype: the hash algorithm of hash.
+    :param int length: how many bytes of the file to send. It defaults to
+        the rest of the file.
+    """
+
+    def __init__(self, fields, file_field, filename, fileobj, hash=None,
+                 hashtype=None, length=None):
+        self.boundary = uuid.uuid4().hex
+        self.fileobj = fileobj
+        self.hash = hash
+        self.hashtype = hashtype
+        self.error = None
+
+        boundary = _to_bytes(self.boundary)
+        head = []
+        for name, value in fields:
+            head.append(b'--' + boundary + b'\r\n')
+            head.append(b'Content-Disposition: form-data; name="' +
+                        _to_bytes(name) + b'"\r\n\r\n')
+            head.append(_to_bytes(value) + b'\r\n')
+        head.append(b'--' + boundary + b'\r\n')
+        head.append(b'Content-Disposition: form-data; name="' +
+                    _to_bytes(file_field) + b'"; filename="' +
+                    _to_bytes(filename).replace(b'"', b'%22') + b'"\r\n')
+        head.append(b'Content-Type: application/octet-stream\r\n\r\n')
+        self._head = b''.join(head)
+        self._tail = b'\r\n--' + boundary + b'--\r\n'
+
+        self._file_start = fileobj.tell()
+        self._file_size = os.fstat(fileobj.fileno()).st_size - self._file_start
+        if length is not None:
+            self._file_size = min(length, self._file_size)
+        self.length = len(self._head) + self._file_size + len(self._tail)
+        self.seek(0, os.SEEK_SET)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={0}'.format(self.boundary)
+
+    def seek(self, offset, origin):
+        """Rewind the body, e.g. when curl resends it after authentication
+
+        Only rewinding to the beginning is supported.
+        """
+        if offset != 0 or origin != os.SEEK_SET:
+            return pycurl.SEEKFUNC_CANTSEEK
+        self.fileobj.seek(self._file_start)
+        self._head_pos = 0
+        self._tail_pos = 0
+        self._file_left = self._file_size
+        self._sum = hashlib.new(self.hashtype) if self.hash else None
+        return pycurl.SEEKFUNC_OK
+
+    def read(self, size):
+        """Return next piece of the body of at most size bytes"""
+        if self._head_pos < len(self._head):
+            data = self._head[self._head_pos:self._head_pos + size]
+            self._head_pos += len(data)
+            return data
+
+        if self._file_left > 0:
+            data = self.fileobj.read(min(size, self._file_left))
+            if not data:
+                self.error = 'File is truncated while being uploaded'
+                return pycurl.READFUNC_ABORT
+            self._file_left -= len(data)
+            if self._sum is not None:
+                self._sum.update(data)
+                if not self._file_left and self._sum.hexdigest() != self.hash:
+                    self.error = 'File is changed while being uploaded'
+                    return pycurl.READFUNC_ABORT
+            return data
+
+        data = self._tail[self._tail_pos:self._tail_pos + size]
+        self._tail_pos += len(data)
+        return data
+
 
 class FedoraLookasideCache(CGILookasideCache):
-    def __init__(self, hashtype, download_url, upload_url):
+    def __init__(self, hashtype, download_url, upload_url, store=None):
+        """Constructor
+
+        :param store: optional local store of downloaded files shared by
+            checkouts.
+        :type store: LocalLookasideStore
+        """
         super(FedoraLookasideCache, self).__init__(
             hashtype, download_url, upload_url)
 
         self.download_path = (
             '%(name)s/%(filename)s/%(hashtype)s/%(hash)s/%(filename)s')
+        self.store = store
+        # The progress bar is garbled when files are downloaded concurrently
+        self.show_progress = True
+        # Curl handles are reused by each thread, so that connections to the
+        # lookaside cache are kept alive across downloads.
+        self._local = threading.local()
+        # Files of at least this size in bytes are downloaded in this number
+        # of byte-range segments concurrently. A segment failing is retried
+        # from where it stopped up to download_retries times.
+        self.segmented_download_min_size = 100 * 1024 * 1024
+        self.download_segments = 4
+        self.download_retries = 3
+        # Without a store, segments are kept in partial_dir, so that an
+        # interrupted download could be resumed by a later fedpkg run. They
+        # are removed on failure if it is not set.
+        self.partial_dir = None
+        # Optional HashCache, so that unchanged files are not hashed again
+        self.hashcache = None
+        # Files larger than upload_chunk_size bytes are uploaded in chunks,
+        # if the upload CGI advertises it by a header in responses to
+        # existence checks, see remote_file_status. Progress is recorded in
+        # upload_state_dir.
+        self.upload_chunk_size = 64 * 1024 * 1024
+        self.upload_retries = 3
+        self.upload_state_dir = None
+        # Base URLs of mirrors of the lookaside cache in configured order,
+        # download_url is used if there are none. Downloads go to the fastest
+        # healthy mirror and fail over to the others.
+        self.mirrors = []
+        self.mirror_stats = MirrorStats()
+        self._probe_lock = threading.Lock()
+
+    def hash_file(self, filename, hashtype=None):
+        """Compute the hash of a file, or get it from the hash cache"""
+        if hashtype is None:
+            hashtype = self.hashtype
+        if self.hashcache is None:
+            return hash_file(filename, hashtype)
+        return self.hashcache.hash_file(filename, hashtype)
+
+    def _downloaded(self, outfile, hash, hashtype):
+        """Remember the verified hash of a downloaded file"""
+        if self.hashcache is not None:
+            self.hashcache.set(outfile, hashtype, hash)
+
+    def _curl(self):
+        """Return curl handle of current thread, reset to default options"""
+        curl = getattr(self._local, 'curl', None)
+        if curl is None:
+            curl = self._local.curl = pycurl.Curl()
+        else:
+            curl.reset()
+        return curl
+
+    def _fetch(self, url, outfile, hash, hashtype, filename,
+               segment_min_size=None):
+        """Fetch url into outfile verifying its hash as data is received
+
+        :param int segment_min_size: if the file is at least this large and
+            the server accepts range requests, the transfer is stopped as
+            soon as the response headers are received, so that the file
+            could be downloaded in segments instead.
+        :return: size of the file if the transfer was stopped to download it
+            in segments, None if the file was downloaded.
+        :rtype: int
+        :raises DownloadError: if the download fails or the hash does not
+            match.
+        """
+        try:
+            sum = hashlib.new(hashtype)
+        except ValueError:
+            raise InvalidHashType(hashtype)
+
+        headers = []
+        segmented = []
+
+        with open(outfile, 'wb') as f:
+            def write(data):
+                if segment_min_size is not None and f.tell() == 0:
+                    size = _segmentable_size(headers)
+                    if size is not None and size >= segment_min_size:
+                        segmented.append(size)
+                        # Returning less than received stops the transfer
+                        return 0
+                f.write(data)
+                sum.update(data)
+
+            def header(line):
+                # Headers of a redirect are followed by the final response
+                if line.startswith(b'HTTP/'):
+                    del headers[:]
+                headers.append(line)
+
+            c = self._curl()
+            c.setopt(pycurl.URL, url)
+            c.setopt(pycurl.HTTPHEADER, ['Pragma:'])
+            c.setopt(pycurl.NOPROGRESS, not self.show_progress)
+            if self.show_progress:
+                c.setopt(pycurl.PROGRESSFUNCTION, self.print_progress)
+            c.setopt(pycurl.OPT_FILETIME, True)
+            c.setopt(pycurl.WRITEFUNCTION, write)
+            c.setopt(pycurl.HEADERFUNCTION, header)
+            c.setopt(pycurl.LOW_SPEED_LIMIT, 1000)
+            c.setopt(pycurl.LOW_SPEED_TIME, 300)
+
+            try:
+                c.perform()
+                tstamp = c.getinfo(pycurl.INFO_FILETIME)
+                status = c.getinfo(pycurl.RESPONSE_CODE)
+            except Exception as e:
+                if not segmented:
+                    raise DownloadError(e)
+
+        if segmented:
+            os.remove(outfile)
+            return segmented[0]
+
+        if self.show_progress:
+            # Get back a new line, after displaying the download progress
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+        if status != 200:
+            self.log.info('Remove downloaded invalid file %s', outfile)
+            os.remove(outfile)
+            raise DownloadError('Server returned status code %d' % status)
+
+        if tstamp > 0:
+            os.utime(outfile, (tstamp, tstamp))
+
+        if sum.hexdigest() != hash:
+            raise DownloadError('%s failed checksum' % filename)
+
+    def _fetch_range(self, url, part_file, start, end):
+        """Append bytes from start to end inclusive of url to part_file
+
+        :return: HTTP status code returned by the server.
+        :rtype: int
+        :raises DownloadError: if the transfer fails.
+        """
+        with open(part_file, 'ab') as f:
+            c = self._curl()
+            c.setopt(pycurl.URL, url)
+            c.setopt(pycurl.HTTPHEADER, ['Pragma:'])
+            c.setopt(pycurl.RANGE, '{0}-{1}'.format(start, end))
+            c.setopt(pycurl.WRITEFUNCTION, f.write)
+            c.setopt(pycurl.LOW_SPEED_LIMIT, 1000)
+            c.setopt(pycurl.LOW_SPEED_TIME, 300)
+            try:
+                c.perform()
+                return c.getinfo(pycurl.RESPONSE_CODE)
+            except Exception as e:
+                raise DownloadError(e)
+
+    def _fetch_segment(self, url, filename, part_file, start, end):
+        """Download a segment into part_file, resuming what is there"""
+        length = end - start + 1
+        error = None
+        for attempt in range(self.download_retries + 1):
+            done = 0
+            if os.path.exists(part_file):
+                done = os.path.getsize(part_file)
+            if done == length:
+                return
+            if done > length:
+                os.remove(part_file)
+                done = 0
+            if attempt:
+                self.log.info('Retry downloading %s from byte %d',
+                              filename, start + done)
+            try:
+                status = self._fetch_range(url, part_file, start + done, end)
+            except DownloadError as e:
+                self.log.debug('Downloading %s failed: %s', filename, e)
+                error = e
+                continue
+            if status != 206:
+                os.remove(part_file)
+                raise DownloadError('Server returned status code %d' % status)
+        if os.path.getsize(part_file) != length:
+            raise error or DownloadError(
+                'Incomplete download of {0}'.format(filename))
+
+    def _segments(self, partial, size):
+        """Return list of (part_file, start, end) of segments of a file"""
+        segment_size = -(-size // self.download_segments)
+        segments = []
+        for start in range(0, size, segment_size):
+            end = min(start + segment_size, size) - 1
+            part_file = '{0}.part{1}-{2}'.format(partial, start, end)
+            segments.append((part_file, start, end))
+        return segments
+
+    def _fetch_segmented(self, url, outfile, hash, hashtype, filename, size,
+                         partial):
+        """Fetch url into outfile in concurrent byte-range segments
+
+        Segments are downloaded into files named by partial and their range.
+        They are kept if the download fails, so that it is resumed next time.
+        Segments are joined into outfile and its hash is verified at last.
+
+        :raises DownloadError: if the download fails or the hash does not
+            match.
+        """
+        try:
+            sum = hashlib.new(hashtype)
+        except ValueError:
+            raise InvalidHashType(hashtype)
+
+        segments = self._segments(partial, size)
+        self.log.debug('Download %s in %d segments', filename, len(segments))
+        pool = ThreadPool(len(segments))
+        try:
+            pool.map(lambda segment: self._fetch_segment(url, filename, *segment),
+                     segments)
+        finally:
+            pool.close()
+            pool.join()
+
+        with open(outfile, 'wb') as f:
+            for part_file, start, end in segments:
+                with open(part_file, 'rb') as part:
+                    for chunk in iter(lambda: part.read(1024 * 1024), b''):
+                        f.write(chunk)
+                        sum.update(chunk)
+        for part_file, start, end in segments:
+            os.remove(part_file)
+
+        if sum.hexdigest() != hash:
+            raise DownloadError('%s failed checksum' % filename)
+
+    def get_download_url(self, name, filename, hash, hashtype=None,
+                         mirror=None, **kwargs):
+        """Return URL of a file in the lookaside cache
+
+        :param str mirror: base URL of the mirror to download from. It
+            defaults to download_url.
+        """
+        url = super(FedoraLookasideCache, self).get_download_url(
+            name, filename, hash, hashtype, **kwargs)
+        if mirror is None:
+            return url
+        return os.path.join(mirror, url[len(self.download_url):].lstrip('/'))
+
+    def _probe(self, mirror):
+        """Measure response time of a mirror"""
+        c = self._curl()
+        c.setopt(pycurl.URL, mirror)
+        c.setopt(pycurl.HTTPHEADER, ['Pragma:'])
+        c.setopt(pycurl.NOBODY, True)
+        c.setopt(pycurl.CONNECTTIMEOUT, 10)
+        c.setopt(pycurl.TIMEOUT, 30)
+        start = time.time()
+        try:
+            c.perform()
+            status = c.getinfo(pycurl.RESPONSE_CODE)
+        except pycurl.error as e:
+            self.log.debug('Mirror %s is not available: %s', mirror, e)
+            self.mirror_stats.record_probe(mirror, None)
+            return
+        latency = time.time() - start
+        if not status or status >= 500:
+            self.log.debug('Mirror %s returned status code %d', mirror, status)
+            self.mirror_stats.record_probe(mirror, None)
+            return
+        self.log.debug('Mirror %s responded in %.3f s', mirror, latency)
+        self.mirror_stats.record_probe(mirror, latency)
+
+    def ordered_mirrors(self):
+        """Return base URLs to download from in order of preference
+
+        Mirrors whose latency is unknown or outdated are probed first.
+        """
+        mirrors = self.mirrors or [self.download_url]
+        if len(mirrors) == 1:
+            return mirrors
+        # Concurrent downloads wait for a single round of probes
+        with self._probe_lock:
+            stale = [mirror for mirror in mirrors
+                     if self.mirror_stats.needs_probe(mirror)]
+            if stale:
+                pool = ThreadPool(len(stale))
+                try:
+                    pool.map(self._probe, stale)
+                finally:
+                    pool.close()
+                    pool.join()
+        return self.mirror_stats.order(mirrors)
+
+    def _download_file(self, name, filename, hash, outfile, hashtype,
+                       partial=None, **kwargs):
+        """Download a file from the lookaside cache into outfile
+
+        Mirrors are tried in order of :meth:`ordered_mirrors`. If the
+        download from a mirror fails or does not match the hash, the next
+        mirror is tried.
+
+        :param str partial: path prefix of segments of a partially downloaded
+            file. It defaults to outfile.
+        """
+        self.log.info("Downloading %s", filename)
+        urled_file = filename.replace(' ', '%20')
+        mirrors = self.ordered_mirrors()
+        for index, mirror in enumerate(mirrors):
+            url = self.get_download_url(name, urled_file, hash, hashtype,
+                                        mirror=mirror, **kwargs)
+            if isinstance(url, six.text_type):
+                url = url.encode('utf-8')
+            self.log.debug("Full url: %s", url)
+            start = time.time()
+            try:
+                self._download_from(url, filename, hash, outfile, hashtype,
+                                    partial)
+            except DownloadError as e:
+                if len(mirrors) == 1:
+                    raise
+                self.mirror_stats.record_failure(mirror)
+                if index == len(mirrors) - 1:
+                    raise
+                self.log.warning('Failed to download %s from %s: %s',
+                                 filename, mirror, e)
+                continue
+            if len(mirrors) > 1:
+                self.mirror_stats.record_transfer(
+                    mirror, os.path.getsize(outfile), time.time() - start)
+            return
+
+    def _download_from(self, url, filename, hash, outfile, hashtype, partial):
+        """Download url into outfile
+
+        Large files are downloaded in segments, see :meth:`_fetch_segmented`.
+        Their size is taken from the response to a plain download, which is
+        stopped then, so that no extra request is made for small files.
+        """
+        segment_min_size = None
+        if self.download_segments > 1:
+            segment_min_size = self.segmented_download_min_size
+        size = self._fetch(url, outfile, hash, hashtype, filename,
+                           segment_min_size=segment_min_size)
+        if size is None:
+            return
+
+        if partial is None:
+            # Without a partial_dir, segments would be left in the package
+            # checkout, so they are not kept for resuming the download.
+            try:
+                self._fetch_segmented(url, outfile, hash, hashtype, filename,
+                                      size, outfile)
+            except Exception:
+                for part_file, start, end in self._segments(outfile, size):
+                    if os.path.exists(part_file):
+                        os.remove(part_file)
+                raise
+            return
+        partial_dir = os.path.dirname(partial)
+        if not os.path.isdir(partial_dir):
+            try:
+                os.makedirs(partial_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        # Processes sharing the partial download must not write the same
+        # segments at once.
+        with _locked('{0}.lock'.format(partial)):
+            self._fetch_segmented(url, outfile, hash, hashtype, filename, size,
+                                  partial)
+
+    def download(self, name, filename, hash, outfile, hashtype=None, **kwargs):
+        """Download a source file
+
+        The file is downloaded through the local store if there is one. Files
+        missing in the store are downloaded into it first, then linked to
+        outfile. Without a store, segments of large files are kept in
+        partial_dir until the download completes. This method is thread-safe,
+        so that several files could be downloaded concurrently.
+        """
+        if hashtype is None:
+            hashtype = self.hashtype
+
+        if os.path.exists(outfile):
+            if self.file_is_valid(outfile, hash, hashtype=hashtype):
+                return
+
+        if self.store is None:
+            partial = None
+            if self.partial_dir:
+                partial = os.path.join(self.partial_dir,
+                                       '{0}-{1}'.format(hashtype, hash))
+            self._download_file(name, filename, hash, outfile, hashtype,
+                                partial=partial, **kwargs)
+            self._downloaded(outfile, hash, hashtype)
+            return
+
+        stored = self.store.get(hashtype, hash)
+        if stored is not None:
+            self.log.info('Using %s from local lookaside store', filename)
+            try:
+                self.store.link(stored, outfile)
+                self._downloaded(outfile, hash, hashtype)
+                return
+            except OSError as e:
+                # Evicted by another process meanwhile
+                if e.errno != errno.ENOENT:
+                    raise
+
+        stored = self._download_to_store(name, filename, hash, hashtype,
+                                         **kwargs)
+        self.store.link(stored, outfile)
+        self._downloaded(outfile, hash, hashtype)
+
+    def _download_to_store(self, name, filename, hash, hashtype, **kwargs):
+        """Download a file into the local store
+
+        :return: path to the file in the store.
+        :rtype: str
+        """
+        tmp_file = self.store.mkstemp()
+        try:
+            self._download_file(name, filename, hash, tmp_file, hashtype,
+                                partial=self.store.partial_path(hashtype, hash),
+                                **kwargs)
+            return self.store.add(hashtype, hash, tmp_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def prefetch(self, name, filename, hash, hashtype=None, **kwargs):
+        """Download a source file into the local store only
+
+        A later :meth:`download` of the same file is then served from the
+        store without network access.
+
+        :return: True if the file was downloaded, False if it was in the
+            store already.
+        :rtype: bool
+        :raises rpkgError: if there is no local store.
+        """
+        if self.store is None:
+            raise rpkgError('Cannot prefetch source files without a local '
+                            'lookaside store')
+        if hashtype is None:
+            hashtype = self.hashtype
+        if self.store.get(hashtype, hash) is not None:
+            return False
+        self._download_to_store(name, filename, hash, hashtype, **kwargs)
+        return True
+
+    def _cgi_curl(self):
+        """Return curl handle set up to call the upload CGI"""
+        c = self._curl()
+        c.setopt(pycurl.URL, self.upload_url)
+
+        if self.client_cert is not None:
+            if os.path.exists(self.client_cert):
+                c.setopt(pycurl.SSLCERT, self.client_cert)
+            else:
+                self.log.warning("Missing certificate: %s", self.client_cert)
+
+        if self.ca_cert is not None:
+            if os.path.exists(self.ca_cert):
+                c.setopt(pycurl.CAINFO, self.ca_cert)
+            else:
+                self.log.warning("Missing certificate: %s", self.ca_cert)
+
+        c.setopt(pycurl.HTTPAUTH, pycurl.HTTPAUTH_GSSNEGOTIATE)
+        c.setopt(pycurl.USERPWD, ':')
+        return c
+
+    def remote_file_exists(self, name, filename, hash):
+        """Verify whether a file exists on the lookaside cache
+
+        Unlike the parent method, the connection to the upload CGI is kept
+        alive for other checks and uploads from the same thread.
+
+        :param str name: The name of the module. (usually the name of the
+            SRPM). This can include the namespace as well (depending on what
+            the server side expects).
+        :param str filename: The name of the file to check for.
+        :param str hash: The known good hash of the file.
+        """
+        return self.remote_file_status(name, filename, hash)[0]
+
+    def remote_file_status(self, name, filename, hash):
+        """Verify whether a file exists and how it could be uploaded
+
+        Parameters are the same as of :meth:`remote_file_exists`.
+
+        :return: pair of whether the file exists on the lookaside cache, and
+            whether the upload CGI accepts the file in chunks.
+        :rtype: tuple
+        """
+        # RHEL 7 ships pycurl that does not accept unicode.
+        if six.PY2 and isinstance(filename, six.text_type):
+            filename = filename.encode('utf-8')
+
+        post_data = [('name', name),
+                     ('%ssum' % self.hashtype, hash),
+                     ('filename', filename)]
+
+        headers = []
+        with io.BytesIO() as buf:
+            c = self._cgi_curl()
+            c.setopt(pycurl.WRITEFUNCTION, buf.write)
+            c.setopt(pycurl.HEADERFUNCTION, headers.append)
+            c.setopt(pycurl.HTTPPOST, post_data)
+
+            try:
+                c.perform()
+                status = c.getinfo(pycurl.RESPONSE_CODE)
+            except Exception as e:
+                raise UploadError(e)
+
+            output = buf.getvalue().strip()
+
+        if status != 200:
+            self.raise_upload_error(status)
+
+        chunked = any(
+            re.match(br'x-lookaside-chunked-upload:\s*1', line.lower())
+            for line in headers)
+
+        # Lookaside CGI script returns these strings depending on whether
+        # or not the file exists:
+        if output == b'Available':
+            return True, chunked
+
+        if output == b'Missing':
+            return False, chunked
+
+        # Something unexpected happened
+        self.log.debug(output)
+        raise UploadError('Error checking for %s at %s'
+                          % (filename, self.upload_url))
+
+    def upload(self, name, filepath, hash, offline=False):
+        """Upload a source file
+
+        :param str name: The name of the module. (usually the name of the SRPM)
+            This can include the namespace as well (depending on what the
+            server side expects).
+        :param str filepath: The full path to the file to upload.
+        :param str hash: The known good hash of the file.
+        :param bool offline: Method prints a message about disabled upload and does return.
+        """
+        if offline:
+            self.log.info("Uploading: %s", filepath)
+            self.log.info("*Upload disabled*")
+            return
+
+        filename = os.path.basename(filepath)
+
+        # As in remote_file_exists, we need to convert unicode strings to str
+        if six.PY2:
+            if isinstance(name, six.text_type):
+                name = name.encode('utf-8')
+            if isinstance(filepath, six.text_type):
+                filepath = filepath.encode('utf-8')
+
+        exists, chunked = self.remote_file_status(name, filename, hash)
+        if exists:
+            self.log.info("File already uploaded: %s", filepath)
+            return
+
+        self.upload_file(name, filepath, hash, chunked=chunked)
+
+    def upload_file(self, name, filepath, hash, chunked=False):
+        """Upload a file without checking it is in the lookaside cache already
+
+        The file is streamed from disk, and it is hashed while being sent to
+        make sure it is the file of given hash.
+
+        :param bool chunked: whether the server accepts the file in chunks,
+            as returned from :meth:`remote_file_status`. Files larger than
+            upload_chunk_size are uploaded in chunks then, see
+            :meth:`_upload_chunked`.
+        :raises UploadError: if the upload fails.
+        """
+        self.log.info("Uploading: %s", filepath)
+        size = os.path.getsize(filepath)
+        if (chunked and self.upload_chunk_size and
+                size > self.upload_chunk_size):
+            self._upload_chunked(name, filepath, hash, size)
+            return
+
+        fields = [
+            ('name', name),
+            ('%ssum' % self.hashtype, hash),
+            ('mtime', str(int(os.stat(filepath).st_mtime))),
+        ]
+
+        with open(filepath, 'rb') as f:
+            body = MultipartBody(fields, 'file', os.path.basename(filepath), f,
+                                 hash=hash, hashtype=self.hashtype)
+            status, output = self._post(body, show_progress=self.show_progress)
+
+        if status != 200:
+            self.raise_upload_error(status)
+
+        if output:
+            self.log.debug(output)
+
+    def _post(self, body, show_progress=False):
+        """Post a multipart body to the upload CGI
+
+        :param MultipartBody body: the request body.
+        :return: pair of HTTP status and the response.
+        :rtype: tuple
+        :raises UploadError: if the request fails.
+        """
+        with io.BytesIO() as buf:
+            c = self._cgi_curl()
+            c.setopt(pycurl.POST, True)
+            c.setopt(pycurl.HTTPHEADER,
+                     ['Content-Type: {0}'.format(body.content_type)])
+            c.setopt(pycurl.POSTFIELDSIZE_LARGE, body.length)
+            c.setopt(pycurl.READFUNCTION, body.read)
+            c.setopt(pycurl.SEEKFUNCTION, body.seek)
+            c.setopt(pycurl.WRITEFUNCTION, buf.write)
+            c.setopt(pycurl.NOPROGRESS, not show_progress)
+            if show_progress:
+                c.setopt(pycurl.PROGRESSFUNCTION, self.print_progress)
+
+            try:
+                c.perform()
+                status = c.getinfo(pycurl.RESPONSE_CODE)
+            except Exception as e:
+                raise UploadError(body.error or e)
+            finally:
+                if show_progress:
+                    # Get back a new line, after displaying the progress
+                    sys.stdout.write('\n')
+                    sys.stdout.flush()
+
+            return status, buf.getvalue().strip()
+
+    def _upload_state_file(self, hash):
+        if not self.upload_state_dir:
+            return None
+        return os.path.join(self.upload_state_dir,
+                            '{0}-{1}.json'.format(self.hashtype, hash))
+
+    def _load_upload_offset(self, state_file, filepath, size):
+        """Return offset acknowledged by the server in a previous run"""
+        if not state_file:
+            return 0
+        try:
+            with open(state_file, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return 0
+        if (state.get('upload_url') != self.upload_url or
+                state.get('size') != size or
+                state.get('mtime') != os.stat(filepath).st_mtime):
+            return 0
+        return state.get('offset', 0)
+
+    def _save_upload_offset(self, state_file, filepath, size, offset):
+        """Record offset acknowledged by the server, ignoring failures"""
+        if not state_file:
+            return
+        state = {
+            'upload_url': self.upload_url,
+            'size': size,
+            'mtime': os.stat(filepath).st_mtime,
+            'offset': offset,
+        }
+        try:
+            if not os.path.isdir(self.upload_state_dir):
+                os.makedirs(self.upload_state_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.upload_state_dir,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_path, state_file)
+        except (IOError, OSError):
+            pass
+
+    def _upload_chunked(self, name, filepath, hash, size):
+        """Upload a file in chunks, resuming a previously interrupted upload
+
+        Each chunk is posted with its offset and the total size of the file.
+        The server appends chunks at the offset of bytes it received so far,
+        and acknowledges the number of received bytes with a response
+        ``Received N``. Chunks are sent from the acknowledged offset, which
+        is also recorded locally, so that a later run resumes from there.
+        Once the whole file is received, the server verifies its hash.
+
+        :raises UploadError: if a chunk fails upload_retries times in a row,
+            the server acknowledges an offset it acknowledged before, i.e.
+            the upload does not make progress, or the server rejects the
+            file.
+        """
+        filename = os.path.basename(filepath)
+        state_file = self._upload_state_file(hash)
+        offset = self._load_upload_offset(state_file, filepath, size)
+        if offset:
+            self.log.info('Resume uploading %s from byte %d', filename, offset)
+
+        fields = [
+            ('name', name),
+            ('%ssum' % self.hashtype, hash),
+            ('filename', filename),
+            ('size', str(size)),
+            ('mtime', str(int(os.stat(filepath).st_mtime))),
+        ]
+        failures = 0
+        # The server may acknowledge a lower offset than the one resumed
+        # from, but never the same offset twice.
+        acknowledged = set([offset])
+        with open(filepath, 'rb') as f:
+            while True:
+                f.seek(offset)
+                body = MultipartBody(
+                    fields + [('offset', str(offset))], 'chunk', filename, f,
+                    length=self.upload_chunk_size)
+                try:
+                    status, output = self._post(body)
+                except UploadError as e:
+                    failures += 1
+                    if failures > self.upload_retries:
+                        raise
+                    self.log.info('Retry uploading %s from byte %d: %s',
+                                  filename, offset, e)
+                    continue
+                failures = 0
+
+                if status != 200:
+                    self.raise_upload_error(status)
+                match = re.match(br'Received (\d+)$', output)
+                if not match:
+                    self.log.debug(output)
+                    raise UploadError('Unexpected response to upload of {0}'
+                                      .format(filename))
+                offset = int(match.group(1))
+                if offset >= size:
+                    break
+                if offset in acknowledged:
+                    raise UploadError(
+                        'Upload of {0} does not make progress at byte {1}'
+                        .format(filename, offset))
+                acknowledged.add(offset)
+                self._save_upload_offset(state_file, filepath, size, offset)
+                self.log.debug('Uploaded %d of %d bytes of %s',
+                               offset, size, filename)
+
+        if state_file and os.path.exists(state_file):
+            os.unlink(state_file)
@@ -0,0 +1,84 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Manifest of source files materialized in a working tree
+
+The manifest records which entries of the sources file have been downloaded
+and verified in each output directory. Comparing it with the current sources
+file tells which entries are new or changed, and which files are not listed
+anymore and could be removed.
+"""
+
+
+import json
+import os
+import tempfile
+
+
+class SourcesManifest(object):
+    """Entries of sources file materialized per output directory
+
+    :param str manifest_file: JSON file to persist the manifest in. If it is
+        None, the manifest is kept in memory only.
+    """
+
+    def __init__(self, manifest_file=None):
+        self.manifest_file = manifest_file
+        self._dirs = None
+
+    @property
+    def dirs(self):
+        if self._dirs is None:
+            self._dirs = self._load()
+        return self._dirs
+
+    def _load(self):
+        if not self.manifest_file:
+            return {}
+        try:
+            with open(self.manifest_file, 'r') as f:
+                dirs = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        return dirs if isinstance(dirs, dict) else {}
+
+    def get(self, outdir):
+        """Get entries materialized in a directory
+
+        :param str outdir: the output directory.
+        :return: mapping from file name to pair of hash type and hash.
+        :rtype: dict
+        """
+        entries = self.dirs.get(os.path.abspath(outdir), {})
+        return dict((filename, tuple(value))
+                    for filename, value in entries.items())
+
+    def set(self, outdir, entries):
+        """Record entries materialized in a directory and save the manifest
+
+        Failures to write the manifest file are ignored.
+
+        :param str outdir: the output directory.
+        :param dict entries: mapping from file name to pair of hash type and
+            hash.
+        """
+        self.dirs[os.path.abspath(outdir)] = dict(
+            (filename, list(value)) for filename, value in entries.items())
+        if not self.manifest_file:
+            return
+        try:
+            # Write to a temporary file and rename, so that concurrent fedpkg
+            # processes never read a partially written manifest.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.manifest_file), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.dirs, f)
+            os.rename(tmp_path, self.manifest_file)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,118 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Submit builds of many packages through one Koji session
+
+Running fedpkg build for every package means logging in to Koji and making
+several calls per package. Here all checks and submissions of a kind are
+sent in a single multicall, so submitting any number of builds takes the
+same few round trips.
+"""
+
+
+import koji
+
+
+def multicall(session, calls):
+    """Make calls in a single Koji multicall
+
+    A failing call does not affect the others.
+
+    :param session: Koji session.
+    :param calls: pairs of Koji API method name and a tuple of arguments.
+    :type calls: list[tuple]
+    :return: pairs of result and error message, which is None on success, in
+        the order of calls.
+    :rtype: list[tuple]
+    """
+    if not calls:
+        return []
+    session.multicall = True
+    for method, args in calls:
+        getattr(session, method)(*args)
+    results = []
+    for result in session.multiCall(strict=False):
+        if isinstance(result, dict):
+            results.append((None, result.get('faultString', str(result))))
+        else:
+            results.append((result[0], None))
+    return results
+
+
+def submit_builds(session, builds, opts=None, priority=None, nvr_check=True):
+    """Check and submit builds in three multicalls
+
+    Build targets and existing builds are queried first, then destination
+    tags of the targets, and builds which pass the checks are submitted at
+    last.
+
+    :param session: logged in Koji session.
+    :param builds: mappings containing nvr, url and target of each build.
+        Task ID of a submitted build is set as task_id, the reason why a
+        build is not submitted is set as error.
+    :type builds: list[dict]
+    :param dict opts: options passed to Koji API build.
+    :param int priority: priority of build tasks.
+    :param bool nvr_check: whether to skip builds whose NVR exists.
+    :return: the builds.
+    :rtype: list[dict]
+    """
+    pending = [build for build in builds if not build.get('error')]
+    targets = sorted(set(build['target'] for build in pending))
+    calls = [('getBuildTarget', (target,)) for target in targets]
+    if nvr_check:
+        calls.extend(('getBuild', (build['nvr'],)) for build in pending)
+    results = multicall(session, calls)
+
+    build_targets = {}
+    for target, (result, error) in zip(targets, results):
+        if error or not result:
+            build_targets[target] = None
+        else:
+            build_targets[target] = result
+    for build in pending:
+        if build_targets[build['target']] is None:
+            build['error'] = 'Unknown build target: {0}'.format(
+                build['target'])
+    if nvr_check:
+        for build, (result, error) in zip(pending, results[len(targets):]):
+            if build.get('error'):
+                continue
+            if error:
+                build['error'] = error
+            elif result and result['state'] != koji.BUILD_STATES['FAILED'] \
+                    and result['state'] != koji.BUILD_STATES['CANCELED']:
+                build['error'] = '{0} has already been built'.format(
+                    build['nvr'])
+    pending = [build for build in pending if not build.get('error')]
+
+    dest_tags = sorted(set(
+        build_targets[build['target']]['dest_tag_name'] for build in pending))
+    results = multicall(session, [('getTag', (tag,)) for tag in dest_tags])
+    locked = {}
+    for tag, (result, error) in zip(dest_tags, results):
+        if error or not result:
+            locked[tag] = 'Unknown destination tag {0}'.format(tag)
+        elif result['locked']:
+            locked[tag] = 'Destination tag {0} is locked'.format(tag)
+    for build in pending:
+        tag = build_targets[build['target']]['dest_tag_name']
+        if tag in locked:
+            build['error'] = locked[tag]
+    pending = [build for build in pending if not build.get('error')]
+
+    results = multicall(session, [
+        ('build', (build['url'], build['target'], opts or {}, priority))
+        for build in pending])
+    for build, (task_id, error) in zip(pending, results):
+        if error:
+            build['error'] = error
+        else:
+            build['task_id'] = task_id
+    return builds
@@ -0,0 +1,242 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Onboard new packages from the repository request to branch requests
+
+Bringing a reviewed package into dist-git takes a repository request, waiting
+until the SCM request is processed, a clone and requests of release branches.
+Here every package goes through these steps on its own, so that packages
+whose requests are processed early are cloned and branched while others are
+still waiting.
+"""
+
+
+import logging
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+from fedpkg.bugzilla import BugzillaClient
+from fedpkg.utils import (assert_new_tests_repo, assert_valid_epel_package,
+                          get_pagure_issue, is_epel, new_branch_ticket,
+                          new_pagure_issue, new_repo_ticket)
+from pyrpkg import rpkgError
+
+log = logging.getLogger(__name__)
+
+
+def issue_id(issue_url):
+    """Return ID of a Pagure issue from its URL"""
+    return issue_url.rstrip('/').rsplit('/', 1)[-1]
+
+
+def wait_for_issue(pagure_url, issue_url, poll_interval=30,
+                   max_poll_interval=600, timeout=24 * 3600):
+    """Wait until an SCM request is processed
+
+    The issue is checked after poll_interval seconds first, and the interval
+    doubles after every check up to max_poll_interval, since requests are
+    processed in minutes, or in hours if they need a human.
+
+    :param str pagure_url: URL of Pagure.
+    :param str issue_url: URL of the issue, as returned by new_pagure_issue.
+    :param int poll_interval: seconds to the first check.
+    :param int max_poll_interval: maximum seconds between checks.
+    :param int timeout: seconds to wait at most.
+    :return: the processed issue.
+    :rtype: dict
+    :raises rpkgError: if the request is closed without being processed, or
+        not processed in time.
+    """
+    deadline = time.time() + timeout
+    interval = poll_interval
+    while True:
+        if time.time() + interval > deadline:
+            raise rpkgError('Request {0} was not processed in time'.format(
+                issue_url))
+        time.sleep(interval)
+        interval = min(interval * 2, max_poll_interval)
+        try:
+            issue = get_pagure_issue(pagure_url, issue_id(issue_url))
+        except rpkgError as e:
+            # Try again later, Pagure may be busy
+            log.warning('%s', e)
+            continue
+        if issue['status'] == 'Open':
+            continue
+        if issue.get('close_status') == 'Processed':
+            return issue
+        comments = issue.get('comments') or []
+        reason = comments[-1]['comment'] if comments else 'no reason given'
+        raise rpkgError('Request {0} was closed as {1}: {2}'.format(
+            issue_url, issue.get('close_status'), reason))
+
+
+class Onboarding(object):
+    """Onboard reviewed packages in the rpms namespace
+
+    :param str name: name of the CLI, e.g. fedpkg, used in error hints.
+    :param str bz_url: URL of Bugzilla.
+    :param str pagure_url: URL of Pagure.
+    :param str pagure_token: Pagure API token allowed to create tickets.
+    :param branches: release branches requested for every package.
+    :type branches: list[str]
+    :param clone: optional callable cloning a repository given by name. It
+        raises rpkgError if the clone fails.
+    :param str dist_git_url: URL of dist-git. If set, a tests repository is
+        requested for every package as well.
+    :param int workers: how many packages are onboarded at once.
+    :param int poll_interval: seconds to the first check of a request, see
+        :func:`wait_for_issue`.
+    :param int max_poll_interval: maximum seconds between checks.
+    :param int timeout: seconds to wait for a repository at most.
+    :param report: optional callable called with a progress message.
+    """
+
+    def __init__(self, name, bz_url, pagure_url, pagure_token, branches,
+                 clone=None, dist_git_url=None, workers=4, poll_interval=30,
+                 max_poll_interval=600, timeout=24 * 3600, report=None):
+        self.name = name
+        self.bz_url = bz_url
+        self.pagure_url = pagure_url
+        self.pagure_token = pagure_token
+        self.branches = branches
+        self.clone = clone
+        self.dist_git_url = dist_git_url
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.report = report or log.info
+
+    def _new_issue(self, title, body):
+        return new_pagure_issue(log, self.pagure_url, self.pagure_token,
+                                title, body, self.name)
+
+    def _review_summary(self, package):
+        bug = BugzillaClient(self.bz_url).get_review_bug(
+            package['bug'], 'rpms', package['name'])
+        return bug.summary.split(' - ', 1)[1].strip()
+
+    def _validate(self, package):
+        """Check the review bug and the tests repository at the same time"""
+        checks = [lambda: self._review_summary(package)]
+        if self.dist_git_url:
+            checks.append(lambda: assert_new_tests_repo(
+                package['name'], self.dist_git_url))
+        for branch in self.branches:
+            if is_epel(branch) and not branch.endswith('-playground'):
+                checks.append(lambda branch=branch: assert_valid_epel_package(
+                    package['name'], branch))
+
+        def _check(check):
+            try:
+                return check(), None
+            except rpkgError as e:
+                return None, str(e)
+
+        pool = ThreadPool(len(checks))
+        try:
+            results = pool.map(_check, checks)
+        finally:
+            pool.close()
+            pool.join()
+        errors = [error for result, error in results if error]
+        if errors:
+            raise rpkgError('; '.join(errors))
+        package['summary'] = results[0][0]
+
+    def _request_repos(self, package):
+        title, body = new_repo_ticket(
+            package['name'], 'rpms', branch='master', bug=package['bug'],
+            summary=package['summary'], monitor='monitoring')
+        package['repo_ticket'] = self._new_issue(title, body)
+        self.report('{0}: requested repository, {1}'.format(
+            package['name'], package['repo_ticket']))
+        if self.dist_git_url:
+            title, body = new_repo_ticket(
+                package['name'], 'tests', bug=package['bug'],
+                description='Tests of the {0} package'.format(
+                    package['name']))
+            package['tests_ticket'] = self._new_issue(title, body)
+
+    def _clone_and_branch(self, package):
+        """Clone the new repository and request branches at the same time"""
+        steps = [(branch, lambda branch=branch: self._new_issue(
+            *new_branch_ticket(package['name'], 'rpms', branch)))
+            for branch in self.branches]
+        if self.clone is not None:
+            steps.append((None, lambda: self.clone(package['name'])))
+
+        def _step(step):
+            branch, run = step
+            try:
+                return branch, run(), None
+            except rpkgError as e:
+                return branch, None, str(e)
+
+        errors = []
+        pool = ThreadPool(max(1, len(steps)))
+        try:
+            for branch, result, error in pool.map(_step, steps):
+                if error:
+                    errors.append(error)
+                elif branch:
+                    package['branch_tickets'][branch] = result
+                else:
+                    package['cloned'] = True
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise rpkgError('; '.join(errors))
+
+    def _onboard(self, package):
+        steps = (
+            ('validation', self._validate),
+            ('repository request', self._request_repos),
+            ('repository request', lambda package: wait_for_issue(
+                self.pagure_url, package['repo_ticket'],
+                poll_interval=self.poll_interval,
+                max_poll_interval=self.max_poll_interval,
+                timeout=self.timeout)),
+            ('clone and branch requests', self._clone_and_branch),
+        )
+        for step, run in steps:
+            try:
+                run(package)
+            except rpkgError as e:
+                package['error'] = '{0} failed: {1}'.format(step, e)
+                self.report('{0}: {1}'.format(package['name'],
+                                              package['error']))
+                return package
+        self.report('{0}: onboarded'.format(package['name']))
+        return package
+
+    def run(self, packages):
+        """Onboard packages
+
+        A failure of a package does not stop the others.
+
+        :param packages: pairs of package name and review bug ID.
+        :type packages: list[tuple]
+        :return: mappings of name, bug, summary, repo_ticket, tests_ticket,
+            branch_tickets keyed by branch, cloned and error, which is None
+            if the package was onboarded, in the order of packages.
+        :rtype: list[dict]
+        """
+        packages = [{'name': name, 'bug': bug, 'summary': None,
+                     'repo_ticket': None, 'tests_ticket': None,
+                     'branch_tickets': {}, 'cloned': False, 'error': None}
+                    for name, bug in packages]
+        pool = ThreadPool(max(1, min(self.workers, len(packages))))
+        try:
+            return pool.map(self._onboard, packages)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,397 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Rebuild packages in the order of their build dependencies
+
+Packages of a set of checkouts are split into waves. A package is built in a
+wave after all packages providing its build requirements, so that builds of
+one wave run in Koji at the same time. Between waves, the scheduler waits
+until builds of the previous wave are in the buildroot, optionally creating
+buildroot overrides for them first.
+
+Progress is written into a state file after every step, so that a rebuild
+interrupted or stopped by a failed build continues where it stopped.
+"""
+
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+import koji
+
+from pyrpkg import rpkgError
+
+log = logging.getLogger(__name__)
+
+# Bump when the layout of the state file changes
+STATE_FORMAT = 1
+
+# Comparison operators of versioned dependencies, e.g. foo >= 1.0
+COMPARISONS = ('<', '<=', '=', '>=', '>')
+# Operators of rich dependencies, e.g. (foo or bar)
+RICH_OPERATORS = ('and', 'or', 'if', 'else', 'with', 'without', 'unless')
+
+
+def dependency_names(dep):
+    """Return names of capabilities a dependency refers to
+
+    Versions are dropped, and every capability of a rich dependency is
+    returned, e.g. ``(foo >= 1.0 or pkgconfig(bar))`` gives foo and
+    pkgconfig(bar).
+
+    :param str dep: dependency as printed by rpmspec.
+    :rtype: list[str]
+    """
+    names = []
+    skip_version = False
+    for token in dep.split():
+        if skip_version:
+            skip_version = False
+            continue
+        if token in COMPARISONS:
+            skip_version = True
+            continue
+        token = token.lstrip('(')
+        while token.endswith(')') and token.count(')') > token.count('('):
+            token = token[:-1]
+        if token and token not in RICH_OPERATORS:
+            names.append(token)
+    return names
+
+
+def build_order(packages):
+    """Split packages into waves ordered by build dependencies
+
+    Only dependencies between the given packages are considered, anything
+    else is expected to be in the buildroot already.
+
+    :param packages: mapping of package key to a mapping with lists of
+        provides and buildrequires.
+    :type packages: dict
+    :return: list of waves, each a sorted list of package keys. Packages of
+        a wave depend only on packages of former waves.
+    :rtype: list[list[str]]
+    :raises rpkgError: if build dependencies form a cycle.
+    """
+    providers = {}
+    for key, deps in packages.items():
+        for provide in deps['provides']:
+            for name in dependency_names(provide)[:1]:
+                providers.setdefault(name, set()).add(key)
+
+    requires = {}
+    for key, deps in packages.items():
+        requires[key] = set()
+        for dep in deps['buildrequires']:
+            for name in dependency_names(dep):
+                requires[key].update(providers.get(name, ()))
+        requires[key].discard(key)
+
+    waves = []
+    built = set()
+    remaining = set(packages)
+    while remaining:
+        wave = sorted(key for key in remaining if requires[key] <= built)
+        if not wave:
+            raise rpkgError(
+                'Build dependencies form a cycle, cannot order: {0}'.format(
+                    ', '.join(sorted(remaining))))
+        waves.append(wave)
+        built.update(wave)
+        remaining.difference_update(wave)
+    return waves
+
+
+class RebuildState(object):
+    """Plan and progress of a rebuild stored in a JSON file
+
+    :param str state_file: path to the state file.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        # Waves of checkout paths, see build_order
+        self.waves = []
+        # Mappings of name, nvr, target, state, task_id and override keyed by
+        # checkout path. State is one of pending, building, built or failed.
+        self.packages = {}
+        # Number of waves whose builds are in the buildroot already
+        self.ready_waves = 0
+
+    @classmethod
+    def load(cls, state_file):
+        """Load state from a file
+
+        :return: the loaded state, or None if the file does not exist.
+        :rtype: RebuildState
+        :raises rpkgError: if the file cannot be read.
+        """
+        if not os.path.exists(state_file):
+            return None
+        try:
+            with open(state_file, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            raise rpkgError('Cannot read rebuild state {0}: {1}'.format(
+                state_file, e))
+        if data.get('format') != STATE_FORMAT:
+            raise rpkgError('Rebuild state {0} has unknown format.'.format(
+                state_file))
+        state = cls(state_file)
+        state.waves = data['waves']
+        state.packages = data['packages']
+        state.ready_waves = data['ready_waves']
+        return state
+
+    def save(self):
+        """Write state into the file atomically"""
+        data = {
+            'format': STATE_FORMAT,
+            'waves': self.waves,
+            'packages': self.packages,
+            'ready_waves': self.ready_waves,
+        }
+        state_dir = os.path.dirname(os.path.abspath(self.state_file))
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=state_dir, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.rename(tmp_file, self.state_file)
+        except (IOError, OSError) as e:
+            raise rpkgError('Cannot save rebuild state {0}: {1}'.format(
+                self.state_file, e))
+
+
+class _SerializedSession(object):
+    """Koji session proxy calling methods of the session one at a time
+
+    Logged in Koji sessions number their calls, so calls from concurrent
+    threads must not overlap.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._session, name)
+        if not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return _call
+
+
+class RebuildScheduler(object):
+    """Build packages of checkouts wave by wave in Koji
+
+    :param session: logged in Koji session used for all builds.
+    :param commands_factory: a callable returning Commands working on the
+        checkout at given path.
+    :param RebuildState state: the plan and progress of the rebuild.
+    :param str side_tag: optional side tag to build all packages in.
+    :param override: optional callable creating a buildroot override of a
+        build given by NVR. It is called for builds of every wave before
+        waiting for the next buildroot.
+    :param int poll_interval: seconds between checks of tasks and repos.
+    :param report: optional callable called with a progress message.
+    :param int workers: maximum number of builds of a wave submitted at once.
+    """
+
+    def __init__(self, session, commands_factory, state, side_tag=None,
+                 override=None, poll_interval=30, report=None, workers=4):
+        self.session = session
+        self.commands_factory = commands_factory
+        self.state = state
+        self.side_tag = side_tag
+        self.override = override
+        self.poll_interval = poll_interval
+        self.report = report or log.info
+        self.workers = workers
+        self._build_tags = {}
+        # Builds are submitted concurrently through the same Koji session
+        self._submit_session = _SerializedSession(session)
+        self._lock = threading.Lock()
+
+    def _commands(self, path):
+        cmd = self.commands_factory(path)
+        cmd._kojisession = self._submit_session
+        if self.side_tag:
+            cmd.target = self.side_tag
+        return cmd
+
+    def plan(self, paths, workers=4):
+        """Read build dependencies of checkouts and order them into waves
+
+        :param paths: paths to checkouts to rebuild.
+        :type paths: list[str]
+        :param int workers: how many specs are evaluated at once.
+        """
+        packages = {}
+        deps = {}
+        for path in paths:
+            cmd = self._commands(path)
+            # Reading git config and evaluating the spec is not thread-safe,
+            # only rpmspec runs in parallel below.
+            packages[path] = {'name': cmd.repo_name, 'nvr': cmd.nvr,
+                              'target': cmd.target, 'state': 'pending',
+                              'task_id': None, 'override': False}
+            deps[path] = (cmd, os.path.join(cmd.path, cmd.spec),
+                          cmd.rpmdefines)
+
+        def _read(path):
+            cmd, spec_file, rpmdefines = deps[path]
+            return path, cmd._spec_dependencies(spec_file, rpmdefines)
+
+        pool = ThreadPool(max(1, min(workers, len(paths))))
+        try:
+            results = dict(pool.map(_read, paths))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.state.waves = build_order(results)
+        self.state.packages = packages
+        self.state.ready_waves = 0
+        self.state.save()
+
+    def _submit(self, path, cmd):
+        """Submit build of a checkout and save the state, thread-safe"""
+        info = self.state.packages[path]
+        build = self._submit_session.getBuild(info['nvr'])
+        if build and build['state'] == koji.BUILD_STATES['COMPLETE']:
+            with self._lock:
+                self.report('{0} is built already'.format(info['nvr']))
+                info.update(state='built', task_id=build.get('task_id'))
+                self.state.save()
+            return
+        task_id = cmd.build(nvr_check=False)
+        with self._lock:
+            self.report('Building {0}: task {1}'.format(info['nvr'], task_id))
+            info.update(state='building', task_id=task_id)
+            self.state.save()
+
+    def _submit_wave(self, wave):
+        """Submit builds of a wave not built yet by a pool of workers"""
+        paths = [path for path in wave
+                 if self.state.packages[path]['state'] in ('pending', 'failed')]
+        if not paths:
+            return
+        # Loading Commands is not thread-safe, only builds run in parallel
+        commands = dict((path, self._commands(path)) for path in paths)
+
+        def _submit(path):
+            self._submit(path, commands[path])
+
+        pool = ThreadPool(max(1, min(self.workers, len(paths))))
+        try:
+            pool.map(_submit, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _wait_for_tasks(self, wave):
+        """Wait until build tasks of a wave finish"""
+        pending = [path for path in wave
+                   if self.state.packages[path]['state'] == 'building']
+        while pending:
+            for path in list(pending):
+                info = self.state.packages[path]
+                task = self.session.getTaskInfo(info['task_id'])
+                state = koji.TASK_STATES[task['state']]
+                if state == 'CLOSED':
+                    info['state'] = 'built'
+                elif state in ('FAILED', 'CANCELED'):
+                    info['state'] = 'failed'
+                else:
+                    continue
+                pending.remove(path)
+                self.report('{0}: {1}'.format(info['nvr'], info['state']))
+            self.state.save()
+            if pending:
+                time.sleep(self.poll_interval)
+
+    def _build_tag(self, target):
+        if target not in self._build_tags:
+            build_target = self.session.getBuildTarget(target)
+            if not build_target:
+                raise rpkgError('Unknown build target: {0}'.format(target))
+            self._build_tags[target] = build_target['build_tag_name']
+        return self._build_tags[target]
+
+    def _in_repo(self, tag, repo, info):
+        """Whether the latest build of a package in repo is the wanted one"""
+        builds = self.session.listTagged(tag, package=info['name'],
+                                         latest=True, inherit=True)
+        return bool(builds) and builds[0]['nvr'] == info['nvr'] and \
+            builds[0]['create_event'] <= repo['create_event']
+
+    def _wait_for_repo(self, wave):
+        """Wait until builds of a wave are in repos of their build tags"""
+        tags = {}
+        for path in wave:
+            info = self.state.packages[path]
+            tags.setdefault(self._build_tag(info['target']), []).append(info)
+        for tag, infos in sorted(tags.items()):
+            self.report('Waiting for repo of {0}'.format(tag))
+            while True:
+                repo = self.session.getRepo(tag)
+                if repo and all(self._in_repo(tag, repo, info)
+                                for info in infos):
+                    break
+                time.sleep(self.poll_interval)
+
+    def _create_overrides(self, wave):
+        for path in wave:
+            info = self.state.packages[path]
+            if info['override']:
+                continue
+            try:
+                self.override(info['nvr'])
+            except Exception as e:
+                # Override may exist already, repo is checked anyway
+                self.report('Cannot create buildroot override of {0}: '
+                            '{1}'.format(info['nvr'], e))
+            info['override'] = True
+            self.state.save()
+
+    def run(self):
+        """Build waves not built yet
+
+        :raises rpkgError: if builds of a wave failed. Later waves are not
+            built then, running again rebuilds the failed packages and
+            continues.
+        """
+        waves = self.state.waves
+        for index, wave in enumerate(waves):
+            if index < self.state.ready_waves:
+                continue
+            self.report('Wave {0} of {1}: {2}'.format(
+                index + 1, len(waves),
+                ' '.join(self.state.packages[path]['name'] for path in wave)))
+            self._submit_wave(wave)
+            self._wait_for_tasks(wave)
+
+            failed = [self.state.packages[path]['nvr'] for path in wave
+                      if self.state.packages[path]['state'] == 'failed']
+            if failed:
+                raise rpkgError('Builds failed: {0}'.format(', '.join(failed)))
+            if index + 1 < len(waves):
+                if self.override is not None:
+                    self._create_overrides(wave)
+                self._wait_for_repo(wave)
+            self.state.ready_waves = index + 1
+            self.state.save()
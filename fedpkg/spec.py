@@ -0,0 +1,184 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Cache of spec file evaluation results
+
+Evaluating a spec file means spawning rpm, which is slow compared to the rest
+of most commands. Results are cached by content, so commands asking for NVR
+and changelog of the same spec with the same rpm defines evaluate it once.
+"""
+
+
+import hashlib
+import json
+import os
+import tempfile
+
+# Bump when the layout of cached results changes
+CACHE_FORMAT = '1'
+
+# Maximum number of entries kept in the cache directory
+MAX_ENTRIES = 1000
+
+# Specs using these depend on more than their own content and the macro
+# files, e.g. other files, output of commands or git history, and are never
+# cached. Expansions are excluded as they may build any of the others.
+UNCACHEABLE_MACROS = (b'%include', b'%(', b'%{lua:', b'%{load:',
+                      b'%{expand:', b'autorelease', b'autochangelog')
+
+# Files and directories of files defining rpm macros, e.g. %dist
+MACRO_PATHS = ('/usr/lib/rpm/macros', '/usr/lib/rpm/macros.d',
+               '/usr/lib/rpm/redhat', '/etc/rpm', '~/.rpmmacros')
+
+
+def macros_digest(paths=None):
+    """Return digest of names and content of rpm macro files
+
+    Macro files change what a spec evaluates to, e.g. the dist tag, without
+    changing the spec itself. Directories are not searched recursively.
+
+    :param paths: files and directories of files to digest. Defaults to
+        MACRO_PATHS.
+    :type paths: list[str]
+    :return: hex digest of the macro files.
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    for path in MACRO_PATHS if paths is None else paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            try:
+                filenames = sorted(os.path.join(path, name)
+                                   for name in os.listdir(path))
+            except OSError:
+                filenames = []
+        else:
+            filenames = [path]
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as f:
+                    content = f.read()
+            except (IOError, OSError):
+                # Missing files and subdirectories
+                continue
+            h.update(filename.encode('utf-8'))
+            h.update(b'\0')
+            h.update(hashlib.sha256(content).hexdigest().encode('utf-8'))
+            h.update(b'\0')
+    return h.hexdigest()
+
+
+class SpecCache(object):
+    """Content-addressed cache of spec evaluation results
+
+    Entries are keyed on the hash of the spec file content, the rpm defines
+    used to evaluate it and the content of installed macro files. Results are
+    kept in memory and, when cache_dir is given, in JSON files, so that later
+    runs skip rpm as well. The least recently used files are removed when
+    there are more than max_entries of them. Failures to access the cache
+    directory are not fatal, the spec is evaluated again.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = {}
+
+    @staticmethod
+    def make_key(spec_file, rpmdefines):
+        """Make cache key of a spec file evaluated with given rpm defines
+
+        :param str spec_file: path to the spec file.
+        :param rpmdefines: rpm options used to evaluate the spec.
+        :type rpmdefines: list[str]
+        :return: hex digest identifying the evaluation, or None if the spec
+            cannot be cached.
+        :rtype: str
+        """
+        with open(spec_file, 'rb') as f:
+            content = f.read()
+        if any(macro in content for macro in UNCACHEABLE_MACROS):
+            return None
+        h = hashlib.sha256()
+        h.update(CACHE_FORMAT.encode('utf-8'))
+        h.update(content)
+        for define in rpmdefines:
+            h.update(b'\0')
+            h.update(define.encode('utf-8'))
+        h.update(b'\0')
+        h.update(macros_digest().encode('utf-8'))
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, '{0}.json'.format(key))
+
+    def get(self, key):
+        """Get cached evaluation result
+
+        :param str key: cache key returned from :meth:`make_key`.
+        :return: the cached result, or None if there is no such entry.
+        :rtype: dict
+        """
+        if key in self._entries:
+            return self._entries[key]
+        if not self.cache_dir:
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'r') as f:
+                result = json.load(f)
+            # Mark as recently used, see _evict
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        self._entries[key] = result
+        return result
+
+    def set(self, key, result):
+        """Cache an evaluation result
+
+        :param str key: cache key returned from :meth:`make_key`.
+        :param dict result: the evaluation result. It must be serializable
+            to JSON.
+        """
+        self._entries[key] = result
+        if not self.cache_dir:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Write to a temporary file and rename, so that concurrent fedpkg
+            # processes never read a partially written entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.rename(tmp_path, self._entry_path(key))
+            self._evict()
+        except (IOError, OSError):
+            pass
+
+    def _evict(self):
+        """Remove least recently used entries above max_entries"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                # Removed by another process
+                continue
+        entries.sort()
+        for mtime, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -0,0 +1,138 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Cache of built SRPMs
+
+Building an SRPM is repeated for every scratch build and mockbuild, even if
+nothing changed in the package repository. SRPMs are cached by hash of the
+input files and the rpm defines affecting the result, so that rpmbuild could
+be skipped.
+"""
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+class SRPMCache(object):
+    """Content-addressed cache of SRPMs
+
+    Every entry is a directory named by the key, containing the SRPM. Entries
+    are evicted when they are older than max_age seconds, or the least
+    recently used first when total size exceeds max_size bytes.
+
+    :param str cache_dir: directory holding the cached SRPMs.
+    :param int max_size: maximum size of all cached SRPMs in bytes.
+    :param int max_age: maximum age of a cached SRPM in seconds.
+    """
+
+    def __init__(self, cache_dir, max_size, max_age):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @staticmethod
+    def make_key(files, values):
+        """Make cache key from input files and values
+
+        :param files: paths of files whose name and content are part of the
+            key.
+        :type files: list[str]
+        :param values: other strings affecting the SRPM, e.g. rpm defines.
+        :type values: list[str]
+        :return: hex digest identifying the SRPM.
+        :rtype: str
+        """
+        h = hashlib.sha256()
+        for path in sorted(files):
+            h.update(os.path.basename(path).encode('utf-8'))
+            h.update(b'\0')
+            file_hash = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_hash.update(chunk)
+            h.update(file_hash.hexdigest().encode('utf-8'))
+            h.update(b'\0')
+        for value in values:
+            h.update(value.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get(self, key, filename):
+        """Get path of a cached SRPM
+
+        The entry is marked as recently used.
+
+        :param str key: key returned from :meth:`make_key`.
+        :param str filename: file name of the SRPM.
+        :return: path to the cached SRPM, or None if it is not cached.
+        :rtype: str
+        """
+        path = os.path.join(self.cache_dir, key, filename)
+        if not os.path.isfile(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, srpm):
+        """Add a SRPM to the cache and evict old entries
+
+        :param str key: key returned from :meth:`make_key`.
+        :param str srpm: path to the SRPM to be cached.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Prepare the entry aside and rename it, so that concurrent
+            # fedpkg processes never see a partially copied SRPM.
+            tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+            shutil.copyfile(srpm, os.path.join(tmp_dir, os.path.basename(srpm)))
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Entry has been added by another process meanwhile
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except (IOError, OSError):
+            return
+        self.evict()
+
+    def _entries(self):
+        """Return list of (mtime, size, entry_dir) of all cached SRPMs"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.'):
+                continue
+            entry_dir = os.path.join(self.cache_dir, key)
+            try:
+                for filename in os.listdir(entry_dir):
+                    st = os.stat(os.path.join(entry_dir, filename))
+                    entries.append((st.st_mtime, st.st_size, entry_dir))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Remove entries which are too old or exceed the size limit"""
+        try:
+            entries = sorted(self._entries(), reverse=True)
+        except OSError:
+            return
+        oldest_allowed = time.time() - self.max_age
+        total_size = 0
+        for mtime, size, entry_dir in entries:
+            total_size += size
+            if mtime < oldest_allowed or total_size > self.max_size:
+                shutil.rmtree(entry_dir, ignore_errors=True)
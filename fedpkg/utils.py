@@ -11,6 +11,7 @@
 # the full text of the license.
 
 import json
+import os
 import re
 from datetime import datetime
 
@@ -21,6 +22,14 @@ from six.moves.configparser import NoOptionError, NoSectionError
 from six.moves.urllib.parse import urlencode, urlparse
 
 from pyrpkg import rpkgError
+from pyrpkg.errors import MalformedLineError
+from pyrpkg.sources import (LINE_PATTERN, BSDSourceFileEntry,
+                            SourceFileEntry)
+
+# How repositories could be cloned. full clones whole history, blobless
+# downloads file contents on demand and shallow clones only the tip of
+# a single branch.
+CLONE_MODES = ('full', 'blobless', 'shallow')
 
 
 def query_pdc(server_url, endpoint, params, timeout=60):
@@ -141,6 +150,98 @@ def new_pagure_issue(logger, url, token, title, body, cli_name):
         url.rstrip('/'), rv.json()['issue']['id'])
 
 
+def get_pagure_issue(url, issue_id):
+    """
+    Gets an issue of the SCM requests project in Pagure
+    :param url: a string of the URL to Pagure
+    :param issue_id: ID of the issue, as an integer or a string
+    :return: a dict of the issue as returned by Pagure API, containing status,
+    close_status and comments among others
+    """
+    issue_url = '{0}/api/0/releng/fedora-scm-requests/issue/{1}'.format(
+        url.rstrip('/'), issue_id)
+    try:
+        rv = requests.get(issue_url, timeout=60)
+    except ConnectionError as error:
+        raise rpkgError('The connection to Pagure failed while trying to get '
+                        'issue {0}. The error was: {1}'.format(
+                            issue_id, str(error)))
+    if not rv.ok:
+        raise rpkgError('The following error occurred while getting issue '
+                        '{0} from Pagure: {1}'.format(issue_id, rv.text))
+    return rv.json()
+
+
+def new_repo_ticket(repo_name, ns, branch=None, bug=None, description=None,
+                    summary=None, upstreamurl=None, monitor=None,
+                    exception=None, initial_commit=True):
+    """
+    Formats a request for a new dist-git repository
+    :param repo_name: a string of the repository name
+    :param ns: a string of the repository namespace
+    :return: a tuple of the ticket title and body
+    """
+    if ns == 'tests':
+        ticket_body = {
+            'action': 'new_repo',
+            'branch': 'master',
+            'bug_id': bug or '',
+            'monitor': 'no-monitoring',
+            'namespace': 'tests',
+            'repo': repo_name,
+            'description': description,
+        }
+    else:
+        ticket_body = {
+            'action': 'new_repo',
+            'branch': branch,
+            'bug_id': bug or '',
+            'description': description or '',
+            'exception': exception,
+            'monitor': monitor,
+            'namespace': ns,
+            'repo': repo_name,
+            'summary': summary,
+            'upstreamurl': upstreamurl or ''
+        }
+        if not initial_commit:
+            ticket_body['initial_commit'] = False
+
+    ticket_body = json.dumps(ticket_body, indent=True)
+    ticket_body = '```\n{0}\n```'.format(ticket_body)
+    ticket_title = 'New Repo for "{0}/{1}"'.format(ns, repo_name)
+    return ticket_title, ticket_body
+
+
+def new_branch_ticket(repo_name, ns, branch, create_git_branch=True,
+                      sls=None):
+    """
+    Formats a request for a new branch of a dist-git repository
+    :param repo_name: a string of the repository name
+    :param ns: a string of the repository namespace
+    :param branch: a string of the requested branch
+    :param create_git_branch: a bool; False if the branch should be created in
+    PDC only
+    :param sls: an optional dict of service levels and their EOL dates
+    :return: a tuple of the ticket title and body
+    """
+    ticket_body = {
+        'action': 'new_branch',
+        'branch': branch,
+        'namespace': ns,
+        'repo': repo_name,
+        'create_git_branch': create_git_branch
+    }
+    if sls:
+        ticket_body['sls'] = sls
+
+    ticket_body = json.dumps(ticket_body, indent=True)
+    ticket_body = '```\n{0}\n```'.format(ticket_body)
+    ticket_title = 'New Branch "{0}" for "{1}/{2}"'.format(
+        branch, ns, repo_name)
+    return ticket_title, ticket_body
+
+
 def do_fork(logger, base_url, token, repo_name, namespace, cli_name):
     """
     Creates a fork of the project.
@@ -560,3 +661,47 @@ def config_get_safely(config, section, option):
         raise rpkgError("{0}\n{1}".format(msg, hint))
     except Exception:
         raise
+
+
+def get_cache_dir(*names):
+    """
+    Returns path of a fedpkg cache directory. It is located in the
+    XDG_CACHE_HOME directory (~/.cache by default). The directory is not
+    created by this function.
+
+    :param names: names of subdirectories under fedpkg's cache directory.
+    :return: path of the cache directory
+    :rtype: str
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'fedpkg', *names)
+
+
+def parse_sources_line(line):
+    """
+    Parses a line of a sources file without reading any sources file from
+    the working tree, e.g. a line of the sources file of another branch.
+
+    :param str line: a line in either the BSD or the old format.
+    :return: the source file entry, or None if the line is blank.
+    :rtype: SourceFileEntry
+    :raises MalformedLineError: if the line is in neither format.
+    """
+    stripped = line.strip()
+    if not stripped:
+        return None
+
+    m = LINE_PATTERN.match(stripped)
+    if m is not None:
+        return BSDSourceFileEntry(m.group('hashtype'), m.group('file'),
+                                  m.group('hash'))
+
+    try:
+        hash, filename = stripped.split('  ', 1)
+    except ValueError:
+        raise MalformedLineError(
+            'sources has invalid content: {0}\n'
+            'Please note that sources file must not be modified manually.'
+            .format(stripped))
+    return SourceFileEntry('md5', filename, hash)
@@ -0,0 +1,350 @@
+# Copyright (c) 2020 - Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+
+"""Discover and index package checkouts in a directory tree
+
+Packagers keep hundreds of dist-git checkouts side by side, often grouped by
+namespace. Commands working on all of them start from here.
+
+Answering which checkout is on which branch at which NVR would mean walking
+every repository and evaluating specs. The workspace index keeps that in a
+SQLite database, refreshed only for checkouts whose refs changed since the
+last update, so that queries are answered without touching the checkouts.
+"""
+
+
+import fnmatch
+import logging
+import os
+import sqlite3
+
+import git
+
+from pyrpkg import rpkgError
+
+log = logging.getLogger(__name__)
+
+# Bump when the database schema changes, the index is rebuilt then.
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE checkouts (
+    path TEXT PRIMARY KEY,
+    repo_name TEXT,
+    namespace TEXT,
+    head_branch TEXT,
+    head TEXT,
+    stamp TEXT
+);
+CREATE TABLE branches (
+    path TEXT,
+    branch TEXT,
+    commit_id TEXT,
+    nvr TEXT,
+    error TEXT,
+    PRIMARY KEY (path, branch)
+);
+CREATE TABLE sources (
+    path TEXT,
+    branch TEXT,
+    file TEXT,
+    hashtype TEXT,
+    hash TEXT
+);
+CREATE INDEX sources_branch ON sources (path, branch);
+CREATE INDEX sources_hash ON sources (hash);
+"""
+
+
+def find_checkouts(root, max_depth=2):
+    """Find git checkouts under a directory
+
+    A directory containing .git is a checkout, and directories inside a
+    checkout are not searched. Hidden directories are skipped.
+
+    :param str root: directory to search.
+    :param int max_depth: how many levels of directories below root are
+        searched, e.g. 2 finds both root/pkg and root/rpms/pkg.
+    :return: sorted absolute paths of checkouts.
+    :rtype: list[str]
+    """
+    root = os.path.abspath(root)
+    root_depth = root.rstrip(os.sep).count(os.sep)
+    checkouts = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if '.git' in dirnames or '.git' in filenames:
+            checkouts.append(dirpath)
+            dirnames[:] = []
+        elif dirpath.rstrip(os.sep).count(os.sep) - root_depth >= max_depth:
+            dirnames[:] = []
+        else:
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+    return sorted(checkouts)
+
+
+def _git_dir(path):
+    """Return the git directory holding refs of a checkout"""
+    git_dir = os.path.join(path, '.git')
+    if os.path.isfile(git_dir):
+        # Worktree or submodule, .git points to the real directory
+        with open(git_dir, 'r') as f:
+            content = f.read().strip()
+        if content.startswith('gitdir:'):
+            git_dir = os.path.join(path, content[len('gitdir:'):].strip())
+    return git_dir
+
+
+def refs_stamp(path):
+    """Return a stamp of a checkout changing whenever its branches change
+
+    The stamp is made of modification times of HEAD, packed refs and loose
+    refs of local branches, so computing it costs a few stat calls.
+
+    :param str path: path to the checkout.
+    :rtype: str
+    """
+    git_dir = _git_dir(path)
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        with open(commondir_file, 'r') as f:
+            common_dir = os.path.join(git_dir, f.read().strip())
+
+    mtimes = []
+    for filename in (os.path.join(git_dir, 'HEAD'),
+                     os.path.join(common_dir, 'packed-refs')):
+        try:
+            mtimes.append(os.stat(filename).st_mtime)
+        except OSError:
+            mtimes.append(0)
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(
+            os.path.join(common_dir, 'refs', 'heads')):
+        # Directory mtime changes when a branch is deleted
+        mtimes.append(os.stat(dirpath).st_mtime)
+        for filename in filenames:
+            mtimes.append(os.stat(os.path.join(dirpath, filename)).st_mtime)
+            count += 1
+    return '{0!r}:{1!r}:{2}'.format(mtimes[0], max(mtimes[1:]), count)
+
+
+class WorkspaceIndex(object):
+    """SQLite index of package checkouts
+
+    Checkouts are keyed by absolute path. Every local branch of a checkout is
+    recorded with its commit, NVR and sources file entries.
+
+    :param str db_file: path to the database file. It is created if missing.
+    """
+
+    def __init__(self, db_file):
+        db_dir = os.path.dirname(db_file)
+        if db_dir and not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.db = sqlite3.connect(db_file)
+        self.db.row_factory = sqlite3.Row
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._create_schema()
+
+    def _create_schema(self):
+        for table in ('checkouts', 'branches', 'sources'):
+            self.db.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = {0}'.format(SCHEMA_VERSION))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _stored_stamp(self, path):
+        row = self.db.execute('SELECT stamp FROM checkouts WHERE path = ?',
+                              (path,)).fetchone()
+        return row['stamp'] if row else None
+
+    def _stored_commits(self, path):
+        return dict(
+            (row['branch'], row['commit_id']) for row in self.db.execute(
+                'SELECT branch, commit_id FROM branches WHERE path = ?',
+                (path,)))
+
+    def _forget(self, path, branches=None):
+        """Remove a checkout, or some of its branches, from the index"""
+        tables = ('branches', 'sources') if branches is not None else (
+            'checkouts', 'branches', 'sources')
+        for table in tables:
+            if branches is None:
+                self.db.execute(
+                    'DELETE FROM {0} WHERE path = ?'.format(table), (path,))
+                continue
+            for branch in branches:
+                self.db.execute(
+                    'DELETE FROM {0} WHERE path = ? AND branch = ?'.format(
+                        table), (path, branch))
+
+    def update_checkout(self, path, commands_factory, workers=4):
+        """Refresh index of a checkout if its refs changed
+
+        Only branches whose commit changed since the last update are
+        evaluated again.
+
+        :param str path: absolute path to the checkout.
+        :param commands_factory: a callable returning Commands working on
+            the checkout at given path.
+        :param int workers: how many specs are evaluated at once.
+        :return: True if the checkout was refreshed, False if it was up to
+            date.
+        :rtype: bool
+        """
+        stamp = refs_stamp(path)
+        if stamp == self._stored_stamp(path):
+            return False
+
+        cmd = commands_factory(path)
+        heads = {}
+        output = cmd.repo.git.for_each_ref(
+            '--format=%(objectname) %(refname)', 'refs/heads')
+        for line in output.splitlines():
+            sha, refname = line.split(' ', 1)
+            heads[refname[len('refs/heads/'):]] = sha
+        try:
+            head_branch = cmd.repo.active_branch.name
+        except TypeError:
+            # Detached HEAD
+            head_branch = None
+        head = heads.get(head_branch) or cmd.repo.git.rev_parse('HEAD')
+
+        stored = self._stored_commits(path)
+        changed = sorted(branch for branch, sha in heads.items()
+                         if stored.get(branch) != sha)
+        rows = []
+        if changed:
+            rows = cmd.branches_report(branches=changed, workers=workers,
+                                       local=True)
+
+        self._forget(path, [branch for branch in stored
+                            if branch not in heads or branch in changed])
+        self.db.execute(
+            'INSERT OR REPLACE INTO checkouts '
+            '(path, repo_name, namespace, head_branch, head, stamp) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (path, cmd.repo_name, cmd.ns, head_branch, head, stamp))
+        for row in rows:
+            self.db.execute(
+                'INSERT INTO branches (path, branch, commit_id, nvr, error) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (path, row['branch'], heads[row['branch']], row['nvr'],
+                 row['error']))
+            self.db.executemany(
+                'INSERT INTO sources (path, branch, file, hashtype, hash) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(path, row['branch'], filename, hashtype, hash)
+                 for hashtype, filename, hash in row['entries']])
+        self.db.commit()
+        return True
+
+    def update(self, root, paths, commands_factory, workers=4):
+        """Refresh index of checkouts found under a directory
+
+        Checkouts indexed under root which do not exist anymore are removed
+        from the index. A checkout which cannot be indexed is skipped and
+        tried again next time.
+
+        :param str root: directory where the checkouts were searched.
+        :param paths: absolute paths to checkouts found in root.
+        :type paths: list[str]
+        :param commands_factory: see :meth:`update_checkout`.
+        :param int workers: how many specs are evaluated at once.
+        :return: tuple of numbers of refreshed, unchanged, failed and removed
+            checkouts.
+        :rtype: tuple
+        """
+        refreshed = unchanged = failed = 0
+        for path in paths:
+            try:
+                if self.update_checkout(path, commands_factory, workers):
+                    refreshed += 1
+                else:
+                    unchanged += 1
+            except (rpkgError, git.GitError, IOError, OSError) as e:
+                self.db.rollback()
+                log.warning('Cannot index %s: %s', path, e)
+                failed += 1
+
+        prefix = os.path.join(os.path.abspath(root), '')
+        found = set(paths)
+        removed = [row['path'] for row in self.db.execute(
+            'SELECT path FROM checkouts')
+            if row['path'].startswith(prefix) and row['path'] not in found]
+        for path in removed:
+            self._forget(path)
+        self.db.commit()
+        return refreshed, unchanged, failed, len(removed)
+
+    def query(self, name=None, namespace=None, branch=None, nvr=None,
+              hash=None, head_only=False):
+        """Find indexed branches of checkouts
+
+        :param str name: glob pattern matching repository names.
+        :param str namespace: namespace of repositories, e.g. rpms.
+        :param str branch: glob pattern matching branch names.
+        :param str nvr: glob pattern matching NVRs.
+        :param str hash: hash of a source file the branch has to contain.
+        :param bool head_only: only report branches checked out currently.
+        :return: mappings of path, repo_name, namespace, branch, head which is
+            True for the branch checked out, commit, nvr, error and sources
+            as lists of hash type, file name and hash, ordered by path and
+            branch.
+        :rtype: list[dict]
+        """
+        sql = ('SELECT c.path, c.repo_name, c.namespace, c.head_branch, '
+               'b.branch, b.commit_id, b.nvr, b.error '
+               'FROM checkouts c JOIN branches b ON b.path = c.path')
+        conditions = []
+        params = []
+        if namespace:
+            conditions.append('c.namespace = ?')
+            params.append(namespace)
+        if head_only:
+            conditions.append('b.branch = c.head_branch')
+        if hash:
+            conditions.append(
+                'EXISTS (SELECT 1 FROM sources s WHERE s.path = b.path '
+                'AND s.branch = b.branch AND s.hash = ?)')
+            params.append(hash)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY c.path, b.branch'
+
+        results = []
+        for row in self.db.execute(sql, params):
+            if name and not fnmatch.fnmatchcase(row['repo_name'] or '', name):
+                continue
+            if branch and not fnmatch.fnmatchcase(row['branch'], branch):
+                continue
+            if nvr and not fnmatch.fnmatchcase(row['nvr'] or '', nvr):
+                continue
+            results.append({
+                'path': row['path'],
+                'repo_name': row['repo_name'],
+                'namespace': row['namespace'],
+                'branch': row['branch'],
+                'head': row['branch'] == row['head_branch'],
+                'commit': row['commit_id'],
+                'nvr': row['nvr'],
+                'error': row['error'],
+                'sources': [
+                    [source['hashtype'], source['file'], source['hash']]
+                    for source in self.db.execute(
+                        'SELECT hashtype, file, hash FROM sources '
+                        'WHERE path = ? AND branch = ? ORDER BY file',
+                        (row['path'], row['branch']))],
+            })
+        return results
@@ -14,6 +14,7 @@ import io
 import json
 import os
 import re
+import shutil
 import sys
 from datetime import datetime, timedelta
 from os import rmdir
@@ -22,7 +23,7 @@ from tempfile import mkdtemp, mkstemp
 import git
 import pkg_resources
 import six
-from mock import Mock, PropertyMock, call, patch
+from mock import ANY, Mock, PropertyMock, call, patch
 from six.moves import StringIO
 from six.moves.configparser import NoOptionError, NoSectionError
 
@@ -113,10 +114,6 @@ class TestUpdate(CliTestCase):
                                   return_value='someone')
         self.mock_user = self.user_patcher.start()
 
-        # Not write clog actually.
-        self.clog_patcher = patch('fedpkg.Commands.clog')
-        self.clog_patcher.start()
-
         # Logs will be read in the tests which do not specify --notes option
         self.fake_clog = list(six.moves.map(six.u, [
             'Add tests for command update',
@@ -126,9 +123,10 @@ class TestUpdate(CliTestCase):
             'fix: rh#10001'
             'Fixes: rhbz#20001'
         ]))
-        clog_file = os.path.join(self.cloned_repo_path, 'clog')
-        with io.open(clog_file, 'w', encoding='utf-8') as f:
-            f.write(os.linesep.join(self.fake_clog))
+        self.changelog_patcher = patch(
+            'fedpkg.Commands.changelog',
+            return_value=os.linesep.join(self.fake_clog))
+        self.changelog_patcher.start()
 
         # Get 'bodhi_client' version. Particular versions have differences
         # across distributions.
@@ -145,10 +143,9 @@ class TestUpdate(CliTestCase):
             os.unlink('bodhi.template')
         if os.path.exists('bodhi.template.last'):
             os.unlink('bodhi.template.last')
-        os.unlink(os.path.join(self.cloned_repo_path, 'clog'))
         self.user_patcher.stop()
         self.os_environ_patcher.stop()
-        self.clog_patcher.stop()
+        self.changelog_patcher.stop()
         self.check_bodhi_version_patcher.stop()
         self.run_command_patcher.stop()
         self.nvr_patcher.stop()
@@ -220,10 +217,7 @@ class TestUpdate(CliTestCase):
             send_request.assert_called_once_with(
                 'updates/', verb='POST', auth=True, data=expected_data)
 
-            unlink.assert_has_calls([
-                call('bodhi.template'),
-                call(os.path.join(cli.cmd.path, 'clog'))
-            ], any_order=True)
+            unlink.assert_called_once_with('bodhi.template')
 
         with io.open('bodhi.template', encoding='utf-8') as f:
             bodhi_template = f.read()
@@ -2310,6 +2304,639 @@ class TestBuildFromStreamBranch(CliTestCase):
         self.assertEqual([1, 2], task_ids)
 
 
+class TestMockbuildAllTargets(CliTestCase):
+    """Test mockbuild --all-targets"""
+
+    def setUp(self):
+        super(TestMockbuildAllTargets, self).setUp()
+        self.patchers = [
+            patch('fedpkg.cli.get_release_branches',
+                  return_value={'fedora': ['f31', 'f30'],
+                                'epel': ['el6', 'epel7']}),
+            patch('fedpkg.cli.fedpkgClient.sources'),
+            patch('fedpkg.Commands._mockbuild_releases'),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(TestMockbuildAllTargets, self).tearDown()
+
+    def get_cli(self, options):
+        cli_cmd = ['fedpkg', '--path', self.cloned_repo_path,
+                   'mockbuild', '--all-targets'] + options
+        with patch('sys.argv', new=cli_cmd):
+            return self.new_cli()
+
+    def test_build_for_configured_targets(self):
+        self.write_file(os.path.join(self.cloned_repo_path, 'package.cfg'),
+                        '[koji]\ntargets = fedora epel7')
+        cli = self.get_cli(['--parallel', '3', '--no-clean'])
+        cli.mockbuild()
+
+        self.assertEqual(['epel7', 'f30', 'f31'], cli.cmd.mockbuild_releases)
+        self.assertEqual(3, cli.cmd.mockbuild_parallel)
+        cli.cmd._mockbuild_releases.assert_called_once_with(
+            ['--no-clean'], hashtype=None)
+
+    def test_fail_if_no_targets_configured(self):
+        cli = self.get_cli([])
+        six.assertRaisesRegex(
+            self, rpkgError, 'No build target is configured', cli.mockbuild)
+
+    def test_cannot_use_with_shell(self):
+        cli = self.get_cli(['--shell'])
+        six.assertRaisesRegex(
+            self, rpkgError, 'cannot be used with --all-targets',
+            cli.mockbuild)
+
+
+class TestUploadFileForBuild(CliTestCase):
+    """Test uploading SRPM once for builds of several targets"""
+
+    def setUp(self):
+        super(TestUploadFileForBuild, self).setUp()
+        self.srpm = os.path.join(self.cloned_repo_path, 'pkg.src.rpm')
+        self.write_file(self.srpm, 'srpm')
+
+    def get_cli(self):
+        cli_cmd = ['fedpkg', '--path', self.cloned_repo_path, 'scratch-build']
+        with patch('sys.argv', new=cli_cmd):
+            return self.new_cli()
+
+    @patch('pyrpkg.cli.cliClient._upload_file_for_build')
+    def test_upload_once(self, upload):
+        upload.side_effect = ['cli-build/1', 'cli-build/2']
+        cli = self.get_cli()
+
+        self.assertEqual('cli-build/1', cli._upload_file_for_build(self.srpm))
+        self.assertEqual('cli-build/1', cli._upload_file_for_build(self.srpm))
+        upload.assert_called_once_with(self.srpm, name=None)
+
+    @patch('pyrpkg.cli.cliClient._upload_file_for_build')
+    def test_upload_again_if_file_changes(self, upload):
+        upload.side_effect = ['cli-build/1', 'cli-build/2']
+        cli = self.get_cli()
+
+        cli._upload_file_for_build(self.srpm)
+        self.write_file(self.srpm, 'rebuilt srpm')
+        self.assertEqual('cli-build/2', cli._upload_file_for_build(self.srpm))
+
+
+@patch('subprocess.Popen')
+@patch('fedpkg.Commands.clone')
+class TestPrefetchOnClone(CliTestCase):
+    """Test prefetching source files after clone"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestPrefetchOnClone, self).setUp()
+        self.path = mkdtemp(prefix='fedpkg-test-clone-')
+        os.makedirs(os.path.join(self.path, 'pkg', '.git'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestPrefetchOnClone, self).tearDown()
+
+    def clone(self, options):
+        cli_cmd = ['fedpkg', '--path', self.path, 'clone'] + options + ['pkg']
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli()
+        cli.cmd.lookaside_store_dir = os.path.join(self.path, 'store')
+        cli.clone()
+        return cli
+
+    def test_start_prefetch_in_background(self, clone, Popen):
+        self.clone(['--prefetch-sources'])
+
+        repo_dir = os.path.join(self.path, 'pkg')
+        cmd = Popen.call_args[0][0]
+        self.assertEqual(['--path', repo_dir, 'prefetch-sources'], cmd[-3:])
+        self.assertTrue(os.path.exists(
+            os.path.join(repo_dir, '.git', 'fedpkg-prefetch.log')))
+
+    def test_no_prefetch_by_default(self, clone, Popen):
+        self.clone([])
+
+        self.assertEqual(1, clone.call_count)
+        Popen.assert_not_called()
+
+    def test_no_prefetch_without_store(self, clone, Popen):
+        cli_cmd = ['fedpkg', '--path', self.path, 'clone',
+                   '--prefetch-sources', 'pkg']
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli()
+        cli.clone()
+
+        Popen.assert_not_called()
+
+
+@patch('fedpkg.Commands.clone_batch')
+class TestCloneBatch(CliTestCase):
+    """Test clone --batch"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestCloneBatch, self).setUp()
+        fd, self.batch_file = mkstemp(prefix='fedpkg-test-batch-')
+        os.close(fd)
+        self.addCleanup(os.remove, self.batch_file)
+        with open(self.batch_file, 'w') as f:
+            f.write('# packages\npkg\nrpms/other\n\npkg\n')
+
+    def clone(self, options):
+        cli_cmd = ['fedpkg', '--path', '/ws', 'clone'] + options
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli()
+        with patch('sys.stdout', new=six.StringIO()):
+            try:
+                cli.clone()
+            finally:
+                self.output = sys.stdout.getvalue().strip()
+
+    def test_clone_batch(self, clone_batch):
+        clone_batch.return_value = [('pkg', None), ('rpms/other', None)]
+
+        self.clone(['--batch', self.batch_file, '--parallel', '8', '-a'])
+
+        clone_batch.assert_called_once_with(
+            ['pkg', 'rpms/other'], anon=True, depth=None, reference_dir=None,
+            workers=8, report=ANY)
+        self.assertEqual('Cloned 2 of 2 repositories.', self.output)
+
+    def test_read_stdin(self, clone_batch):
+        clone_batch.return_value = [('pkg', None)]
+
+        with patch('sys.stdin', new=six.StringIO('pkg\n')):
+            self.clone(['--batch', '-'])
+
+        self.assertEqual(['pkg'], clone_batch.call_args[0][0])
+
+    def test_report_failures(self, clone_batch):
+        clone_batch.return_value = [('pkg', None), ('rpms/other', 'denied')]
+
+        six.assertRaisesRegex(self, rpkgError, 'Failed to clone: rpms/other',
+                              self.clone, ['--batch', self.batch_file])
+        self.assertEqual('Cloned 1 of 2 repositories.', self.output)
+
+    def test_batch_with_repo(self, clone_batch):
+        six.assertRaisesRegex(self, rpkgError, 'cannot be combined',
+                              self.clone, ['--batch', self.batch_file, 'pkg'])
+        clone_batch.assert_not_called()
+
+    def test_missing_reference(self, clone_batch):
+        six.assertRaisesRegex(
+            self, rpkgError, 'does not exist', self.clone,
+            ['--batch', self.batch_file, '--reference', '/nonexistent'])
+
+    def test_repo_is_required(self, clone_batch):
+        six.assertRaisesRegex(self, rpkgError, 'Repository to clone',
+                              self.clone, [])
+
+
+class TestCloneMode(CliTestCase):
+    """Test clone modes"""
+
+    require_test_repos = False
+
+    def get_cli(self, options=[]):
+        cli_cmd = ['fedpkg', '--path', '/ws', 'clone'] + options + ['pkg']
+        with patch('sys.argv', new=cli_cmd):
+            return self.new_cli()
+
+    def test_load_clone_modes(self):
+        cli = self.get_cli()
+        cli.config.set('fedpkg', 'clone_mode_rpms', 'shallow')
+        cli.config.set('fedpkg', 'clone_mode_modules', 'blobless')
+
+        self.assertEqual({'rpms': 'shallow', 'modules': 'blobless'},
+                         cli.cmd.clone_modes)
+
+    def test_invalid_clone_mode(self):
+        cli = self.get_cli()
+        cli.config.set('fedpkg', 'clone_mode_rpms', 'sparse')
+
+        six.assertRaisesRegex(self, rpkgError,
+                              'Invalid value of option clone_mode_rpms',
+                              getattr, cli, 'cmd')
+
+    @patch('fedpkg.Commands.clone')
+    def test_mode_option(self, clone):
+        cli = self.get_cli(['--mode', 'blobless'])
+        cli.clone()
+
+        self.assertEqual('blobless', cli.cmd.clone_mode)
+        self.assertEqual(1, clone.call_count)
+
+
+@patch('fedpkg.Commands.branches_report')
+class TestBranchesReport(CliTestCase):
+    """Test command branches-report"""
+
+    require_test_repos = False
+
+    rows = [
+        {'branch': 'f31', 'nvr': 'pkg-1.0-1.fc31', 'behind': 2,
+         'sources': ['a.tar.gz'], 'sources_group': 1, 'error': None},
+        {'branch': 'f32', 'nvr': None, 'behind': 0,
+         'sources': [], 'sources_group': None, 'error': 'No spec file'},
+        {'branch': 'master', 'nvr': 'pkg-1.0-1.fc33', 'behind': 0,
+         'sources': ['a.tar.gz'], 'sources_group': 1, 'error': None},
+    ]
+
+    def setUp(self):
+        super(TestBranchesReport, self).setUp()
+        self.path = mkdtemp(prefix='fedpkg-test-branches-report-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestBranchesReport, self).tearDown()
+
+    def get_output(self, options):
+        cli_cmd = ['fedpkg', '--path', self.path, 'branches-report'] + options
+        with patch('sys.argv', cli_cmd):
+            cli = self.new_cli()
+            with patch('sys.stdout', new=six.StringIO()):
+                cli.show_branches_report()
+                return sys.stdout.getvalue().strip()
+
+    def test_print_matrix(self, branches_report):
+        branches_report.return_value = self.rows
+        output = self.get_output(['--branches', 'f31', 'f32', 'master'])
+
+        expected = [
+            'BRANCH  NVR                  BEHIND  SOURCES',
+            'f31     pkg-1.0-1.fc31       2       1',
+            'f32     error: No spec file  0       -',
+            'master  pkg-1.0-1.fc33       0       1',
+            '',
+            'Branches with identical sources:',
+            '  1: f31 master',
+        ]
+        self.assertEqual('\n'.join(expected), output)
+        branches_report.assert_called_once_with(
+            branches=['f31', 'f32', 'master'], workers=4)
+
+    def test_print_json(self, branches_report):
+        branches_report.return_value = self.rows
+        output = self.get_output(['--json', '--parallel', '2'])
+
+        self.assertEqual(self.rows, json.loads(output))
+        branches_report.assert_called_once_with(branches=None, workers=2)
+
+    def test_invalid_parallel(self, branches_report):
+        six.assertRaisesRegex(
+            self, rpkgError, 'greater than zero',
+            self.get_output, ['--parallel', '0'])
+
+
+@patch('fedpkg.Commands.sync_branches')
+class TestSyncBranches(CliTestCase):
+    """Test command sync-branches"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestSyncBranches, self).setUp()
+        self.path = mkdtemp(prefix='fedpkg-test-sync-branches-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(TestSyncBranches, self).tearDown()
+
+    def sync(self, options):
+        cli_cmd = ['fedpkg', '--path', self.path, 'sync-branches'] + options
+        with patch('sys.argv', cli_cmd):
+            cli = self.new_cli()
+            with patch('sys.stdout', new=six.StringIO()):
+                try:
+                    cli.sync_branches()
+                finally:
+                    self.output = sys.stdout.getvalue().strip()
+
+    @patch('fedpkg.cli.get_release_branches',
+           return_value={'epel': ['epel8'], 'fedora': ['f32', 'f31']})
+    def test_sync_active_releases(self, get_release_branches, sync_branches):
+        sync_branches.return_value = [
+            ('f32', 'updated'), ('f31', 'up-to-date'), ('epel8', 'missing')]
+        self.sync([])
+
+        sync_branches.assert_called_once_with(
+            ['f32', 'f31', 'epel8'], source='master', push=True)
+        self.assertEqual('f32: updated\nf31: up-to-date\nepel8: missing',
+                         self.output)
+
+    def test_sync_selected_branches(self, sync_branches):
+        sync_branches.return_value = [('f32', 'updated')]
+        self.sync(['--branches', 'f32', '--from', 'f33', '--no-push'])
+
+        sync_branches.assert_called_once_with(['f32'], source='f33',
+                                              push=False)
+
+    def test_fail_if_not_synced(self, sync_branches):
+        sync_branches.return_value = [
+            ('f32', 'not fast-forward'), ('f31', 'updated')]
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'Branches not synced: f32$',
+            self.sync, ['--branches', 'f32', 'f31'])
+        self.assertEqual('f32: not fast-forward\nf31: updated', self.output)
+
+
+@patch('fedpkg.cli.run_foreach')
+@patch('fedpkg.cli.find_checkouts', return_value=['/ws/a', '/ws/rpms/b'])
+class TestForeach(CliTestCase):
+    """Test command foreach"""
+
+    require_test_repos = False
+
+    def foreach(self, options):
+        cli_cmd = ['fedpkg', '--path', '/ws', 'foreach'] + options
+        with patch('sys.argv', cli_cmd):
+            cli = self.new_cli()
+            with patch('sys.stdout', new=six.StringIO()):
+                try:
+                    cli.foreach()
+                finally:
+                    self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    def test_run_commands(self, find_checkouts, run_foreach):
+        run_foreach.return_value = [('/ws/a', None, ''),
+                                    ('/ws/rpms/b', None, '')]
+        cli = self.foreach(['--parallel', '8', 'pull', ';', 'sources'])
+
+        find_checkouts.assert_called_once_with('/ws', max_depth=2)
+        run_foreach.assert_called_once_with(
+            cli, ['/ws/a', '/ws/rpms/b'], [['pull'], ['sources']], 8,
+            report=ANY)
+        self.assertEqual('2 of 2 checkouts succeeded.', self.output)
+
+    def test_summarize_failures(self, find_checkouts, run_foreach):
+        def fake_run_foreach(client, paths, steps, workers, report):
+            report('/ws/a', None, 'Downloading a.tar.gz\n')
+            report('/ws/rpms/b', 'Branch is dirty', '')
+            return [('/ws/a', None, 'Downloading a.tar.gz\n'),
+                    ('/ws/rpms/b', 'Branch is dirty', '')]
+
+        run_foreach.side_effect = fake_run_foreach
+
+        six.assertRaisesRegex(self, rpkgError, '1 checkouts failed',
+                              self.foreach, ['--', 'pull'])
+        expected = [
+            '==> /ws/a <==',
+            'Downloading a.tar.gz',
+            '==> /ws/rpms/b <==',
+            'FAILED: Branch is dirty',
+            '',
+            '1 of 2 checkouts succeeded.',
+            '  /ws/rpms/b: Branch is dirty',
+        ]
+        self.assertEqual('\n'.join(expected), self.output)
+
+    def test_no_command(self, find_checkouts, run_foreach):
+        six.assertRaisesRegex(self, rpkgError, 'No command',
+                              self.foreach, [])
+        run_foreach.assert_not_called()
+
+    def test_no_nested_foreach(self, find_checkouts, run_foreach):
+        six.assertRaisesRegex(self, rpkgError, 'cannot be nested',
+                              self.foreach, ['foreach', 'pull'])
+
+    def test_no_checkouts(self, find_checkouts, run_foreach):
+        find_checkouts.return_value = []
+
+        six.assertRaisesRegex(self, rpkgError, 'No package checkouts',
+                              self.foreach, ['pull'])
+
+    def test_check_commands_first(self, find_checkouts, run_foreach):
+        with patch('sys.stderr', new=six.StringIO()):
+            self.assertRaises(SystemExit, self.foreach, ['unknown-command'])
+        run_foreach.assert_not_called()
+
+
+@patch('fedpkg.Commands.anon_kojisession', new_callable=PropertyMock)
+@patch('fedpkg.Commands.kojisession', new_callable=PropertyMock)
+@patch('fedpkg.cli.RebuildScheduler')
+class TestMassRebuild(CliTestCase):
+    """Test command mass-rebuild"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestMassRebuild, self).setUp()
+        self.path = mkdtemp(prefix='fedpkg-test-mass-rebuild-')
+        self.addCleanup(shutil.rmtree, self.path)
+        self.state_file = os.path.join(self.path, 'fedpkg-rebuild.json')
+
+    def mass_rebuild(self, options):
+        cli_cmd = ['fedpkg', '--path', self.path, 'mass-rebuild'] + options
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli()
+        with patch('sys.stdout', new=six.StringIO()):
+            try:
+                cli.mass_rebuild()
+            finally:
+                self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    @patch('fedpkg.cli.find_checkouts', return_value=['/ws/lib', '/ws/app'])
+    def test_dry_run(self, find_checkouts, RebuildScheduler, kojisession,
+                     anon_kojisession):
+        scheduler = RebuildScheduler.return_value
+        scheduler.state.waves = [['/ws/lib'], ['/ws/app']]
+        scheduler.state.packages = {
+            '/ws/lib': {'nvr': 'lib-2.0-1.fc33'},
+            '/ws/app': {'nvr': 'app-1.0-2.fc33'},
+        }
+
+        self.mass_rebuild(['--dry-run', '--side-tag', 'f33-build-side-1'])
+
+        self.assertEqual(anon_kojisession.return_value,
+                         RebuildScheduler.call_args[0][0])
+        self.assertEqual('f33-build-side-1',
+                         RebuildScheduler.call_args[1]['side_tag'])
+        scheduler.plan.assert_called_once_with(['/ws/lib', '/ws/app'],
+                                               workers=4)
+        scheduler.run.assert_not_called()
+        self.assertEqual('Wave 1: lib-2.0-1.fc33\nWave 2: app-1.0-2.fc33',
+                         self.output)
+
+    def test_continue_from_state(self, RebuildScheduler, kojisession,
+                                 anon_kojisession):
+        with open(self.state_file, 'w') as f:
+            json.dump({'format': 1, 'waves': [['/ws/lib']],
+                       'packages': {'/ws/lib': {}}, 'ready_waves': 0}, f)
+        RebuildScheduler.return_value.state.packages = {'/ws/lib': {}}
+
+        cli = self.mass_rebuild([])
+
+        state = RebuildScheduler.call_args[0][2]
+        self.assertEqual([['/ws/lib']], state.waves)
+        RebuildScheduler.return_value.plan.assert_not_called()
+        RebuildScheduler.return_value.run.assert_called_once_with()
+        self.assertEqual(self.path, cli.args.path)
+        self.assertEqual('Continuing rebuild from {0}\n'
+                         'All 1 packages are built.'.format(self.state_file),
+                         self.output)
+
+    def test_side_tag_and_override(self, RebuildScheduler, kojisession,
+                                   anon_kojisession):
+        with patch('sys.stderr', new=six.StringIO()):
+            self.assertRaises(SystemExit, self.mass_rebuild,
+                              ['--side-tag', 'tag', '--override'])
+
+
+@patch('fedpkg.Commands.target', new_callable=PropertyMock,
+       return_value='f33-candidate')
+@patch('fedpkg.Commands.nvr', new_callable=PropertyMock,
+       return_value='pkg-1.0-1.fc33')
+@patch('fedpkg.Commands.construct_build_url',
+       return_value='git+https://src.fedoraproject.org/rpms/pkg.git#abc')
+@patch('fedpkg.Commands.check_repo')
+@patch('fedpkg.Commands.kojisession', new_callable=PropertyMock)
+@patch('fedpkg.cli.submit_builds')
+class TestMassBuild(CliTestCase):
+    """Test command mass-build"""
+
+    require_test_repos = False
+
+    def mass_build(self, options):
+        cli_cmd = ['fedpkg', '--path', '/ws', 'mass-build'] + options
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.cli = self.new_cli()
+        with patch('sys.stdout', new=six.StringIO()):
+            try:
+                cli.mass_build()
+            finally:
+                self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    def test_submit(self, submit_builds, kojisession, check_repo, *args):
+        def _submit(session, builds, **kwargs):
+            builds[0]['task_id'] = 42
+
+        submit_builds.side_effect = _submit
+        check_repo.side_effect = [None, rpkgError('has uncommitted changes')]
+
+        with six.assertRaisesRegex(self, rpkgError,
+                                   '1 builds were not submitted'):
+            self.mass_build(['--background', '--scratch', '/ws/pkg',
+                             '/ws/dirty'])
+
+        session, builds = submit_builds.call_args[0]
+        self.assertEqual(kojisession.return_value, session)
+        self.assertEqual([
+            {'path': '/ws/pkg', 'nvr': 'pkg-1.0-1.fc33', 'task_id': 42,
+             'url': 'git+https://src.fedoraproject.org/rpms/pkg.git#abc',
+             'target': 'f33-candidate'},
+            {'path': '/ws/dirty', 'nvr': None,
+             'error': 'has uncommitted changes'},
+        ], builds)
+        self.assertEqual({'opts': {'scratch': True}, 'priority': 5,
+                          'nvr_check': False}, submit_builds.call_args[1])
+        # Koji login happens once for all checkouts
+        self.assertEqual(1, kojisession.call_count)
+        self.assertEqual('/ws', self.cli.args.path)
+        self.assertEqual(
+            'CHECKOUT   NVR             TASK\n'
+            '/ws/pkg    pkg-1.0-1.fc33  42\n'
+            '/ws/dirty  -               error: has uncommitted changes\n'
+            '\n'
+            'Submitted 1 of 2 builds.', self.output)
+
+    @patch('fedpkg.cli.find_checkouts', return_value=['/ws/a', '/ws/b'])
+    def test_checkouts_in_path(self, find_checkouts, submit_builds,
+                               kojisession, *args):
+        def _submit(session, builds, **kwargs):
+            for build in builds:
+                build['error'] = 'Destination tag is locked'
+
+        submit_builds.side_effect = _submit
+        six.assertRaisesRegex(self, rpkgError, '2 builds were not submitted',
+                              self.mass_build, ['--target', 'f33-build-side-1'])
+
+        find_checkouts.assert_called_once_with('/ws', max_depth=2)
+        builds = submit_builds.call_args[0][1]
+        self.assertEqual(['/ws/a', '/ws/b'],
+                         [build['path'] for build in builds])
+        self.assertEqual(['f33-build-side-1'] * 2,
+                         [build['target'] for build in builds])
+        self.assertTrue(submit_builds.call_args[1]['nvr_check'])
+        self.assertIn('Submitted 0 of 2 builds.', self.output)
+
+
+@patch('fedpkg.cli.WorkspaceIndex')
+class TestWorkspace(CliTestCase):
+    """Test command ws"""
+
+    require_test_repos = False
+
+    def ws(self, options):
+        with patch('sys.argv', ['fedpkg', '--path', '/ws', 'ws'] + options):
+            cli = self.new_cli()
+            with patch('sys.stdout', new=six.StringIO()):
+                try:
+                    cli.args.command()
+                finally:
+                    self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    @patch('fedpkg.cli.find_checkouts', return_value=['/ws/a', '/ws/b'])
+    def test_update(self, find_checkouts, WorkspaceIndex):
+        index = WorkspaceIndex.return_value
+        index.update.return_value = (1, 1, 0, 0)
+
+        cli = self.ws(['update', '--depth', '1'])
+
+        find_checkouts.assert_called_once_with('/ws', max_depth=1)
+        index.update.assert_called_once_with(
+            '/ws', ['/ws/a', '/ws/b'], ANY, workers=4)
+        index.close.assert_called_once_with()
+        self.assertEqual('/ws', cli.args.path)
+        self.assertEqual('Indexed 2 checkouts: 1 refreshed, 1 unchanged, '
+                         '0 failed, 0 removed.', self.output)
+
+    @patch('fedpkg.cli.find_checkouts', return_value=['/ws/a'])
+    def test_update_failed(self, find_checkouts, WorkspaceIndex):
+        WorkspaceIndex.return_value.update.return_value = (0, 0, 1, 0)
+
+        six.assertRaisesRegex(self, rpkgError, '1 checkouts could not',
+                              self.ws, ['update'])
+
+    def test_query(self, WorkspaceIndex):
+        index = WorkspaceIndex.return_value
+        index.query.return_value = [
+            {'path': '/ws/a', 'branch': 'f32', 'head': True,
+             'nvr': 'a-1.0-1.fc32', 'error': None},
+            {'path': '/ws/b', 'branch': 'master', 'head': False,
+             'nvr': None, 'error': 'No spec file'},
+        ]
+
+        self.ws(['query', '--branch', 'f3*', '--head'])
+
+        index.query.assert_called_once_with(
+            name=None, namespace=None, branch='f3*', nvr=None, hash=None,
+            head_only=True)
+        expected = [
+            'PATH   BRANCH  NVR',
+            '/ws/a  f32 *   a-1.0-1.fc32',
+            '/ws/b  master  error: No spec file',
+        ]
+        self.assertEqual('\n'.join(expected), self.output)
+
+    def test_query_json(self, WorkspaceIndex):
+        WorkspaceIndex.return_value.query.return_value = []
+
+        self.ws(['query', '--json'])
+
+        self.assertEqual([], json.loads(self.output))
+
+
 @patch('fedpkg.cli.get_release_branches',
        return_value={
            'epel': ['el6', 'epel7'],
@@ -2341,6 +2968,64 @@ class TestReleasesInfo(CliTestCase):
         self.assert_output_releases('Fedora: f29 f28\nEPEL: el6 epel7')
 
 
+class TestDistInfo(CliTestCase):
+    """Test command dist-info"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestDistInfo, self).setUp()
+        self.localarch = patch('pyrpkg.Commands.localarch',
+                               new_callable=PropertyMock,
+                               return_value='x86_64')
+        self.localarch.start()
+        self.findmasterbranch = patch('fedpkg.Commands._findmasterbranch',
+                                      return_value='32')
+        self.findmasterbranch.start()
+        self.path = mkdtemp(prefix='fedpkg-test-dist-info-')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        self.findmasterbranch.stop()
+        self.localarch.stop()
+        super(TestDistInfo, self).tearDown()
+
+    def get_output(self, options):
+        cli_cmd = ['fedpkg', '--path', self.path, 'dist-info'] + options
+        with patch('sys.argv', cli_cmd):
+            cli = self.new_cli()
+            with patch('sys.stdout', new=six.StringIO()):
+                cli.show_dist_info()
+                return sys.stdout.getvalue().strip()
+
+    def test_print_dist_values(self):
+        output = self.get_output(['--branches', 'master', 'f31', 'foo'])
+
+        expected = [
+            'master: distval=32 distvar=fedora disttag=fc32 '
+            'mockconfig=fedora-rawhide-x86_64 override=None distunset=rhel',
+            'f31: distval=31 distvar=fedora disttag=fc31 '
+            'mockconfig=fedora-31-x86_64 override=f31-override distunset=rhel',
+            'foo: unknown',
+        ]
+        self.assertEqual('\n'.join(expected), output)
+
+    def test_print_json(self):
+        output = self.get_output(['--branches', 'epel8', 'foo', '--json'])
+
+        self.assertEqual({
+            'epel8': {
+                'distval': '8',
+                'distvar': 'rhel',
+                'disttag': 'el8',
+                'mockconfig': 'epel-8-x86_64',
+                'override': 'epel8-override',
+                'distunset': 'fedora',
+            },
+            'foo': None,
+        }, json.loads(output))
+
+
 class TestRetire(CliTestCase):
     """
     Test retire operation with additional fedpkg Fedora release checking
@@ -2398,3 +3083,178 @@ class TestRetire(CliTestCase):
         self.retire_release("epel7", "pending")
         self.retire_release("epel7", None)
         self.retire_release("epel8", None)
+
+
+@patch('fedpkg.Commands.push', autospec=True)
+@patch('fedpkg.Commands.retire', autospec=True)
+@patch('fedpkg.Commands.ns', new_callable=PropertyMock, return_value='rpms')
+@patch('fedpkg.Commands.branch_merge', new_callable=PropertyMock)
+@patch('requests.get')
+class TestRetireBatch(CliTestCase):
+    """Test command retire --batch"""
+
+    require_test_repos = False
+
+    def setUp(self):
+        super(TestRetireBatch, self).setUp()
+        self.path = mkdtemp(prefix='fedpkg-test-retire-batch-')
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def checkout(self, name, retired=False):
+        path = os.path.join(self.path, name)
+        os.mkdir(path)
+        if retired:
+            with open(os.path.join(path, 'dead.package'), 'w') as f:
+                f.write('Retired\n')
+        return path
+
+    def retire_batch(self, entries, options=()):
+        batch_file = os.path.join(self.path, 'retire.txt')
+        with open(batch_file, 'w') as f:
+            f.write('\n'.join(entries) + '\n')
+        cli_cmd = ['fedpkg', '--path', self.path, 'retire', '--batch',
+                   batch_file] + list(options) + ['Orphaned for 6+ weeks']
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli(cfg='fedpkg-test.conf')
+        with patch('sys.stdout', new=six.StringIO()):
+            try:
+                cli.retire()
+            finally:
+                self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    def release_states(self, get, states):
+        def _get(url, timeout):
+            rv = Mock()
+            state = states[url.rsplit('/', 1)[-1]]
+            if state:
+                rv.ok = True
+                rv.json.return_value = {'state': state}
+            else:
+                rv.ok = False
+                rv.status_code = 404
+            return rv
+
+        get.side_effect = _get
+
+    def test_retire(self, get, branch_merge, ns, retire, push):
+        self.release_states(get, {'f30': 'pending', 'f31': 'current'})
+        branch_merge.side_effect = ['f30', 'f30', 'f31', 'epel8']
+        paths = [self.checkout('a'), self.checkout('b'), self.checkout('c'),
+                 self.checkout('d', retired=True), self.checkout('e')]
+
+        six.assertRaisesRegex(self, rpkgError, '2 packages were not retired',
+                              self.retire_batch, paths, ['--parallel', '2'])
+
+        # Release state is looked up once per Fedora release
+        self.assertEqual(2, get.call_count)
+        self.assertEqual(
+            sorted([paths[0], paths[1], paths[4]]),
+            sorted(call_args[0][0].path for call_args in retire.call_args_list))
+        retire.assert_called_with(ANY, 'Orphaned for 6+ weeks')
+        self.assertEqual(3, push.call_count)
+        self.assertEqual(
+            'Retired 3 of 5 packages.\n'
+            'Refused:\n'
+            "  {0}: Fedora release (f31) is in state 'current'\n"
+            '  {1}: already retired'.format(paths[2], paths[3]),
+            self.output)
+
+    def test_clone_missing_repos(self, get, branch_merge, ns, retire, push):
+        self.release_states(get, {'master': None})
+        branch_merge.return_value = 'master'
+        existing = self.checkout('foo')
+
+        with patch('fedpkg.Commands.clone_batch',
+                   return_value=[('rpms/bar', None)]) as clone_batch:
+            cli = self.retire_batch(['foo', 'rpms/bar'])
+
+        clone_batch.assert_called_once_with(['rpms/bar'], path=self.path,
+                                            workers=4)
+        self.assertEqual(
+            sorted([existing, os.path.join(self.path, 'bar')]),
+            sorted(call_args[0][0].path for call_args in retire.call_args_list))
+        self.assertEqual(self.path, cli.args.path)
+        self.assertEqual('Retired 2 of 2 packages.', self.output)
+
+    def test_failed_clone(self, get, branch_merge, ns, retire, push):
+        with patch('fedpkg.Commands.clone_batch',
+                   return_value=[('rpms/bar', 'Connection refused')]):
+            six.assertRaisesRegex(self, rpkgError, 'Failed to clone: rpms/bar',
+                                  self.retire_batch, ['rpms/bar'])
+        retire.assert_not_called()
+
+
+@patch('fedpkg.cli.get_release_branches',
+       return_value={'fedora': ['f32', 'f33'], 'epel': ['epel7', 'epel8']})
+@patch('fedpkg.cli.Onboarding')
+class TestOnboard(CliTestCase):
+    """Test command onboard"""
+
+    require_test_repos = False
+
+    def onboard(self, options):
+        cli_cmd = ['fedpkg-stage', '--path', '/ws', 'onboard'] + options
+        with patch('sys.argv', new=cli_cmd):
+            cli = self.new_cli(name='fedpkg-stage', cfg='fedpkg-stage.conf',
+                               user_cfg='fedpkg-user-stage.conf')
+        with patch('sys.stdout', new=six.StringIO()):
+            try:
+                cli.onboard()
+            finally:
+                self.output = sys.stdout.getvalue().strip()
+        return cli
+
+    def test_onboard(self, Onboarding, get_release_branches):
+        Onboarding.return_value.run.return_value = [
+            {'name': 'foo', 'error': None,
+             'repo_ticket': 'https://pagure/issue/1'},
+            {'name': 'bar', 'error': 'validation failed: not approved',
+             'repo_ticket': None},
+        ]
+
+        six.assertRaisesRegex(
+            self, rpkgError, '1 packages were not onboarded', self.onboard,
+            ['--branch', 'f33', '--branch', 'epel8', '--no-clone', 'foo:1234',
+             'bar:1235'])
+
+        args, kwargs = Onboarding.call_args
+        self.assertEqual(['f33', 'epel8', 'epel8-playground'], args[4])
+        self.assertIsNone(kwargs['clone'])
+        self.assertIsNone(kwargs['dist_git_url'])
+        self.assertEqual(24 * 3600, kwargs['timeout'])
+        Onboarding.return_value.run.assert_called_once_with(
+            [('foo', 1234), ('bar', 1235)])
+        self.assertEqual(
+            'NAME  REPOSITORY REQUEST      STATUS\n'
+            'foo   https://pagure/issue/1  onboarded\n'
+            'bar   -                       error: validation failed: '
+            'not approved\n'
+            '\n'
+            'Onboarded 1 of 2 packages.', self.output)
+
+    def test_batch(self, Onboarding, get_release_branches):
+        Onboarding.return_value.run.return_value = []
+        fd, batch_file = mkstemp(prefix='fedpkg-test-onboard-')
+        self.addCleanup(os.unlink, batch_file)
+        with os.fdopen(fd, 'w') as f:
+            f.write('# reviewed last week\nfoo 1234\nbar:1235\n')
+
+        self.onboard(['--batch', batch_file, '--tests', 'baz:1236'])
+
+        Onboarding.return_value.run.assert_called_once_with(
+            [('baz', 1236), ('foo', 1234), ('bar', 1235)])
+        self.assertEqual([], Onboarding.call_args[0][4])
+        self.assertIsNotNone(Onboarding.call_args[1]['clone'])
+        self.assertIsNotNone(Onboarding.call_args[1]['dist_git_url'])
+        get_release_branches.assert_not_called()
+
+    def test_invalid_package(self, Onboarding, get_release_branches):
+        six.assertRaisesRegex(self, rpkgError, 'Invalid package foo',
+                              self.onboard, ['foo'])
+        Onboarding.assert_not_called()
+
+    def test_not_release_branch(self, Onboarding, get_release_branches):
+        six.assertRaisesRegex(self, rpkgError, 'f99 is not a release branch',
+                              self.onboard, ['--branch', 'f99', 'foo:1'])
+        Onboarding.assert_not_called()
@@ -9,11 +9,17 @@
 # option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
 # the full text of the license.
 
+import hashlib
+import os
+import shutil
+import tempfile
+
+import git
 import six
-from mock import Mock, PropertyMock, call, mock_open, patch
+from mock import ANY, Mock, PropertyMock, call, mock_open, patch
 from six.moves import builtins
 
-from pyrpkg.errors import rpkgError
+from pyrpkg.errors import DownloadError, UploadError, rpkgError
 from utils import CommandTestCase
 
 
@@ -152,6 +158,622 @@ class TestLookaside(CommandTestCase):
         self.assertEqual(self.cmd.lookasidehash, lookaside.hashtype)
         self.assertEqual(self.cmd.lookaside, lookaside.download_url)
         self.assertEqual(self.cmd.lookaside_cgi, lookaside.upload_url)
+        self.assertIsNone(lookaside.store)
+
+    def test_get_lookaside_with_store(self):
+        self.cmd.lookaside_store_dir = '/var/cache/lookaside'
+        self.cmd.lookaside_store_max_size = 1024
+        lookaside = self.cmd.lookasidecache
+
+        self.assertEqual('/var/cache/lookaside', lookaside.store.store_dir)
+        self.assertEqual(1024, lookaside.store.max_size)
+
+    def test_get_lookaside_with_mirrors(self):
+        self.cmd.lookaside_mirrors = ['http://a/pkgs', 'http://b/pkgs']
+        lookaside = self.cmd.lookasidecache
+
+        self.assertEqual(['http://a/pkgs', 'http://b/pkgs'], lookaside.mirrors)
+        self.assertTrue(lookaside.mirror_stats.stats_file.endswith(
+            os.path.join('fedpkg', 'mirrors.json')))
+
+
+class TestSources(CommandTestCase):
+    """Test Commands.sources"""
+
+    def setUp(self):
+        super(TestSources, self).setUp()
+        self.cmd = self.make_commands()
+        self.write_file(self.cmd.sources_filename, os.linesep.join([
+            'SHA512 (a.tar.gz) = {0}'.format('a' * 128),
+            'SHA512 (b.tar.gz) = {0}'.format('b' * 128),
+            'SHA512 (c.tar.gz) = {0}'.format('c' * 128),
+        ]) + os.linesep)
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.download')
+    def test_download_all_files(self, download):
+        self.cmd.sources()
+
+        self.assertEqual(3, download.call_count)
+        download.assert_any_call(
+            ANY, 'b.tar.gz', 'b' * 128,
+            os.path.join(self.cmd.path, 'b.tar.gz'), hashtype='sha512')
+        self.assertTrue(self.cmd.lookasidecache.show_progress)
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.download')
+    def test_download_one_by_one(self, download):
+        self.cmd.sources_parallel = 1
+        self.cmd.sources()
+
+        self.assertEqual(3, download.call_count)
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.download')
+    def test_isolate_failures(self, download):
+        def fake_download(name, filename, *args, **kwargs):
+            if filename == 'b.tar.gz':
+                raise DownloadError('Server returned status code 404')
+        download.side_effect = fake_download
+
+        six.assertRaisesRegex(
+            self, DownloadError, 'Failed to download b.tar.gz$',
+            self.cmd.sources)
+        self.assertEqual(3, download.call_count)
+
+
+class RemoteBranchesTestCase(CommandTestCase):
+    """Base test case changing branches of the remote repository"""
+
+    def commit_sources(self, branch, filenames):
+        self.run_cmd(['git', 'checkout', branch], cwd=self.repo_path)
+        self.write_file(os.path.join(self.repo_path, 'sources'), ''.join(
+            'SHA512 ({0}) = {1}\n'.format(
+                filename,
+                hashlib.sha512(filename.encode('utf-8')).hexdigest())
+            for filename in filenames))
+        # Branches sharing history and sources must not end up with the same
+        # commit, which happens if both are committed within a second.
+        self.run_cmd(['git', 'commit', '-a', '-m',
+                      'Update sources of {0}'.format(branch)],
+                     cwd=self.repo_path)
+        self.run_cmd(['git', 'checkout', 'master'], cwd=self.repo_path)
+
+    def fetch(self):
+        self.run_cmd(['git', 'fetch', 'origin'], cwd=self.cloned_repo_path)
+
+
+class TestPrefetchSources(RemoteBranchesTestCase):
+    """Test Commands.prefetch_sources"""
+
+    def setUp(self):
+        super(TestPrefetchSources, self).setUp()
+        self.commit_sources('f26', ['a.tar.gz', 'b.tar.gz'])
+        self.commit_sources('f27', ['b.tar.gz', 'c.tar.gz'])
+        self.fetch()
+
+        self.cmd = self.make_commands()
+        self.cmd.lookaside_store_dir = os.path.join(self.cloned_repo_path,
+                                                    'store')
+
+        patcher = patch('fedpkg.lookaside.FedoraLookasideCache.prefetch',
+                        return_value=True)
+        self.prefetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def prefetched_files(self):
+        return sorted(args[1] for args, kwargs in self.prefetch.call_args_list)
+
+    def test_remote_release_branches(self):
+        self.assertEqual(['f26', 'f27', 'master'],
+                         self.cmd._remote_release_branches())
+
+    def test_read_sources_without_checkout(self):
+        entries = self.cmd._branch_sources('origin/f27')
+
+        self.assertEqual(['b.tar.gz', 'c.tar.gz'],
+                         [entry.file for entry in entries])
+        self.assertEqual('', self.read_file(self.cmd.sources_filename))
+
+    def test_prefetch_once_per_hash(self):
+        self.assertEqual(3, self.cmd.prefetch_sources())
+
+        self.assertEqual(['a.tar.gz', 'b.tar.gz', 'c.tar.gz'],
+                         self.prefetched_files())
+
+    def test_prefetch_selected_branches(self):
+        self.cmd.prefetch_sources(branches=['f27'])
+
+        self.assertEqual(['b.tar.gz', 'c.tar.gz'], self.prefetched_files())
+
+    def test_count_downloaded_files_only(self):
+        self.prefetch.side_effect = [True, False, False]
+
+        self.assertEqual(1, self.cmd.prefetch_sources())
+
+    def test_isolate_failures(self):
+        def fake_prefetch(name, filename, hash, hashtype=None):
+            if filename == 'a.tar.gz':
+                raise DownloadError('Server returned status code 404')
+            return True
+
+        self.prefetch.side_effect = fake_prefetch
+
+        six.assertRaisesRegex(
+            self, DownloadError, 'Failed to prefetch a.tar.gz$',
+            self.cmd.prefetch_sources)
+        self.assertEqual(3, self.prefetch.call_count)
+
+    def test_require_store(self):
+        self.cmd.lookaside_store_dir = None
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'lookaside_store',
+            self.cmd.prefetch_sources)
+
+
+class TestBranchesReport(RemoteBranchesTestCase):
+    """Test Commands.branches_report"""
+
+    def setUp(self):
+        super(TestBranchesReport, self).setUp()
+        self.commit_sources('master', ['a.tar.gz'])
+        self.commit_sources('f26', ['a.tar.gz'])
+        self.commit_sources('f27', ['b.tar.gz'])
+        self.fetch()
+
+        self.cmd = self.make_commands()
+        for patcher in (
+                patch('pyrpkg.Commands.localarch', new_callable=PropertyMock,
+                      return_value='x86_64'),
+                patch('fedpkg.Commands._findmasterbranch', return_value='28'),
+                patch('fedpkg.Commands._evaluate_spec_file',
+                      side_effect=self.fake_evaluate)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.evaluated = []
+
+    def fake_evaluate(self, spec_file, rpmdefines):
+        self.evaluated.append(os.path.basename(spec_file))
+        disttag = [define for define in rpmdefines
+                   if define.startswith("--define 'dist ")][0]
+        return {'name': 'docpkg', 'epoch': '0', 'version': '1.2',
+                'release': '2' + disttag.split('.')[-1].rstrip("'"),
+                'changelog': ''}
+
+    def test_report(self):
+        rows = self.cmd.branches_report()
+
+        self.assertEqual(['f26', 'f27', 'master'],
+                         [row['branch'] for row in rows])
+        self.assertEqual(['docpkg-1.2-2fc26', 'docpkg-1.2-2fc27',
+                          'docpkg-1.2-2fc28'],
+                         [row['nvr'] for row in rows])
+        self.assertEqual([1, 1, 0], [row['behind'] for row in rows])
+        self.assertEqual([['a.tar.gz'], ['b.tar.gz'], ['a.tar.gz']],
+                         [row['sources'] for row in rows])
+        self.assertEqual(rows[0]['sources_group'], rows[2]['sources_group'])
+        self.assertNotEqual(rows[0]['sources_group'], rows[1]['sources_group'])
+        self.assertEqual(['docpkg.spec'] * 3, self.evaluated)
+
+    def test_selected_branches(self):
+        rows = self.cmd.branches_report(branches=['f27'], workers=1)
+
+        self.assertEqual(['f27'], [row['branch'] for row in rows])
+        self.assertIsNone(rows[0]['error'])
+
+    def test_report_local_branches(self):
+        rows = self.cmd.branches_report(branches=['f26', 'master'],
+                                        local=True)
+
+        self.assertEqual(['docpkg-1.2-2fc26', 'docpkg-1.2-2fc28'],
+                         [row['nvr'] for row in rows])
+        # Sources were committed to the remote branches only
+        self.assertEqual([[], []], [row['entries'] for row in rows])
+
+    def test_report_errors_per_branch(self):
+        rows = self.cmd.branches_report(branches=['rhel-7', 'f26', 'f99'])
+
+        self.assertEqual('Unknown release branch', rows[0]['error'])
+        self.assertEqual('docpkg-1.2-2fc26', rows[1]['nvr'])
+        self.assertIsNotNone(rows[2]['error'])
+
+    def test_working_tree_is_untouched(self):
+        self.cmd.branches_report()
+
+        self.assertEqual('master', self.cmd.repo.active_branch.name)
+        self.assertEqual('', self.read_file(self.cmd.sources_filename))
+
+
+class TestSyncBranches(RemoteBranchesTestCase):
+    """Test Commands.sync_branches"""
+
+    def setUp(self):
+        super(TestSyncBranches, self).setUp()
+        self.cmd = self.make_commands()
+        self.write_file(os.path.join(self.cloned_repo_path, 'CHANGELOG.rst'),
+                        'changed')
+        self.run_cmd(['git', 'commit', '-a', '-m', 'Update changelog'],
+                     cwd=self.cloned_repo_path)
+        self.master = self.local_tip('master')
+
+    def local_tip(self, branch):
+        return self.cmd.repo.git.rev_parse(branch)
+
+    def remote_tip(self, branch):
+        return git.Repo(self.repo_path).git.rev_parse(branch)
+
+    def test_fast_forward_and_push(self):
+        results = self.cmd.sync_branches(['f26', 'f27'])
+
+        self.assertEqual([('f26', 'updated'), ('f27', 'updated')], results)
+        for branch in ('f26', 'f27'):
+            self.assertEqual(self.master, self.local_tip(branch))
+            self.assertEqual(self.master, self.remote_tip(branch))
+            self.assertEqual(self.master, self.local_tip('origin/' + branch))
+        self.assertEqual('master', self.cmd.repo.active_branch.name)
+
+    def test_up_to_date(self):
+        self.cmd.sync_branches(['f26'])
+
+        with patch('fedpkg.Commands._run_command') as run_command:
+            results = self.cmd.sync_branches(['f26'])
+        self.assertEqual([('f26', 'up-to-date')], results)
+        run_command.assert_not_called()
+
+    def test_skip_diverged_branch(self):
+        self.commit_sources('f27', ['a.tar.gz'])
+        self.fetch()
+        f27 = self.remote_tip('f27')
+
+        results = self.cmd.sync_branches(['f26', 'f27'])
+
+        self.assertEqual([('f26', 'updated'), ('f27', 'not fast-forward')],
+                         results)
+        self.assertEqual(f27, self.remote_tip('f27'))
+
+    def test_skip_checked_out_branch(self):
+        self.run_cmd(['git', 'checkout', '-q', 'f26'],
+                     cwd=self.cloned_repo_path)
+
+        results = self.cmd.sync_branches(['f26'])
+
+        self.assertEqual([('f26', 'checked out')], results)
+        self.assertNotEqual(self.master, self.remote_tip('f26'))
+
+    def test_missing_branch(self):
+        with patch('fedpkg.Commands._run_command') as run_command:
+            results = self.cmd.sync_branches(['f99'])
+
+        self.assertEqual([('f99', 'missing')], results)
+        run_command.assert_not_called()
+
+    def test_no_push(self):
+        f26 = self.remote_tip('f26')
+
+        with patch('fedpkg.Commands._run_command') as run_command:
+            results = self.cmd.sync_branches(['f26', 'rhel-6.8'], push=False)
+
+        self.assertEqual([('f26', 'updated'), ('rhel-6.8', 'updated')],
+                         results)
+        run_command.assert_not_called()
+        self.assertEqual(f26, self.remote_tip('f26'))
+        self.assertEqual(self.master, self.local_tip('f26'))
+        self.assertEqual(self.master, self.local_tip('rhel-6.8'))
+
+    def test_missing_source_branch(self):
+        six.assertRaisesRegex(
+            self, rpkgError, 'Branch foo does not exist',
+            self.cmd.sync_branches, ['f26'], source='foo')
+
+
+class TestCloneBatch(CommandTestCase):
+    """Test Commands.clone_batch"""
+
+    def setUp(self):
+        super(TestCloneBatch, self).setUp()
+        self.cmd = self.make_commands()
+        self.cmd.distgit_namespaced = True
+        self.cmd.clone_configs = {
+            'rpms': 'bz.default-component %(repo)s\n'
+                    'bz.default-product Fedora Modules',
+        }
+        self.target_dir = tempfile.mkdtemp(prefix='fedpkg-test-clone-batch-')
+        self.addCleanup(shutil.rmtree, self.target_dir)
+        patcher = patch('fedpkg.Commands._get_namespace_anongiturl',
+                        side_effect=self.giturl)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def giturl(self, repo):
+        if self.cmd.get_base_repo(repo) == 'docpkg':
+            return self.repo_path
+        return os.path.join(self.target_dir, 'missing.git')
+
+    def test_clone_and_configure(self):
+        reported = []
+        results = self.cmd.clone_batch(
+            ['docpkg', 'rpms/missing'], path=self.target_dir, anon=True,
+            workers=2, report=lambda repo, error: reported.append(repo))
+
+        self.assertEqual(['docpkg', 'rpms/missing'],
+                         [repo for repo, error in results])
+        self.assertIsNone(results[0][1])
+        self.assertIsNotNone(results[1][1])
+        self.assertEqual(['docpkg', 'rpms/missing'], sorted(reported))
+
+        clone = git.Repo(os.path.join(self.target_dir, 'docpkg'))
+        self.assertEqual('docpkg',
+                         clone.git.config('--get', 'bz.default-component'))
+        self.assertEqual('Fedora Modules',
+                         clone.git.config('--get', 'bz.default-product'))
+        self.assertEqual('true',
+                         clone.git.config('--get', 'credential.useHttpPath'))
+        self.assertTrue(clone.git.rev_parse('origin/f27'))
+
+    def test_skip_existing_directory(self):
+        os.mkdir(os.path.join(self.target_dir, 'docpkg'))
+
+        results = self.cmd.clone_batch(['docpkg'], path=self.target_dir,
+                                       anon=True)
+
+        six.assertRegex(self, results[0][1], 'exists')
+
+    def test_borrow_objects_from_reference(self):
+        reference_dir = os.path.join(self.target_dir, 'mirrors')
+        mirror_dir = os.path.join(reference_dir, 'rpms', 'docpkg.git')
+        self.run_cmd(['git', 'clone', '-q', '--mirror', self.repo_path,
+                      mirror_dir])
+
+        results = self.cmd.clone_batch(['docpkg'], path=self.target_dir,
+                                       anon=True, reference_dir=reference_dir)
+
+        self.assertIsNone(results[0][1])
+        alternates = os.path.join(self.target_dir, 'docpkg', '.git',
+                                  'objects', 'info', 'alternates')
+        with open(alternates, 'r') as f:
+            self.assertEqual(os.path.join(mirror_dir, 'objects'),
+                             f.read().strip())
+
+    def test_clone_without_namespaces(self):
+        self.cmd.distgit_namespaced = False
+        self.cmd.clone_config = 'bz.default-component %(repo)s'
+        reference_dir = os.path.join(self.target_dir, 'mirrors')
+        mirror_dir = os.path.join(reference_dir, 'docpkg.git')
+        self.run_cmd(['git', 'clone', '-q', '--mirror', self.repo_path,
+                      mirror_dir])
+
+        results = self.cmd.clone_batch(['docpkg'], path=self.target_dir,
+                                       anon=True, reference_dir=reference_dir)
+
+        self.assertIsNone(results[0][1])
+        clone = git.Repo(os.path.join(self.target_dir, 'docpkg'))
+        # Config of the rpms namespace does not apply
+        self.assertEqual('docpkg',
+                         clone.git.config('--get', 'bz.default-component'))
+        self.assertRaises(git.GitCommandError, clone.git.config,
+                          '--get', 'bz.default-product')
+        alternates = os.path.join(self.target_dir, 'docpkg', '.git',
+                                  'objects', 'info', 'alternates')
+        with open(alternates, 'r') as f:
+            self.assertEqual(os.path.join(mirror_dir, 'objects'),
+                             f.read().strip())
+
+
+class TestCloneModes(CommandTestCase):
+    """Test Commands.clone with clone modes"""
+
+    def setUp(self):
+        super(TestCloneModes, self).setUp()
+        self.cmd = self.make_commands()
+        self.cmd.distgit_namespaced = True
+        self.target_dir = tempfile.mkdtemp(prefix='fedpkg-test-clone-mode-')
+        self.addCleanup(shutil.rmtree, self.target_dir)
+        # Local clones ignore --depth unless file:// is used
+        patcher = patch('fedpkg.Commands._get_namespace_anongiturl',
+                        return_value='file://' + self.repo_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mode_options(self):
+        self.cmd.clone_modes = {'rpms': 'blobless', 'modules': 'shallow'}
+
+        self.assertEqual(['--filter=blob:none'],
+                         self.cmd._clone_mode_options('pkg'))
+        self.assertEqual(['--depth', '1', '--single-branch'],
+                         self.cmd._clone_mode_options('modules/pkg'))
+        self.assertEqual(['--depth', '5'],
+                         self.cmd._clone_mode_options('container/pkg', '5'))
+        self.cmd.clone_mode = 'full'
+        self.assertEqual([], self.cmd._clone_mode_options('pkg'))
+
+    def test_full_clone(self):
+        self.cmd.clone('docpkg', self.target_dir, anon=True)
+
+        clone = git.Repo(os.path.join(self.target_dir, 'docpkg'))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.target_dir, 'docpkg', '.git', 'shallow')))
+        self.assertRaises(git.GitCommandError, clone.git.config,
+                          '--get', 'remote.origin.partialclonefilter')
+        self.assertTrue(clone.git.rev_parse('origin/f27'))
+
+    def test_configure_like_clone_batch(self):
+        self.cmd.clone_configs = {
+            'rpms': 'bz.default-component %(repo)s\n'
+                    'bz.default-product Fedora Modules',
+        }
+        self.cmd.clone('docpkg', self.target_dir, anon=True)
+        batch_dir = os.path.join(self.target_dir, 'batch')
+        os.mkdir(batch_dir)
+        self.cmd.clone_batch(['docpkg'], path=batch_dir, anon=True)
+
+        def config(path):
+            return git.Repo(path).git.config('--local', '--list')
+
+        self.assertEqual(config(os.path.join(batch_dir, 'docpkg')),
+                         config(os.path.join(self.target_dir, 'docpkg')))
+        six.assertRegex(self, config(os.path.join(batch_dir, 'docpkg')),
+                        'bz.default-product=Fedora Modules')
+
+    @patch('pyrpkg.Commands.clone')
+    def test_leave_unknown_options_to_rpkg(self, clone):
+        self.cmd.clone_modes = {'rpms': 'shallow'}
+        self.cmd.clone('docpkg', path=self.target_dir, anon=True,
+                       skip_hooks=True)
+
+        clone.assert_called_once_with('docpkg', path=self.target_dir,
+                                      anon=True, skip_hooks=True)
+
+    def test_blobless_clone_positional_options(self):
+        self.cmd.clone_modes = {'rpms': 'blobless'}
+
+        self.cmd.clone('docpkg', self.target_dir, 'f27', None, True)
+
+        clone = self.make_commands(path=os.path.join(self.target_dir,
+                                                     'docpkg'))
+        self.assertEqual('f27', clone.repo.active_branch.name)
+        self.assertEqual('blob:none', clone.repo.git.config(
+            '--get', 'remote.origin.partialclonefilter'))
+
+    def test_shallow_clone(self):
+        self.cmd.clone_modes = {'rpms': 'shallow'}
+
+        self.cmd.clone('docpkg', path=self.target_dir, branch='f27',
+                       anon=True)
+
+        repo_dir = os.path.join(self.target_dir, 'docpkg')
+        self.assertTrue(os.path.exists(
+            os.path.join(repo_dir, '.git', 'shallow')))
+        clone = self.make_commands(path=repo_dir)
+        self.assertEqual('f27', clone.repo.active_branch.name)
+        self.assertEqual(
+            'refs/remotes/origin/f27',
+            clone.repo.git.for_each_ref('--format=%(refname)',
+                                        'refs/remotes/origin/f*'))
+        # Other release branches are listed from the remote
+        self.assertEqual([26, 27], clone._remote_fedora_versions())
+        self.assertEqual('f27', clone.branch_merge)
+
+
+class TestIncrementalSources(CommandTestCase):
+    """Test Commands.sources syncing only changed entries"""
+
+    def setUp(self):
+        super(TestIncrementalSources, self).setUp()
+        self.cmd = self.make_commands()
+        self.write_sources(['a.tar.gz', 'b.tar.gz'])
+
+        patcher = patch('fedpkg.lookaside.FedoraLookasideCache.download',
+                        side_effect=self.fake_download)
+        self.download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_sources(self, filenames):
+        self.write_file(self.cmd.sources_filename, ''.join(
+            'SHA512 ({0}) = {1}\n'.format(
+                filename,
+                hashlib.sha512(filename.encode('utf-8')).hexdigest())
+            for filename in filenames))
+
+    def fake_download(self, name, filename, hash, outfile, hashtype):
+        self.write_file(outfile, filename)
+        os.utime(outfile, (0, 0))
+        self.cmd.lookasidecache.hashcache.set(outfile, hashtype, hash)
+
+    def downloaded_files(self):
+        return sorted(c[0][1] for c in self.download.call_args_list)
+
+    def test_download_only_new_entries(self):
+        self.cmd.sources()
+        self.write_sources(['a.tar.gz', 'b.tar.gz', 'c.tar.gz'])
+        self.download.reset_mock()
+        self.cmd.sources()
+
+        self.assertEqual(['c.tar.gz'], self.downloaded_files())
+
+    def test_download_modified_files_again(self):
+        self.cmd.sources()
+        self.write_file(os.path.join(self.cmd.path, 'a.tar.gz'), 'modified')
+        self.download.reset_mock()
+        self.cmd.sources()
+
+        self.assertEqual(['a.tar.gz'], self.downloaded_files())
+
+    def test_remove_files_not_listed_anymore(self):
+        self.cmd.sources()
+        self.write_sources(['b.tar.gz'])
+        self.download.reset_mock()
+        self.cmd.sources()
+
+        self.assertEqual([], self.downloaded_files())
+        self.assertFalse(
+            os.path.exists(os.path.join(self.cmd.path, 'a.tar.gz')))
+        self.assertEqual(
+            {'b.tar.gz': ('sha512', hashlib.sha512(b'b.tar.gz').hexdigest())},
+            self.cmd.sources_manifest.get(self.cmd.path))
+
+    def test_keep_modified_files_not_listed_anymore(self):
+        self.cmd.sources()
+        self.write_file(os.path.join(self.cmd.path, 'a.tar.gz'), 'modified')
+        self.write_sources(['b.tar.gz'])
+        self.cmd.sources()
+
+        self.assertEqual('modified', self.read_file(
+            os.path.join(self.cmd.path, 'a.tar.gz')))
+
+
+class TestUpload(CommandTestCase):
+    """Test Commands.upload"""
+
+    def setUp(self):
+        super(TestUpload, self).setUp()
+        self.cmd = self.make_commands()
+        self.files = [os.path.join(self.cmd.path, name)
+                      for name in ('a.tar.gz', 'b.tar.gz', 'c.tar.gz')]
+        for filename in self.files:
+            self.write_file(filename, filename)
+            os.utime(filename, (0, 0))
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.upload_file')
+    @patch('fedpkg.lookaside.FedoraLookasideCache.remote_file_status')
+    def test_upload_missing_files(self, remote_file_status, upload_file):
+        remote_file_status.side_effect = lambda name, filename, hash: \
+            (filename == 'b.tar.gz', filename == 'c.tar.gz')
+
+        self.cmd.upload(iter(self.files), replace=True)
+
+        self.assertEqual(3, remote_file_status.call_count)
+        self.assertEqual(
+            sorted([(self.files[0], False), (self.files[2], True)]),
+            sorted((c[0][1], c[1]['chunked'])
+                   for c in upload_file.call_args_list))
+        sources = self.read_file(self.cmd.sources_filename)
+        for filename in self.files:
+            file_hash = hashlib.sha512(filename.encode('utf-8')).hexdigest()
+            self.assertIn('SHA512 ({0}) = {1}'.format(
+                os.path.basename(filename), file_hash), sources)
+            self.assertEqual(file_hash, self.cmd.hashcache.get(
+                filename, self.cmd.lookasidehash))
+        self.assertIn('/c.tar.gz', self.read_file(
+            os.path.join(self.cmd.path, '.gitignore')))
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.upload_file')
+    @patch('fedpkg.lookaside.FedoraLookasideCache.remote_file_status')
+    def test_offline(self, remote_file_status, upload_file):
+        self.cmd.upload(self.files, replace=True, offline=True)
+
+        remote_file_status.assert_not_called()
+        upload_file.assert_not_called()
+        self.assertIn('c.tar.gz', self.read_file(self.cmd.sources_filename))
+
+    @patch('fedpkg.lookaside.FedoraLookasideCache.upload_file')
+    @patch('fedpkg.lookaside.FedoraLookasideCache.remote_file_status')
+    def test_do_not_update_sources_if_upload_fails(self, remote_file_status,
+                                                   upload_file):
+        remote_file_status.return_value = (False, False)
+        upload_file.side_effect = UploadError('Request is unauthorized.')
+        self.write_file(self.cmd.sources_filename, '')
+
+        self.assertRaises(UploadError, self.cmd.upload, self.files,
+                          replace=True)
+        self.assertEqual('', self.read_file(self.cmd.sources_filename))
 
 
 class TestLoadRpmDefines(CommandTestCase):
@@ -316,7 +938,7 @@ class TestFindMasterBranch(CommandTestCase):
     @patch('pyrpkg.Commands.repo', new_callable=PropertyMock)
     def test_get_from_koji_for_the_last_chance(self, repo, anon_kojisession):
         # Must mock there is no f* branches
-        repo.return_value.refs = ['rhel', 'private-branch']
+        repo.return_value.git.for_each_ref.return_value = ''
 
         koji_session = anon_kojisession.return_value
         koji_session.getBuildTarget.return_value = {'dest_tag_name': 'f29'}
@@ -339,7 +961,7 @@ class TestFindMasterBranch(CommandTestCase):
     @patch('pyrpkg.Commands.repo', new_callable=PropertyMock)
     def test_raise_error_if_koji_api_call_fails(self, repo, anon_kojisession):
         # No f* branches in order to call Koji API to get dest_tag_name
-        repo.return_value.refs = ['rhel', 'private-branch']
+        repo.return_value.git.for_each_ref.return_value = ''
 
         koji_session = anon_kojisession.return_value
         # As the code shows, any error will be caught
@@ -349,6 +971,47 @@ class TestFindMasterBranch(CommandTestCase):
             self, rpkgError, 'Unable to find rawhide target',
             self.cmd._findmasterbranch)
 
+    @patch('pyrpkg.Commands.anon_kojisession', new_callable=PropertyMock)
+    @patch('pyrpkg.Commands.repo', new_callable=PropertyMock)
+    def test_sort_remote_branches_numerically(self, repo, anon_kojisession):
+        repo.return_value.git.for_each_ref.return_value = '\n'.join([
+            'refs/remotes/origin/f99',
+            'refs/remotes/origin/f100',
+            'refs/remotes/origin/f14-foobar',
+        ])
+        repo.return_value.git.config.return_value = \
+            '+refs/heads/*:refs/remotes/origin/*'
+        anon_kojisession.return_value.getBuildTarget.side_effect = ValueError
+
+        self.assertEqual(101, self.cmd._findmasterbranch())
+
+    @patch('pyrpkg.Commands.repo', new_callable=PropertyMock)
+    def test_remote_versions_are_cached(self, repo):
+        for_each_ref = repo.return_value.git.for_each_ref
+        for_each_ref.return_value = 'refs/remotes/origin/f29'
+        repo.return_value.git.config.return_value = \
+            '+refs/heads/*:refs/remotes/origin/*'
+
+        self.assertEqual([29], self.cmd._remote_fedora_versions())
+        self.assertEqual([29], self.cmd._remote_fedora_versions())
+        for_each_ref.assert_called_once_with(
+            '--format=%(refname)', 'refs/remotes/*/f[0-9][0-9]*')
+
+    @patch('pyrpkg.Commands.repo', new_callable=PropertyMock)
+    def test_remote_versions_of_single_branch_clone(self, repo):
+        repo.return_value.git.for_each_ref.return_value = \
+            'refs/remotes/origin/f29'
+        repo.return_value.git.config.return_value = \
+            '+refs/heads/f29:refs/remotes/origin/f29'
+        repo.return_value.git.ls_remote.return_value = '\n'.join([
+            'f123\trefs/heads/f29',
+            '0123\trefs/heads/f30',
+        ])
+
+        self.assertEqual([29, 30], self.cmd._remote_fedora_versions())
+        repo.return_value.git.ls_remote.assert_called_once_with(
+            '--heads', 'origin', 'refs/heads/f[0-9]*')
+
 
 class TestOverrideBuildURL(CommandTestCase):
     """Test Commands.construct_build_url"""
@@ -362,3 +1025,304 @@ class TestOverrideBuildURL(CommandTestCase):
         self.assertEqual(
             'git+{0}'.format(super_construct_build_url.return_value),
             overrided_url)
+
+
+class TestEvaluateSpec(CommandTestCase):
+    """Test Commands.evaluate_spec and its users"""
+
+    rpm_output = (
+        'docpkg (none) 1.2 2.fc26\v- Initial version\n'
+        '- Second line\n'
+        '?? not a record separator\n\f'
+        'docpkg-doc (none) 1.2 2.fc26\v(none)\n\f')
+
+    def setUp(self):
+        super(TestEvaluateSpec, self).setUp()
+        self.cache_home = tempfile.mkdtemp(prefix='fedpkg-test-cache-')
+        self.environ_patcher = patch.dict(
+            'os.environ', {'XDG_CACHE_HOME': self.cache_home})
+        self.environ_patcher.start()
+
+        self.popen_patcher = patch('fedpkg.subprocess.Popen')
+        self.mock_popen = self.popen_patcher.start()
+        proc = self.mock_popen.return_value
+        proc.communicate.return_value = (self.rpm_output, '')
+        proc.returncode = 0
+
+        self.rpmdefines_patcher = patch(
+            'pyrpkg.Commands.rpmdefines', new_callable=PropertyMock,
+            return_value=["--define 'dist .fc26'"])
+        self.rpmdefines_patcher.start()
+
+        self.cmd = self.make_commands()
+        # Specs running shell commands are not cached
+        self.spec_file = os.path.join(self.cmd.path, self.cmd.spec)
+        spec = self.read_file(self.spec_file)
+        self.write_file(self.spec_file, '\n'.join(
+            line for line in spec.splitlines()
+            if not line.startswith('BuildRoot:')))
+
+    def tearDown(self):
+        self.rpmdefines_patcher.stop()
+        self.popen_patcher.stop()
+        self.environ_patcher.stop()
+        shutil.rmtree(self.cache_home)
+        super(TestEvaluateSpec, self).tearDown()
+
+    def test_load_nameverrel(self):
+        self.cmd.load_nameverrel()
+
+        self.assertEqual('docpkg', self.cmd._package_name_spec)
+        self.assertEqual('0', self.cmd._epoch)
+        self.assertEqual('1.2', self.cmd._ver)
+        self.assertEqual('2.fc26', self.cmd._rel)
+
+    def test_changelog(self):
+        self.assertEqual('Initial version\nSecond line\n'
+                         '?? not a record separator\n',
+                         self.cmd.changelog())
+        self.assertEqual('- Initial version\n- Second line\n'
+                         '?? not a record separator\n',
+                         self.cmd.changelog(raw=True))
+
+    def test_spawn_rpm_once(self):
+        self.cmd.load_nameverrel()
+        self.cmd.changelog()
+        # A new instance reads the result from cache directory
+        self.make_commands().changelog()
+
+        self.assertEqual(1, self.mock_popen.call_count)
+
+    def test_spawn_rpm_for_uncacheable_spec(self):
+        with open(self.spec_file, 'a') as f:
+            f.write('%global commit %(git rev-parse HEAD)\n')
+
+        self.cmd.load_nameverrel()
+        self.make_commands().changelog()
+
+        self.assertEqual(2, self.mock_popen.call_count)
+
+    def test_clog_writes_file(self):
+        self.cmd.clog()
+
+        clog_file = os.path.join(self.cmd.path, 'clog')
+        self.assertEqual('Initial version\nSecond line\n'
+                         '?? not a record separator\n',
+                         self.read_file(clog_file))
+
+    def test_raise_error_if_rpm_fails(self):
+        proc = self.mock_popen.return_value
+        proc.communicate.return_value = ('', 'error: bad spec')
+        proc.returncode = 1
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'Could not get n-v-r-e', self.cmd.load_nameverrel)
+
+
+class TestMockbuildReleases(CommandTestCase):
+    """Test Commands.mockbuild with multiple releases"""
+
+    def setUp(self):
+        super(TestMockbuildReleases, self).setUp()
+        self.results_dir = tempfile.mkdtemp(prefix='fedpkg-test-results-')
+
+        real_exists = os.path.exists
+        self.patchers = [
+            patch('pyrpkg.Commands.localarch', new_callable=PropertyMock,
+                  return_value='x86_64'),
+            patch('fedpkg.Commands.runtime_disttag', new_callable=PropertyMock,
+                  return_value=None),
+            patch('fedpkg.Commands.mock_results_dir', new_callable=PropertyMock,
+                  return_value=self.results_dir),
+            patch('fedpkg.Commands.srpm', side_effect=self.fake_srpm),
+            patch('fedpkg.Commands._config_dir_basic',
+                  side_effect=lambda root: '/tmp/{0}.mockconfig'.format(root)),
+            patch('fedpkg.Commands._config_dir_other'),
+            patch('fedpkg.Commands._cleanup_tmp_dir'),
+            patch('os.path.exists',
+                  side_effect=lambda path: (not path.startswith('/etc/mock/')
+                                            and real_exists(path))),
+            patch('fedpkg.subprocess.call', side_effect=self.fake_call),
+        ]
+        self.mocks = [patcher.start() for patcher in self.patchers]
+        self.mock_srpm = self.mocks[3]
+        self.mock_cleanup = self.mocks[6]
+        self.mock_call = self.mocks[8]
+        self.failing_roots = []
+
+        self.cmd = self.make_commands()
+        self.cmd.mockbuild_releases = ['f31', 'f32', 'epel8']
+        self.cmd.mockbuild_parallel = 3
+
+    def tearDown(self):
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        shutil.rmtree(self.results_dir)
+        super(TestMockbuildReleases, self).tearDown()
+
+    def fake_srpm(self, hashtype=None):
+        self.cmd.srpmname = '/tmp/docpkg-{0}.src.rpm'.format(
+            self.cmd.branch_merge)
+
+    def fake_call(self, cmd, **kwargs):
+        root = cmd[cmd.index('-r') + 1]
+        return 1 if root in self.failing_roots else 0
+
+    def get_mock_commands(self):
+        return dict((c[0][0][c[0][0].index('-r') + 1], c[0][0])
+                    for c in self.mock_call.call_args_list)
+
+    def test_build_for_all_releases(self):
+        self.cmd.mockbuild(['--no-clean'])
+
+        commands = self.get_mock_commands()
+        self.assertEqual(
+            ['mock', '--no-clean',
+             '--configdir', '/tmp/fedora-31-x86_64.mockconfig',
+             '-r', 'fedora-31-x86_64',
+             '--resultdir', os.path.join(self.results_dir, 'fedora-31-x86_64'),
+             '--rebuild', '/tmp/docpkg-f31.src.rpm'],
+            commands['fedora-31-x86_64'])
+        self.assertEqual(
+            set(['fedora-31-x86_64', 'fedora-32-x86_64', 'epel-8-x86_64']),
+            set(commands.keys()))
+        self.assertTrue(os.path.exists(os.path.join(
+            self.results_dir, 'epel-8-x86_64', 'mock-output.log')))
+        self.assertEqual(3, self.mock_cleanup.call_count)
+
+    def test_srpm_per_dist_tag(self):
+        self.cmd.mockbuild([])
+
+        self.assertEqual(3, self.mock_srpm.call_count)
+        commands = self.get_mock_commands()
+        self.assertEqual('/tmp/docpkg-f32.src.rpm',
+                         commands['fedora-32-x86_64'][-1])
+        self.assertEqual('/tmp/docpkg-epel8.src.rpm',
+                         commands['epel-8-x86_64'][-1])
+
+    @patch('fedpkg.Commands._findmasterbranch', return_value='32')
+    def test_reuse_srpm_of_same_dist_tag(self, findmasterbranch):
+        self.cmd.mockbuild_releases = ['f32', 'master']
+        self.cmd.mockbuild([])
+
+        self.assertEqual(1, self.mock_srpm.call_count)
+        commands = self.get_mock_commands()
+        self.assertEqual('/tmp/docpkg-f32.src.rpm',
+                         commands['fedora-rawhide-x86_64'][-1])
+
+    @patch('pyrpkg.Commands.mockbuild')
+    def test_pass_other_options_to_rpkg(self, mockbuild):
+        self.cmd.mockbuild_releases = []
+        self.cmd.mockbuild(['--no-clean'], force_local_mock_config=True)
+
+        mockbuild.assert_called_once_with(
+            ['--no-clean'], root=None, hashtype=None, shell=None,
+            force_local_mock_config=True)
+
+    def test_report_failed_releases(self):
+        self.failing_roots = ['fedora-32-x86_64']
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'Mock build failed for f32',
+            self.cmd.mockbuild, [])
+        self.assertEqual(3, self.mock_call.call_count)
+
+    def test_root_cannot_be_used(self):
+        self.assertRaises(rpkgError, self.cmd.mockbuild, [], root='fedora')
+
+
+class TestSRPMCache(CommandTestCase):
+    """Test Commands.srpm with SRPM cache"""
+
+    def setUp(self):
+        super(TestSRPMCache, self).setUp()
+        self.cache_home = tempfile.mkdtemp(prefix='fedpkg-test-cache-')
+        self.patchers = [
+            patch.dict('os.environ', {'XDG_CACHE_HOME': self.cache_home}),
+            patch('pyrpkg.Commands.rpmdefines', new_callable=PropertyMock,
+                  return_value=["--define 'dist .fc26'"]),
+            patch('fedpkg.Commands.ver', new_callable=PropertyMock,
+                  return_value='1.2'),
+            patch('fedpkg.Commands.rel', new_callable=PropertyMock,
+                  return_value='2.fc26'),
+            patch('pyrpkg.Commands.srpm', side_effect=self.fake_rpmbuild),
+        ]
+        self.rpmbuild = [patcher.start() for patcher in self.patchers][-1]
+
+        self.cmd = self.make_commands()
+        self.srpm_file = os.path.join(self.cmd.path,
+                                      'testpkg-1.2-2.fc26.src.rpm')
+
+    def tearDown(self):
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+        shutil.rmtree(self.cache_home)
+        super(TestSRPMCache, self).tearDown()
+
+    def fake_rpmbuild(self, **kwargs):
+        self.cmd.srpmname = self.srpm_file
+        self.write_file(self.srpm_file, 'srpm')
+
+    def test_reuse_srpm_built_from_same_content(self):
+        self.cmd.srpm()
+        os.unlink(self.srpm_file)
+        self.cmd.srpm()
+
+        self.assertEqual(1, self.rpmbuild.call_count)
+        self.assertEqual('srpm', self.read_file(self.srpm_file))
+        self.assertEqual(self.srpm_file, self.cmd.srpmname)
+
+    def test_rebuild_if_content_changes(self):
+        self.cmd.srpm()
+        self.write_file(os.path.join(self.cmd.path, 'fix.patch'), 'patch')
+        self.cmd.srpm()
+
+        self.assertEqual(2, self.rpmbuild.call_count)
+
+    def test_rebuild_with_different_hashtype(self):
+        self.cmd.srpm()
+        self.cmd.srpm(hashtype='md5')
+
+        self.assertEqual(2, self.rpmbuild.call_count)
+
+    def test_ignore_build_results(self):
+        self.cmd.srpm()
+        self.write_file(os.path.join(self.cmd.path, 'build.log'), 'log')
+        self.cmd.git_excludes = ['/build*.log']
+        self.cmd.srpm()
+
+        self.assertEqual(1, self.rpmbuild.call_count)
+
+    def test_ignore_files_ignored_by_git(self):
+        self.cmd.srpm()
+        self.write_file(os.path.join(self.cmd.repo.git_dir, 'info', 'exclude'),
+                        'notes.txt\n')
+        self.write_file(os.path.join(self.cmd.path, 'notes.txt'), 'notes')
+        self.cmd.srpm()
+
+        self.assertEqual(1, self.rpmbuild.call_count)
+
+    def test_rebuild_if_source_file_is_replaced(self):
+        self.write_file(os.path.join(self.cmd.repo.git_dir, 'info', 'exclude'),
+                        '/source.tar.gz\n')
+        self.write_file(self.cmd.sources_filename,
+                        'SHA512 (source.tar.gz) = 123abc\n')
+        source_file = os.path.join(self.cmd.path, 'source.tar.gz')
+        self.write_file(source_file, 'source')
+        self.cmd.srpm()
+        os.unlink(self.srpm_file)
+        # Replaced before running new-sources, sources file is the same
+        self.write_file(source_file, 'new source')
+        self.cmd.srpm()
+
+        self.assertEqual(2, self.rpmbuild.call_count)
+
+    def test_rebuild_if_macro_files_change(self):
+        macros = os.path.join(self.cache_home, 'macros')
+        self.write_file(macros, '%dist .fc26')
+        with patch('fedpkg.spec.MACRO_PATHS', new=[macros]):
+            self.cmd.srpm()
+            self.write_file(macros, '%dist .fc26.1')
+            self.cmd.srpm()
+
+        self.assertEqual(2, self.rpmbuild.call_count)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import six
+from mock import Mock
+
+from fedpkg.dist import DistInfo, resolve_dist, resolve_dists
+from pyrpkg.errors import rpkgError
+from utils import unittest
+
+
+class TestResolveDist(unittest.TestCase):
+    """Test resolve_dist"""
+
+    def test_resolve_release_branches(self):
+        expected = {
+            'f31': DistInfo('31', 'fedora', 'fc31', 'fedora-31-x86_64',
+                            'f31-override', 'rhel'),
+            'f100': DistInfo('100', 'fedora', 'fc100', 'fedora-100-x86_64',
+                             'f100-override', 'rhel'),
+            'el6': DistInfo('6', 'rhel', 'el6', 'epel-6-x86_64',
+                            'epel6-override', 'fedora'),
+            'epel8': DistInfo('8', 'rhel', 'el8', 'epel-8-x86_64',
+                              'epel8-override', 'fedora'),
+            'epel8-playground': DistInfo(
+                '8', 'rhel', 'epel8.playground', 'epel-8-x86_64',
+                'epel8-override', 'fedora'),
+            'olpc7': DistInfo('7', 'olpc', 'olpc7', None,
+                              'dist-olpc7-override', 'rhel'),
+        }
+        for branch, dist in expected.items():
+            self.assertEqual(dist, resolve_dist(branch, 'x86_64'))
+
+    def test_resolve_master(self):
+        rawhide = Mock(return_value='32')
+
+        self.assertEqual(
+            DistInfo('32', 'fedora', 'fc32', 'fedora-rawhide-x86_64', None,
+                     'rhel'),
+            resolve_dist('master', 'x86_64', rawhide=rawhide))
+
+    def test_master_requires_rawhide(self):
+        self.assertRaises(rpkgError, resolve_dist, 'master', 'x86_64')
+
+    def test_unknown_branch(self):
+        for branch in ('private-branch', 'f30-foo', 'rhel-7'):
+            self.assertRaises(rpkgError, resolve_dist, branch, 'x86_64')
+
+    def test_memoized_per_branch_and_arch(self):
+        self.assertIs(resolve_dist('f29', 'i686'), resolve_dist('f29', 'i686'))
+        self.assertEqual('fedora-29-aarch64',
+                         resolve_dist('f29', 'aarch64').mockconfig)
+
+
+class TestResolveDists(unittest.TestCase):
+    """Test resolve_dists"""
+
+    def test_resolve_batch(self):
+        rawhide = Mock(return_value='32')
+
+        dists = resolve_dists(['master', 'f31', 'unknown', 'master'],
+                              'x86_64', rawhide=rawhide)
+
+        self.assertEqual(['master', 'f31', 'unknown'],
+                         [branch for branch, _ in dists])
+        dists = dict(dists)
+        self.assertEqual('fc32', dists['master'].disttag)
+        self.assertEqual('fc31', dists['f31'].disttag)
+        self.assertIsNone(dists['unknown'])
+        rawhide.assert_called_once_with()
+
+    def test_raise_error_of_rawhide(self):
+        rawhide = Mock(side_effect=rpkgError('Unable to find rawhide target'))
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'Unable to find rawhide target',
+            resolve_dists, ['f31', 'master'], 'x86_64', rawhide=rawhide)
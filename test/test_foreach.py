@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from fedpkg.foreach import run_foreach, split_steps
+from pyrpkg.errors import rpkgError
+from utils import unittest
+
+
+class FakeCommands(object):
+
+    def __init__(self):
+        self._kojisession = None
+
+
+class FakeClient(object):
+    """Client running a few commands on a checkout path"""
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser()
+        self.parser.add_argument('--path')
+        subparsers = self.parser.add_subparsers()
+        for name in ('touch', 'echo', 'fail', 'koji'):
+            subparser = subparsers.add_parser(name)
+            subparser.set_defaults(command=getattr(self, name))
+        self._cmd = None
+
+    @property
+    def cmd(self):
+        if self._cmd is None:
+            self._cmd = FakeCommands()
+        return self._cmd
+
+    def touch(self):
+        with open(os.path.join(self.args.path, 'touched'), 'a') as f:
+            f.write('x')
+
+    def echo(self):
+        print('echo from {0}'.format(os.path.basename(self.args.path)))
+        sys.stdout.flush()
+        subprocess.call(['echo', 'from subprocess'])
+
+    def fail(self):
+        raise rpkgError('Something is wrong')
+
+    def koji(self):
+        print('session: {0}'.format(self.cmd._kojisession))
+        if not self.cmd._kojisession:
+            self.cmd._kojisession = 'logged-in'
+
+
+class TestSplitSteps(unittest.TestCase):
+    """Test split_steps"""
+
+    def test_split(self):
+        self.assertEqual([['pull'], ['sources', '--outdir', 'x']],
+                         split_steps(['pull', ';', 'sources', '--outdir', 'x']))
+
+    def test_drop_empty_steps(self):
+        self.assertEqual([['pull']], split_steps([';', 'pull', ';']))
+
+
+class TestRunForeach(unittest.TestCase):
+    """Test run_foreach"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-foreach-')
+        self.paths = []
+        for name in ('a', 'b', 'c'):
+            path = os.path.join(self.tmpdir, name)
+            os.mkdir(path)
+            self.paths.append(path)
+        self.client = FakeClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_steps(self, steps, workers=2):
+        return sorted(run_foreach(self.client, self.paths, steps, workers))
+
+    def test_run_steps_in_each_checkout(self):
+        results = self.run_steps([['touch'], ['touch']])
+
+        self.assertEqual(self.paths, [path for path, error, output in results])
+        for path in self.paths:
+            with open(os.path.join(path, 'touched')) as f:
+                self.assertEqual('xx', f.read())
+
+    def test_capture_output(self):
+        results = self.run_steps([['echo']])
+
+        path, error, output = results[0]
+        self.assertIsNone(error)
+        self.assertEqual('echo from a\nfrom subprocess\n', output)
+
+    def test_stop_at_first_failure(self):
+        results = self.run_steps([['fail'], ['touch']])
+
+        for path, error, output in results:
+            self.assertEqual('Something is wrong', error)
+            self.assertFalse(os.path.exists(os.path.join(path, 'touched')))
+
+    def test_invalid_command(self):
+        results = self.run_steps([['unknown']])
+
+        for path, error, output in results:
+            self.assertEqual('exited with status 2', error)
+            self.assertIn('invalid choice', output)
+
+    def test_reuse_sessions(self):
+        results = self.run_steps([['koji']], workers=1)
+
+        self.assertEqual(
+            ['session: None\n', 'session: logged-in\n', 'session: logged-in\n'],
+            [output for path, error, output in results])
+
+    def test_report_each_checkout(self):
+        reported = []
+        run_foreach(self.client, self.paths, [['touch']], 2,
+                    report=lambda *result: reported.append(result[0]))
+
+        self.assertEqual(self.paths, sorted(reported))
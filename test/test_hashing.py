@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+
+from fedpkg.hashing import RACY_PERIOD, HashCache, hash_file
+from pyrpkg.errors import InvalidHashType
+from utils import unittest
+
+
+class HashingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-hashing-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_file(self, filename, content, age=60):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+
+class TestHashFile(HashingTestCase):
+    """Test hash_file"""
+
+    def test_small_file(self):
+        path = self.make_file('small.tar.gz', 'source')
+
+        self.assertEqual(hashlib.sha512(b'source').hexdigest(),
+                         hash_file(path, 'sha512'))
+
+    @patch('fedpkg.hashing.MMAP_MIN_SIZE', new=4)
+    def test_large_file(self):
+        path = self.make_file('large.tar.gz', 'source')
+
+        self.assertEqual(hashlib.md5(b'source').hexdigest(),
+                         hash_file(path, 'md5'))
+
+    def test_empty_file(self):
+        path = self.make_file('empty.tar.gz', '')
+
+        self.assertEqual(hashlib.sha512(b'').hexdigest(),
+                         hash_file(path, 'sha512'))
+
+    def test_invalid_hashtype(self):
+        path = self.make_file('small.tar.gz', 'source')
+
+        self.assertRaises(InvalidHashType, hash_file, path, 'nosuchhash')
+
+
+class TestHashCache(HashingTestCase):
+    """Test HashCache"""
+
+    def setUp(self):
+        super(TestHashCache, self).setUp()
+        self.cache_file = os.path.join(self.tmpdir, 'hashes.json')
+        self.path = self.make_file('source.tar.gz', 'source')
+
+    @patch('fedpkg.hashing.hash_file', return_value='123')
+    def test_hash_unchanged_file_once(self, hash_file):
+        cache = HashCache(self.cache_file)
+
+        self.assertEqual('123', cache.hash_file(self.path, 'sha512'))
+        self.assertEqual('123', cache.hash_file(self.path, 'sha512'))
+        hash_file.assert_called_once_with(self.path, 'sha512')
+
+    @patch('fedpkg.hashing.hash_file', return_value='123')
+    def test_hash_changed_file_again(self, hash_file):
+        cache = HashCache(self.cache_file)
+        cache.hash_file(self.path, 'sha512')
+        self.make_file('source.tar.gz', 'new source')
+        cache.hash_file(self.path, 'sha512')
+
+        self.assertEqual(2, hash_file.call_count)
+
+    @patch('fedpkg.hashing.hash_file', return_value='123')
+    def test_hash_file_with_restored_mtime_again(self, hash_file):
+        cache = HashCache(self.cache_file)
+        cache.hash_file(self.path, 'sha512')
+        st = os.stat(self.path)
+        time.sleep(0.01)
+        with open(self.path, 'w') as f:
+            f.write('SOURCE')
+        os.utime(self.path, (st.st_atime, st.st_mtime))
+        cache.hash_file(self.path, 'sha512')
+
+        self.assertEqual(2, hash_file.call_count)
+
+    @patch('fedpkg.hashing.hash_file', return_value='123')
+    def test_keep_digest_of_file_linked_elsewhere(self, hash_file):
+        cache = HashCache(self.cache_file)
+        cache.hash_file(self.path, 'sha512')
+        # Another checkout links the file from the store
+        os.link(self.path, os.path.join(self.tmpdir, 'linked.tar.gz'))
+
+        with patch('time.time', return_value=time.time() + RACY_PERIOD):
+            cache.hash_file(self.path, 'sha512')
+
+        hash_file.assert_called_once_with(self.path, 'sha512')
+
+    @patch('fedpkg.hashing.hash_file', return_value='123')
+    def test_do_not_cache_recently_modified_file(self, hash_file):
+        cache = HashCache(self.cache_file)
+        path = self.make_file('new.tar.gz', 'source', age=0)
+        cache.hash_file(path, 'sha512')
+
+        self.assertIsNone(cache.get(path, 'sha512'))
+
+    def test_persist_cache(self):
+        cache = HashCache(self.cache_file)
+        cache.set(self.path, 'sha512', '123')
+        cache.set(os.path.join(self.tmpdir, 'source.tar.gz'), 'md5', '456')
+        cache.save()
+
+        cache = HashCache(self.cache_file)
+        self.assertEqual('123', cache.get(self.path, 'sha512'))
+        self.assertEqual('456', cache.get(self.path, 'md5'))
+
+    def test_drop_removed_files_when_save(self):
+        cache = HashCache(self.cache_file)
+        cache.set(self.path, 'sha512', '123')
+        os.unlink(self.path)
+        cache.save()
+
+        self.assertEqual({}, HashCache(self.cache_file).entries)
+
+    def test_ignore_broken_cache_file(self):
+        with open(self.cache_file, 'w') as f:
+            f.write('{')
+
+        self.assertIsNone(HashCache(self.cache_file).get(self.path, 'sha512'))
+
+    def test_hash_files(self):
+        paths = [self.make_file('{0}.tar.gz'.format(i), str(i))
+                 for i in range(5)]
+        cache = HashCache()
+
+        self.assertEqual(
+            [hashlib.sha512(str(i).encode('utf-8')).hexdigest()
+             for i in range(5)],
+            cache.hash_files(paths, 'sha512', workers=3))
@@ -0,0 +1,982 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+import pycurl
+import six
+from mock import patch
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from fedpkg.hashing import HashCache
+from fedpkg.lookaside import (FedoraLookasideCache, LocalLookasideStore,
+                              MirrorStats, MultipartBody)
+from pyrpkg.errors import DownloadError, UploadError, rpkgError
+from utils import unittest
+
+
+def sha512(content):
+    return hashlib.sha512(content.encode('utf-8')).hexdigest()
+
+
+class LookasideTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-lookaside-')
+        self.store_dir = os.path.join(self.tmpdir, 'store')
+        self.store = LocalLookasideStore(self.store_dir, max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_file(self, filename):
+        with open(filename, 'r') as f:
+            return f.read()
+
+    def add_file(self, content):
+        tmp_file = self.store.mkstemp()
+        with open(tmp_file, 'w') as f:
+            f.write(content)
+        return self.store.add('sha512', sha512(content), tmp_file)
+
+
+class TestLocalLookasideStore(LookasideTestCase):
+    """Test LocalLookasideStore"""
+
+    def test_add_and_get(self):
+        stored = self.add_file('source')
+
+        self.assertEqual(stored, self.store.get('sha512', sha512('source')))
+        self.assertEqual('source', self.read_file(stored))
+        self.assertIsNone(self.store.get('sha512', sha512('other')))
+        self.assertIsNone(self.store.get('md5', sha512('source')))
+
+    def test_link(self):
+        stored = self.add_file('source')
+        outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+        self.store.link(stored, outfile)
+
+        self.assertEqual('source', self.read_file(outfile))
+
+    def test_replace_existing_file_when_link(self):
+        stored = self.add_file('source')
+        outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+        with open(outfile, 'w') as f:
+            f.write('broken')
+        self.store.link(stored, outfile)
+
+        self.assertEqual('source', self.read_file(outfile))
+        self.assertEqual('source', self.read_file(stored))
+
+    def test_evict_least_recently_used(self):
+        self.add_file('a' * 60)
+        past = time.time() - 60
+        os.utime(os.path.dirname(self.store.path('sha512', sha512('a' * 60))),
+                 (past, past))
+
+        self.add_file('b' * 60)
+
+        self.assertIsNone(self.store.get('sha512', sha512('a' * 60)))
+        self.assertIsNotNone(self.store.get('sha512', sha512('b' * 60)))
+
+    def test_keep_added_file_larger_than_limit(self):
+        self.add_file('a' * 200)
+
+        self.assertIsNotNone(self.store.get('sha512', sha512('a' * 200)))
+
+
+class TestDownloadThroughStore(LookasideTestCase):
+    """Test FedoraLookasideCache.download with local store"""
+
+    def setUp(self):
+        super(TestDownloadThroughStore, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi', store=self.store)
+        self.outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+
+        def fake_download(name, filename, hash, outfile, hashtype, **kwargs):
+            with open(outfile, 'w') as f:
+                f.write('source')
+
+        patcher = patch('fedpkg.lookaside.FedoraLookasideCache._download_file',
+                        side_effect=fake_download)
+        self.download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_download_into_store(self):
+        self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                self.outfile, hashtype='sha512')
+
+        self.assertEqual(1, self.download.call_count)
+        self.assertEqual('source', self.read_file(self.outfile))
+        stored = self.store.get('sha512', sha512('source'))
+        self.assertEqual('source', self.read_file(stored))
+
+    def test_download_once_for_checkouts(self):
+        other_outfile = os.path.join(self.tmpdir, 'other', 'source.tar.gz')
+        os.mkdir(os.path.dirname(other_outfile))
+
+        self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                self.outfile, hashtype='sha512')
+        self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                other_outfile, hashtype='sha512')
+
+        self.assertEqual(1, self.download.call_count)
+        self.assertEqual('source', self.read_file(other_outfile))
+
+    def test_no_temporary_file_left_on_failure(self):
+        self.download.side_effect = IOError('Network is down')
+
+        self.assertRaises(
+            IOError, self.lookaside.download, 'pkg', 'source.tar.gz',
+            sha512('source'), self.outfile, hashtype='sha512')
+        self.assertEqual([], [name for name in os.listdir(self.store_dir)
+                              if name.startswith('.tmp-')])
+
+    def test_without_store(self):
+        self.lookaside.store = None
+        self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                self.outfile, hashtype='sha512')
+
+        self.download.assert_called_once_with(
+            'pkg', 'source.tar.gz', sha512('source'), self.outfile, 'sha512',
+            partial=None)
+        self.assertFalse(os.path.exists(self.store_dir))
+
+    def test_prefetch_into_store(self):
+        self.assertTrue(self.lookaside.prefetch(
+            'pkg', 'source.tar.gz', sha512('source'), hashtype='sha512'))
+        self.assertFalse(self.lookaside.prefetch(
+            'pkg', 'source.tar.gz', sha512('source'), hashtype='sha512'))
+
+        self.assertEqual(1, self.download.call_count)
+        stored = self.store.get('sha512', sha512('source'))
+        self.assertEqual('source', self.read_file(stored))
+
+    def test_download_prefetched_file(self):
+        self.lookaside.prefetch('pkg', 'source.tar.gz', sha512('source'),
+                                hashtype='sha512')
+        self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                self.outfile, hashtype='sha512')
+
+        self.assertEqual(1, self.download.call_count)
+        self.assertEqual('source', self.read_file(self.outfile))
+
+    def test_prefetch_without_store(self):
+        self.lookaside.store = None
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'without a local lookaside store',
+            self.lookaside.prefetch, 'pkg', 'source.tar.gz', sha512('source'))
+
+
+class TestDownloadWithHashCache(LookasideTestCase):
+    """Test FedoraLookasideCache.download with hash cache"""
+
+    def setUp(self):
+        super(TestDownloadWithHashCache, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi')
+        self.lookaside.hashcache = HashCache()
+        self.outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+
+        def fake_download(name, filename, hash, outfile, hashtype, **kwargs):
+            with open(outfile, 'w') as f:
+                f.write('source')
+            past = time.time() - 60
+            os.utime(outfile, (past, past))
+
+        patcher = patch('fedpkg.lookaside.FedoraLookasideCache._download_file',
+                        side_effect=fake_download)
+        self.download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('fedpkg.hashing.hash_file')
+    def test_do_not_hash_downloaded_file_again(self, hash_file):
+        for i in range(2):
+            self.lookaside.download('pkg', 'source.tar.gz', sha512('source'),
+                                    self.outfile, hashtype='sha512')
+
+        self.assertEqual(1, self.download.call_count)
+        hash_file.assert_not_called()
+        self.assertTrue(self.lookaside.file_is_valid(
+            self.outfile, sha512('source'), hashtype='sha512'))
+
+
+class FakeServer(object):
+    """Lookaside cache server serving a single file to FakeCurl handles"""
+
+    def __init__(self, content, status=200, accept_ranges=True):
+        self.content = content
+        self.status = status
+        self.accept_ranges = accept_ranges
+        # How many range requests fail in the middle of the transfer
+        self.failures = 0
+        self.ranges = []
+        # Number of requests of the whole file
+        self.gets = 0
+        self.handles = []
+        self.uploads = []
+
+    def Curl(self):
+        handle = FakeCurl(self)
+        self.handles.append(handle)
+        return handle
+
+
+class FakeCurl(object):
+    """Curl handle sending requests to FakeServer"""
+
+    def __init__(self, server):
+        self.server = server
+        self.options = {}
+        self.resets = 0
+
+    def reset(self):
+        self.options = {}
+        self.resets += 1
+
+    def setopt(self, option, value):
+        self.options[option] = value
+
+    def perform(self):
+        server = self.server
+        self.status = server.status
+        if pycurl.READFUNCTION in self.options:
+            body = []
+            while True:
+                data = self.options[pycurl.READFUNCTION](16384)
+                if data == pycurl.READFUNC_ABORT:
+                    raise pycurl.error(42, 'Operation was aborted')
+                if not data:
+                    break
+                body.append(data)
+            server.uploads.append(b''.join(body))
+            return
+        if self.options.get(pycurl.NOBODY):
+            header = self.options.get(pycurl.HEADERFUNCTION, len)
+            header(b'HTTP/1.1 200 OK\r\n')
+            if server.accept_ranges:
+                header(b'Accept-Ranges: bytes\r\n')
+            return
+        content = server.content
+        if pycurl.RANGE in self.options and server.accept_ranges:
+            server.ranges.append(self.options[pycurl.RANGE])
+            start, end = self.options[pycurl.RANGE].split('-')
+            content = content[int(start):int(end) + 1]
+            self.status = 206
+            if server.failures:
+                server.failures -= 1
+                self.options[pycurl.WRITEFUNCTION](content[:len(content) // 2])
+                raise pycurl.error(18, 'transfer closed')
+        else:
+            server.gets += 1
+            header = self.options.get(pycurl.HEADERFUNCTION, len)
+            header('HTTP/1.1 {0} OK\r\n'.format(self.status).encode('ascii'))
+            header('Content-Length: {0}\r\n'.format(len(content)).encode(
+                'ascii'))
+            if server.accept_ranges:
+                header(b'Accept-Ranges: bytes\r\n')
+            header(b'\r\n')
+        written = self.options[pycurl.WRITEFUNCTION](content)
+        if written is not None and written != len(content):
+            raise pycurl.error(23, 'Failed writing body')
+
+    def getinfo(self, info):
+        if info == pycurl.RESPONSE_CODE:
+            return self.status
+        if info == pycurl.CONTENT_LENGTH_DOWNLOAD:
+            return float(len(self.server.content))
+        return -1
+
+
+class TestFetch(LookasideTestCase):
+    """Test FedoraLookasideCache._fetch"""
+
+    def setUp(self):
+        super(TestFetch, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi')
+        self.lookaside.show_progress = False
+        self.outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+
+    def fetch(self, server, hash=None):
+        with patch('pycurl.Curl', new=server.Curl):
+            self.lookaside._fetch('http://localhost/source.tar.gz',
+                                  self.outfile, hash or sha512('source'),
+                                  'sha512', 'source.tar.gz')
+
+    def test_fetch(self):
+        self.fetch(FakeServer(b'source'))
+
+        self.assertEqual('source', self.read_file(self.outfile))
+
+    def test_reuse_curl_handle(self):
+        server = FakeServer(b'source')
+        self.fetch(server)
+        self.fetch(server)
+
+        self.assertEqual(1, len(server.handles))
+        self.assertEqual(1, server.handles[0].resets)
+
+    def test_fail_checksum(self):
+        six.assertRaisesRegex(
+            self, DownloadError, 'source.tar.gz failed checksum',
+            self.fetch, FakeServer(b'broken'))
+
+    def test_remove_file_if_not_found(self):
+        six.assertRaisesRegex(
+            self, DownloadError, 'Server returned status code 404',
+            self.fetch, FakeServer(b'Not Found', status=404))
+        self.assertFalse(os.path.exists(self.outfile))
+
+
+class TestSegmentedDownload(LookasideTestCase):
+    """Test downloading large files in byte-range segments"""
+
+    def setUp(self):
+        super(TestSegmentedDownload, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi')
+        self.lookaside.show_progress = False
+        self.lookaside.segmented_download_min_size = 100
+        self.outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+        self.content = ''.join(str(i % 10) for i in range(1000))
+
+    def download(self, server, partial=None):
+        with patch('pycurl.Curl', new=server.Curl):
+            self.lookaside._download_file(
+                'pkg', 'source.tar.gz', sha512(self.content), self.outfile,
+                'sha512', partial=partial)
+
+    def part_files(self):
+        return [name for name in os.listdir(self.tmpdir) if '.part' in name]
+
+    def test_download_in_segments(self):
+        server = FakeServer(self.content.encode('utf-8'))
+        self.download(server)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual(['0-249', '250-499', '500-749', '750-999'],
+                         sorted(server.ranges))
+        self.assertEqual(1, server.gets)
+        self.assertEqual([], self.part_files())
+
+    def test_small_file_is_not_segmented(self):
+        self.lookaside.segmented_download_min_size = 2000
+        server = FakeServer(self.content.encode('utf-8'))
+        self.download(server)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual([], server.ranges)
+        self.assertEqual(1, server.gets)
+        self.assertEqual(1, len(server.handles))
+
+    def test_server_not_supporting_ranges(self):
+        server = FakeServer(self.content.encode('utf-8'), accept_ranges=False)
+        self.download(server)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual([], server.ranges)
+
+    def test_retry_from_where_segment_stopped(self):
+        self.lookaside.download_segments = 2
+        server = FakeServer(self.content.encode('utf-8'))
+        server.failures = 1
+        self.download(server)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual(3, len(server.ranges))
+        self.assertTrue(set(server.ranges) & set(['250-499', '750-999']))
+
+    def test_resume_interrupted_download(self):
+        self.lookaside.download_segments = 2
+        self.lookaside.download_retries = 0
+        server = FakeServer(self.content.encode('utf-8'))
+        server.failures = 1
+        partial = os.path.join(self.tmpdir, 'source-segments')
+
+        self.assertRaises(DownloadError, self.download, server, partial)
+        self.assertEqual(2, len(self.part_files()))
+
+        server.ranges = []
+        self.download(server, partial)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual(1, len(server.ranges))
+        self.assertIn(server.ranges[0], ['250-499', '750-999'])
+        self.assertEqual([], self.part_files())
+
+    def test_remove_segments_without_store(self):
+        self.lookaside.download_segments = 2
+        self.lookaside.download_retries = 0
+        server = FakeServer(self.content.encode('utf-8'))
+        server.failures = 1
+
+        self.assertRaises(DownloadError, self.download, server)
+        self.assertEqual([], self.part_files())
+
+    def test_resume_in_partial_dir_without_store(self):
+        self.lookaside.download_segments = 2
+        self.lookaside.download_retries = 0
+        self.lookaside.partial_dir = os.path.join(self.tmpdir, 'partial')
+        server = FakeServer(self.content.encode('utf-8'))
+        server.failures = 1
+
+        with patch('pycurl.Curl', new=server.Curl):
+            self.assertRaises(
+                DownloadError, self.lookaside.download, 'pkg',
+                'source.tar.gz', sha512(self.content), self.outfile)
+            self.assertEqual([], self.part_files())
+            parts = [name for name in os.listdir(self.lookaside.partial_dir)
+                     if '.part' in name]
+            self.assertEqual(2, len(parts))
+            prefix = 'sha512-{0}.part'.format(sha512(self.content))
+            self.assertTrue(all(name.startswith(prefix) for name in parts))
+
+            server.ranges = []
+            self.lookaside.download('pkg', 'source.tar.gz',
+                                    sha512(self.content), self.outfile)
+
+        self.assertEqual(self.content, self.read_file(self.outfile))
+        self.assertEqual(1, len(server.ranges))
+
+    def test_fail_checksum(self):
+        self.content = self.content[::-1]
+        server = FakeServer(self.content.encode('utf-8')[::-1])
+
+        six.assertRaisesRegex(
+            self, DownloadError, 'source.tar.gz failed checksum',
+            self.download, server)
+
+
+class FakeMirrors(object):
+    """FakeServer instances serving lookaside cache mirrors by base URL"""
+
+    def __init__(self, servers):
+        self.servers = servers
+
+    def Curl(self):
+        return RoutingCurl(self)
+
+
+class RoutingCurl(FakeCurl):
+    """Curl handle sending requests to the FakeServer of requested mirror"""
+
+    def perform(self):
+        url = self.options[pycurl.URL]
+        if isinstance(url, bytes):
+            url = url.decode('utf-8')
+        for base_url, server in self.server.servers.items():
+            if url.startswith(base_url):
+                break
+        else:
+            raise pycurl.error(6, 'Could not resolve host')
+        if server is None:
+            raise pycurl.error(7, 'Failed to connect')
+        mirrors = self.server
+        self.server = server
+        try:
+            server.requests = getattr(server, 'requests', []) + [url]
+            FakeCurl.perform(self)
+        finally:
+            self.server = mirrors
+
+    def getinfo(self, info):
+        if info == pycurl.CONTENT_LENGTH_DOWNLOAD:
+            return -1
+        return FakeCurl.getinfo(self, info)
+
+
+class TestMirrorStats(LookasideTestCase):
+    """Test MirrorStats"""
+
+    def setUp(self):
+        super(TestMirrorStats, self).setUp()
+        self.stats_file = os.path.join(self.tmpdir, 'cache', 'mirrors.json')
+        self.stats = MirrorStats(self.stats_file)
+
+    def test_unknown_mirrors_keep_order(self):
+        self.assertEqual(['http://a', 'http://b'],
+                         self.stats.order(['http://a', 'http://b']))
+        self.assertTrue(self.stats.needs_probe('http://a'))
+
+    def test_prefer_faster_mirror(self):
+        self.stats.record_probe('http://a', 0.5)
+        self.stats.record_probe('http://b', 0.1)
+
+        self.assertEqual(['http://b', 'http://a', 'http://c'],
+                         self.stats.order(['http://a', 'http://b', 'http://c']))
+        self.assertFalse(self.stats.needs_probe('http://a'))
+
+    def test_throughput_outweighs_latency(self):
+        self.stats.record_probe('http://a', 0.1)
+        self.stats.record_probe('http://b', 0.2)
+        self.stats.record_transfer('http://a', 10 * 1024 * 1024, 10)
+        self.stats.record_transfer('http://b', 10 * 1024 * 1024, 1)
+
+        self.assertEqual(['http://b', 'http://a'],
+                         self.stats.order(['http://a', 'http://b']))
+
+    def test_small_transfer_is_not_measured(self):
+        self.stats.record_transfer('http://a', 1024, 10)
+
+        self.assertIsNone(self.stats.estimate('http://a'))
+
+    def test_failed_mirror_goes_last(self):
+        self.stats.record_probe('http://a', 0.1)
+        self.stats.record_failure('http://a')
+
+        self.assertFalse(self.stats.is_healthy('http://a'))
+        self.assertEqual(['http://b', 'http://a'],
+                         self.stats.order(['http://a', 'http://b']))
+
+    def test_failure_expires(self):
+        self.stats.failure_timeout = 0
+        self.stats.record_failure('http://a')
+        time.sleep(0.01)
+
+        self.assertTrue(self.stats.is_healthy('http://a'))
+
+    def test_successful_transfer_clears_failure(self):
+        self.stats.record_failure('http://a')
+        self.stats.record_transfer('http://a', 1024, 1)
+
+        self.assertTrue(self.stats.is_healthy('http://a'))
+
+    def test_save_and_load(self):
+        self.stats.record_probe('http://a', 0.5)
+        self.stats.save()
+
+        stats = MirrorStats(self.stats_file)
+        self.assertEqual(0.5, stats.estimate('http://a'))
+        self.assertFalse(stats.needs_probe('http://a'))
+
+    def test_ignore_broken_stats_file(self):
+        os.makedirs(os.path.dirname(self.stats_file))
+        with open(self.stats_file, 'w') as f:
+            f.write('[')
+
+        self.assertIsNone(MirrorStats(self.stats_file).estimate('http://a'))
+
+
+class TestMirrorFailover(LookasideTestCase):
+    """Test downloading from mirrors of the lookaside cache"""
+
+    def setUp(self):
+        super(TestMirrorFailover, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi')
+        self.lookaside.show_progress = False
+        self.lookaside.mirrors = ['http://a/pkgs', 'http://b/pkgs']
+        self.outfile = os.path.join(self.tmpdir, 'source.tar.gz')
+
+    def download(self, servers):
+        with patch('pycurl.Curl', new=FakeMirrors(servers).Curl):
+            self.lookaside._download_file(
+                'pkg', 'source.tar.gz', sha512('source'), self.outfile,
+                'sha512')
+
+    def test_mirror_download_url(self):
+        self.assertEqual(
+            'http://a/pkgs/pkg/source.tar.gz/sha512/abc/source.tar.gz',
+            self.lookaside.get_download_url('pkg', 'source.tar.gz', 'abc',
+                                            'sha512', mirror='http://a/pkgs'))
+
+    def test_download_from_fastest_mirror(self):
+        self.lookaside.mirror_stats.record_probe('http://a/pkgs', 0.5)
+        self.lookaside.mirror_stats.record_probe('http://b/pkgs', 0.1)
+        a = FakeServer(b'source')
+        b = FakeServer(b'source')
+        self.download({'http://a/': a, 'http://b/': b})
+
+        self.assertEqual('source', self.read_file(self.outfile))
+        self.assertFalse(hasattr(a, 'requests'))
+        self.assertTrue(b.requests)
+
+    def test_probe_unknown_mirrors(self):
+        a = FakeServer(b'source', status=503)
+        b = FakeServer(b'source')
+        self.download({'http://a/': a, 'http://b/': b})
+
+        self.assertEqual('source', self.read_file(self.outfile))
+        self.assertEqual(['http://a/pkgs'], a.requests)
+        self.assertFalse(self.lookaside.mirror_stats.is_healthy('http://a/pkgs'))
+        self.assertIsNotNone(
+            self.lookaside.mirror_stats.estimate('http://b/pkgs'))
+
+    def test_fail_over_unreachable_mirror(self):
+        self.lookaside.mirror_stats.probe_interval = float('inf')
+        self.lookaside.mirror_stats.record_probe('http://a/pkgs', 0.1)
+        self.lookaside.mirror_stats.record_probe('http://b/pkgs', 0.5)
+        self.download({'http://a/': None, 'http://b/': FakeServer(b'source')})
+
+        self.assertEqual('source', self.read_file(self.outfile))
+        self.assertFalse(self.lookaside.mirror_stats.is_healthy('http://a/pkgs'))
+
+    def test_fail_over_corrupted_file(self):
+        self.lookaside.mirror_stats.record_probe('http://a/pkgs', 0.1)
+        self.lookaside.mirror_stats.record_probe('http://b/pkgs', 0.5)
+        self.download({'http://a/': FakeServer(b'broken'),
+                       'http://b/': FakeServer(b'source')})
+
+        self.assertEqual('source', self.read_file(self.outfile))
+        self.assertFalse(self.lookaside.mirror_stats.is_healthy('http://a/pkgs'))
+
+    def test_all_mirrors_fail(self):
+        self.lookaside.mirror_stats.record_probe('http://a/pkgs', 0.1)
+        self.lookaside.mirror_stats.record_probe('http://b/pkgs', 0.5)
+
+        six.assertRaisesRegex(
+            self, DownloadError, 'Server returned status code 404',
+            self.download, {'http://a/': FakeServer(b'broken'),
+                            'http://b/': FakeServer(b'', status=404)})
+        self.assertFalse(self.lookaside.mirror_stats.is_healthy('http://b/pkgs'))
+
+    def test_save_changed_stats_only(self):
+        stats_file = os.path.join(self.tmpdir, 'mirrors.json')
+        self.lookaside.mirrors = []
+        self.lookaside.mirror_stats = MirrorStats(stats_file)
+        self.download({'http://localhost/': FakeServer(b'source')})
+        self.lookaside.mirror_stats.save()
+
+        self.assertFalse(os.path.exists(stats_file))
+
+
+class TestMultipartBody(LookasideTestCase):
+    """Test MultipartBody"""
+
+    def setUp(self):
+        super(TestMultipartBody, self).setUp()
+        self.path = os.path.join(self.tmpdir, 'source.tar.gz')
+        with open(self.path, 'w') as f:
+            f.write('source')
+
+    def read_all(self, body, size=4):
+        pieces = []
+        while True:
+            data = body.read(size)
+            if data == pycurl.READFUNC_ABORT:
+                return data
+            if not data:
+                return b''.join(pieces)
+            self.assertLessEqual(len(data), size)
+            pieces.append(data)
+
+    def expected_body(self, boundary):
+        return (
+            '--{0}\r\n'
+            'Content-Disposition: form-data; name="name"\r\n\r\n'
+            'rpms/pkg\r\n'
+            '--{0}\r\n'
+            'Content-Disposition: form-data; name="file"; '
+            'filename="source.tar.gz"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            'source\r\n'
+            '--{0}--\r\n'.format(boundary)).encode('utf-8')
+
+    def test_read(self):
+        with open(self.path, 'rb') as f:
+            body = MultipartBody([('name', 'rpms/pkg')], 'file',
+                                 'source.tar.gz', f, hash=sha512('source'),
+                                 hashtype='sha512')
+            data = self.read_all(body)
+
+        self.assertEqual(self.expected_body(body.boundary), data)
+        self.assertEqual(len(data), body.length)
+
+    def test_rewind(self):
+        with open(self.path, 'rb') as f:
+            body = MultipartBody([('name', 'rpms/pkg')], 'file',
+                                 'source.tar.gz', f, hash=sha512('source'),
+                                 hashtype='sha512')
+            self.read_all(body)
+            self.assertEqual(pycurl.SEEKFUNC_OK, body.seek(0, os.SEEK_SET))
+            data = self.read_all(body, size=1000)
+
+        self.assertEqual(self.expected_body(body.boundary), data)
+
+    def test_abort_if_hash_does_not_match(self):
+        with open(self.path, 'rb') as f:
+            body = MultipartBody([('name', 'rpms/pkg')], 'file',
+                                 'source.tar.gz', f, hash=sha512('other'),
+                                 hashtype='sha512')
+
+            self.assertEqual(pycurl.READFUNC_ABORT, self.read_all(body))
+        self.assertEqual('File is changed while being uploaded', body.error)
+
+
+class TestUploadFile(LookasideTestCase):
+    """Test FedoraLookasideCache.upload_file"""
+
+    def setUp(self):
+        super(TestUploadFile, self).setUp()
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://localhost/repo/pkgs/upload.cgi')
+        self.lookaside.show_progress = False
+        self.path = os.path.join(self.tmpdir, 'source.tar.gz')
+        with open(self.path, 'w') as f:
+            f.write('source')
+
+    def test_stream_file(self):
+        server = FakeServer(b'')
+        with patch('pycurl.Curl', new=server.Curl):
+            self.lookaside.upload_file('rpms/pkg', self.path, sha512('source'))
+
+        self.assertEqual(1, len(server.uploads))
+        self.assertIn(b'\r\n\r\nsource\r\n', server.uploads[0])
+        self.assertIn(sha512('source').encode('utf-8'), server.uploads[0])
+        options = server.handles[0].options
+        self.assertEqual(len(server.uploads[0]),
+                         options[pycurl.POSTFIELDSIZE_LARGE])
+        self.assertEqual('http://localhost/repo/pkgs/upload.cgi',
+                         options[pycurl.URL])
+
+    def test_fail_if_file_changed(self):
+        server = FakeServer(b'')
+        with patch('pycurl.Curl', new=server.Curl):
+            six.assertRaisesRegex(
+                self, UploadError, 'File is changed while being uploaded',
+                self.lookaside.upload_file, 'rpms/pkg', self.path,
+                sha512('other'))
+
+    def test_fail_on_server_error(self):
+        server = FakeServer(b'', status=500)
+        with patch('pycurl.Curl', new=server.Curl):
+            six.assertRaisesRegex(
+                self, UploadError, 'Error occurs inside the server',
+                self.lookaside.upload_file, 'rpms/pkg', self.path,
+                sha512('source'))
+
+    def remote_file_exists(self, output):
+        server = FakeServer(output)
+        with patch('pycurl.Curl', new=server.Curl):
+            return self.lookaside.remote_file_exists(
+                'rpms/pkg', 'source.tar.gz', sha512('source'))
+
+    def test_remote_file_exists(self):
+        self.assertTrue(self.remote_file_exists(b'Available\n'))
+
+    def test_remote_file_missing(self):
+        self.assertFalse(self.remote_file_exists(b'Missing\n'))
+
+    def test_reuse_connection_to_upload_file(self):
+        server = FakeServer(b'Missing')
+        with patch('pycurl.Curl', new=server.Curl):
+            self.lookaside.remote_file_exists(
+                'rpms/pkg', 'source.tar.gz', sha512('source'))
+            self.lookaside.upload_file('rpms/pkg', self.path, sha512('source'))
+
+        self.assertEqual(1, len(server.handles))
+
+    def test_chunked_upload_is_not_supported(self):
+        server = FakeServer(b'Missing')
+        with patch('pycurl.Curl', new=server.Curl):
+            self.assertEqual((False, False), self.lookaside.remote_file_status(
+                'rpms/pkg', 'source.tar.gz', sha512('source')))
+
+        self.assertEqual(1, len(server.handles))
+
+
+def parse_multipart(content_type, body):
+    """Parse multipart/form-data body into dicts of fields and files"""
+    boundary = re.search(r'boundary="?([^";]+)', content_type).group(1)
+    fields = {}
+    files = {}
+    for part in body.split(b'--' + boundary.encode('utf-8'))[1:-1]:
+        headers, data = part[2:-2].split(b'\r\n\r\n', 1)
+        name = re.search(br'name="([^"]*)"', headers).group(1).decode('utf-8')
+        if b'filename=' in headers:
+            files[name] = data
+        else:
+            fields[name] = data.decode('utf-8')
+    return fields, files
+
+
+class StandInLookasideHandler(BaseHTTPRequestHandler):
+    """Lookaside upload CGI supporting chunked uploads"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, content, headers=None):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        for header in (headers or {}).items():
+            self.send_header(*header)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        fields, files = parse_multipart(self.headers['Content-Type'], body)
+        key = (fields['name'], fields['sha512sum'])
+
+        if 'file' in files:
+            server.stored[key] = files['file']
+            self.respond(200, '')
+        elif 'chunk' in files:
+            offset = int(fields['offset'])
+            server.offsets.append(offset)
+            if offset in server.drop_offsets:
+                # Connection is lost while the chunk is being acknowledged
+                server.drop_offsets.remove(offset)
+                self.wfile.write(b'HTTP/1.1 200 OK\r\n'
+                                 b'Content-Length: 100\r\n\r\nRece')
+                self.close_connection = True
+                return
+            if key in server.stored:
+                self.respond(200, 'Received {0}'.format(
+                    len(server.stored[key])))
+                return
+            if server.stalled:
+                # Chunks are discarded, e.g. because the disk is full
+                self.respond(200, 'Received {0}'.format(offset))
+                return
+            received = server.partial.setdefault(key, b'')
+            if offset == len(received):
+                received += files['chunk']
+                server.partial[key] = received
+            if len(received) == int(fields['size']):
+                del server.partial[key]
+                if hashlib.sha512(received).hexdigest() != key[1]:
+                    self.respond(400, 'Checksum mismatch')
+                    return
+                server.stored[key] = received
+            self.respond(200, 'Received {0}'.format(len(received)))
+        else:
+            headers = {}
+            if server.chunked:
+                headers['X-Lookaside-Chunked-Upload'] = '1'
+            self.respond(200, 'Available' if key in server.stored
+                         else 'Missing', headers)
+
+
+class StandInLookasideServer(ThreadingMixIn, HTTPServer):
+    """HTTP server of StandInLookasideHandler
+
+    Connections kept alive by curl are served in daemon threads, so that
+    they do not block shutting down the server.
+    """
+
+    daemon_threads = True
+
+
+class TestChunkedUpload(LookasideTestCase):
+    """Test uploading to a stand-in lookaside CGI in chunks"""
+
+    def setUp(self):
+        super(TestChunkedUpload, self).setUp()
+        self.server = StandInLookasideServer(('127.0.0.1', 0),
+                                             StandInLookasideHandler)
+        self.server.chunked = True
+        self.server.stalled = False
+        self.server.drop_offsets = []
+        self.server.stored = {}
+        self.server.partial = {}
+        self.server.offsets = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.lookaside = FedoraLookasideCache(
+            'sha512', 'http://localhost/repo/pkgs',
+            'http://127.0.0.1:{0}/upload.cgi'.format(self.server.server_port))
+        self.lookaside.show_progress = False
+        self.lookaside.upload_chunk_size = 10
+        self.lookaside.upload_state_dir = os.path.join(self.tmpdir, 'uploads')
+
+        self.content = ''.join(str(i % 10) for i in range(35))
+        self.path = os.path.join(self.tmpdir, 'source.tar.gz')
+        with open(self.path, 'w') as f:
+            f.write(self.content)
+        self.key = ('rpms/pkg', sha512(self.content))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(TestChunkedUpload, self).tearDown()
+
+    def upload(self):
+        self.lookaside.upload('rpms/pkg', self.path, sha512(self.content))
+
+    def test_upload_in_chunks(self):
+        self.upload()
+
+        self.assertEqual(self.content.encode('utf-8'),
+                         self.server.stored[self.key])
+        self.assertEqual([0, 10, 20, 30], self.server.offsets)
+        self.assertEqual([], os.listdir(self.lookaside.upload_state_dir))
+
+    def test_fall_back_to_single_upload(self):
+        self.server.chunked = False
+        self.upload()
+
+        self.assertEqual(self.content.encode('utf-8'),
+                         self.server.stored[self.key])
+        self.assertEqual([], self.server.offsets)
+
+    def test_retry_lost_chunk(self):
+        self.server.drop_offsets = [0]
+        self.upload()
+
+        self.assertEqual(self.content.encode('utf-8'),
+                         self.server.stored[self.key])
+        self.assertEqual([0, 0, 10, 20, 30], self.server.offsets)
+
+    def test_resume_interrupted_upload(self):
+        self.lookaside.upload_retries = 0
+        self.server.drop_offsets = [20]
+        self.assertRaises(UploadError, self.upload)
+        self.assertEqual([0, 10, 20], self.server.offsets)
+
+        self.server.offsets = []
+        self.upload()
+
+        self.assertEqual(self.content.encode('utf-8'),
+                         self.server.stored[self.key])
+        self.assertEqual([20, 30], self.server.offsets)
+
+    def test_fail_if_upload_does_not_make_progress(self):
+        self.server.stalled = True
+
+        six.assertRaisesRegex(
+            self, UploadError, 'does not make progress at byte 0',
+            self.upload)
+        self.assertEqual([0], self.server.offsets)
+
+    def test_report_chunked_upload_support(self):
+        self.assertEqual((False, True), self.lookaside.remote_file_status(
+            'rpms/pkg', 'source.tar.gz', sha512(self.content)))
+
+    def test_fail_if_checksum_does_not_match(self):
+        with open(self.path, 'w') as f:
+            f.write(self.content[::-1])
+
+        six.assertRaisesRegex(
+            self, UploadError, 'status 400', self.upload)
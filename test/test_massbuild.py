@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import koji
+
+from fedpkg.massbuild import multicall, submit_builds
+from utils import unittest
+
+
+class FakeSession(object):
+    """Koji session answering multicalls from fake data"""
+
+    def __init__(self):
+        self.multicall = False
+        self.multicalls = []
+        self._calls = []
+        self.targets = {
+            'f33-candidate': {'dest_tag_name': 'f33-updates-candidate'},
+            'locked': {'dest_tag_name': 'f30'},
+        }
+        self.tags = {
+            'f33-updates-candidate': {'locked': False},
+            'f30': {'locked': True},
+        }
+        self.builds = {
+            'old-1.0-1.fc33': {'state': koji.BUILD_STATES['COMPLETE']},
+            'failed-1.0-1.fc33': {'state': koji.BUILD_STATES['FAILED']},
+        }
+        self.next_task_id = 100
+
+    def __getattr__(self, method):
+        def _call(*args):
+            assert self.multicall, 'only multicalls are expected'
+            self._calls.append((method, args))
+        return _call
+
+    def _answer(self, method, args):
+        if method == 'getBuildTarget':
+            return self.targets.get(args[0])
+        if method == 'getTag':
+            return self.tags.get(args[0])
+        if method == 'getBuild':
+            return self.builds.get(args[0])
+        if method == 'build':
+            if args[0].endswith('#bad'):
+                raise ValueError('Invalid source URL')
+            self.next_task_id += 1
+            return self.next_task_id
+        raise AssertionError(method)
+
+    def multiCall(self, strict=False):
+        self.multicall = False
+        self.multicalls.append([method for method, args in self._calls])
+        results = []
+        for method, args in self._calls:
+            try:
+                results.append([self._answer(method, args)])
+            except ValueError as e:
+                results.append({'faultCode': 1000, 'faultString': str(e)})
+        self._calls = []
+        return results
+
+
+class TestMulticall(unittest.TestCase):
+    """Test multicall"""
+
+    def test_results_and_faults(self):
+        session = FakeSession()
+
+        results = multicall(session, [('getTag', ('f30',)),
+                                      ('build', ('git+https://pkg#bad', 't',
+                                                 {}, None))])
+
+        self.assertEqual([({'locked': True}, None),
+                          (None, 'Invalid source URL')], results)
+        self.assertEqual([['getTag', 'build']], session.multicalls)
+
+    def test_no_calls(self):
+        session = FakeSession()
+
+        self.assertEqual([], multicall(session, []))
+        self.assertEqual([], session.multicalls)
+
+
+class TestSubmitBuilds(unittest.TestCase):
+    """Test submit_builds"""
+
+    def build(self, name, target='f33-candidate', url=None):
+        return {'path': '/ws/' + name, 'nvr': name + '-1.0-1.fc33',
+                'url': url or 'git+https://src/rpms/{0}.git#abc'.format(name),
+                'target': target}
+
+    def test_submit(self):
+        session = FakeSession()
+        builds = [
+            self.build('new'),
+            self.build('old'),
+            self.build('failed'),
+            self.build('unknown', target='f99-candidate'),
+            self.build('locked', target='locked'),
+            self.build('bad', url='git+https://src/rpms/bad.git#bad'),
+            {'path': '/ws/dirty', 'nvr': None, 'error': 'has uncommitted'},
+        ]
+
+        submit_builds(session, builds, opts={'fail_fast': True}, priority=5)
+
+        self.assertEqual(101, builds[0]['task_id'])
+        self.assertEqual('old-1.0-1.fc33 has already been built',
+                         builds[1]['error'])
+        self.assertEqual(102, builds[2]['task_id'])
+        self.assertEqual('Unknown build target: f99-candidate',
+                         builds[3]['error'])
+        self.assertEqual('Destination tag f30 is locked', builds[4]['error'])
+        self.assertEqual('Invalid source URL', builds[5]['error'])
+        self.assertEqual('has uncommitted', builds[6]['error'])
+        # Three round trips for any number of builds
+        self.assertEqual(3, len(session.multicalls))
+        self.assertEqual(['build'] * 3, session.multicalls[2])
+
+    def test_skip_nvr_check(self):
+        session = FakeSession()
+        builds = [self.build('old')]
+
+        submit_builds(session, builds, nvr_check=False)
+
+        self.assertEqual(101, builds[0]['task_id'])
+        self.assertNotIn('getBuild', session.multicalls[0])
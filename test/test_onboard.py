@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import json
+import threading
+
+import six
+from mock import Mock, call, patch
+
+from fedpkg.onboard import Onboarding, issue_id, wait_for_issue
+from pyrpkg import rpkgError
+from utils import unittest
+
+ISSUE_URL = 'https://pagure.io/releng/fedora-scm-requests/issue/{0}'
+
+
+def issue(status='Open', close_status=None, comments=()):
+    return {'status': status, 'close_status': close_status,
+            'comments': [{'comment': comment} for comment in comments]}
+
+
+@patch('time.sleep')
+@patch('fedpkg.onboard.get_pagure_issue')
+class TestWaitForIssue(unittest.TestCase):
+    """Test wait_for_issue"""
+
+    def test_issue_id(self, get_pagure_issue, sleep):
+        self.assertEqual('42', issue_id(ISSUE_URL.format(42)))
+
+    def test_backoff(self, get_pagure_issue, sleep):
+        get_pagure_issue.side_effect = [
+            issue(), rpkgError('Pagure is down'), issue(), issue(), issue(),
+            issue('Closed', 'Processed')]
+
+        result = wait_for_issue('https://pagure.io', ISSUE_URL.format(42),
+                                poll_interval=30, max_poll_interval=200)
+
+        self.assertEqual('Processed', result['close_status'])
+        get_pagure_issue.assert_called_with('https://pagure.io', '42')
+        self.assertEqual([call(30), call(60), call(120), call(200), call(200),
+                          call(200)], sleep.call_args_list)
+
+    def test_closed_without_processing(self, get_pagure_issue, sleep):
+        get_pagure_issue.return_value = issue(
+            'Closed', 'Invalid', ['Review is not approved'])
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'closed as Invalid: Review is not approved',
+            wait_for_issue, 'https://pagure.io', ISSUE_URL.format(42))
+
+    def test_timeout(self, get_pagure_issue, sleep):
+        get_pagure_issue.return_value = issue()
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'was not processed in time',
+            wait_for_issue, 'https://pagure.io', ISSUE_URL.format(42),
+            poll_interval=10, timeout=-1)
+        get_pagure_issue.assert_not_called()
+
+
+class TestOnboarding(unittest.TestCase):
+    """Test Onboarding"""
+
+    def setUp(self):
+        self.tickets = []
+        self.lock = threading.Lock()
+        self.cloned = []
+
+        patchers = [
+            patch('fedpkg.onboard.new_pagure_issue',
+                  side_effect=self.new_pagure_issue),
+            patch('fedpkg.onboard.wait_for_issue'),
+            patch('fedpkg.onboard.BugzillaClient'),
+            patch('fedpkg.onboard.assert_new_tests_repo'),
+            patch('fedpkg.onboard.assert_valid_epel_package'),
+        ]
+        mocks = []
+        for patcher in patchers:
+            mocks.append(patcher.start())
+            self.addCleanup(patcher.stop)
+        (self.wait_for_issue, self.BugzillaClient, self.assert_new_tests_repo,
+         self.assert_valid_epel_package) = mocks[1:]
+
+        def get_review_bug(bug_id, namespace, name):
+            if bug_id == 666:
+                raise rpkgError('The Bugzilla bug is not approved yet')
+            return Mock(summary='Review Request: {0} - Summary of {0}'.format(
+                name))
+
+        self.BugzillaClient.return_value.get_review_bug.side_effect = \
+            get_review_bug
+
+    def new_pagure_issue(self, logger, url, token, title, body, cli_name):
+        with self.lock:
+            self.tickets.append(json.loads(body.strip('`\n')))
+            return ISSUE_URL.format(len(self.tickets))
+
+    def clone(self, name):
+        if name == 'broken':
+            raise rpkgError('Connection refused')
+        self.cloned.append(name)
+
+    def onboarding(self, **kwargs):
+        return Onboarding('fedpkg', 'https://bugzilla', 'https://pagure.io',
+                          'token', ['f33', 'epel8', 'epel8-playground'],
+                          clone=self.clone, poll_interval=0, **kwargs)
+
+    def test_onboard(self):
+        results = self.onboarding().run([('foo', 1), ('bar', 2)])
+
+        self.assertEqual([None, None],
+                         [package['error'] for package in results])
+        foo = results[0]
+        self.assertEqual('Summary of foo', foo['summary'])
+        self.assertTrue(foo['cloned'])
+        self.assertEqual(['epel8', 'epel8-playground', 'f33'],
+                         sorted(foo['branch_tickets']))
+        self.assertEqual(['bar', 'foo'], sorted(self.cloned))
+        self.assertEqual(
+            sorted([('new_repo', 'foo', 'master'), ('new_repo', 'bar', 'master'),
+                    ('new_branch', 'foo', 'f33'), ('new_branch', 'bar', 'f33'),
+                    ('new_branch', 'foo', 'epel8'),
+                    ('new_branch', 'bar', 'epel8'),
+                    ('new_branch', 'foo', 'epel8-playground'),
+                    ('new_branch', 'bar', 'epel8-playground')]),
+            sorted((ticket['action'], ticket['repo'], ticket['branch'])
+                   for ticket in self.tickets))
+        repo_ticket = [ticket for ticket in self.tickets
+                       if ticket['action'] == 'new_repo'
+                       and ticket['repo'] == 'foo'][0]
+        self.assertEqual(1, repo_ticket['bug_id'])
+        self.assertEqual('Summary of foo', repo_ticket['summary'])
+        self.wait_for_issue.assert_any_call(
+            'https://pagure.io', foo['repo_ticket'], poll_interval=0,
+            max_poll_interval=600, timeout=24 * 3600)
+        # Playground branches come with epel8 and are not checked separately
+        self.assert_valid_epel_package.assert_has_calls(
+            [call('foo', 'epel8'), call('bar', 'epel8')], any_order=True)
+        self.assertEqual(2, self.assert_valid_epel_package.call_count)
+
+    def test_failed_validation(self):
+        self.assert_new_tests_repo.side_effect = rpkgError(
+            'Repository https://src/tests/bad already exists')
+
+        results = self.onboarding(dist_git_url='https://src').run([('bad', 666)])
+
+        self.assertEqual(
+            'validation failed: The Bugzilla bug is not approved yet; '
+            'Repository https://src/tests/bad already exists',
+            results[0]['error'])
+        self.assertEqual([], self.tickets)
+
+    def test_tests_repo(self):
+        results = self.onboarding(dist_git_url='https://src').run(
+            [('foo', 1)])
+
+        self.assertIsNone(results[0]['error'])
+        self.assertIsNotNone(results[0]['tests_ticket'])
+        self.assert_new_tests_repo.assert_called_once_with('foo',
+                                                           'https://src')
+        self.assertIn(('tests', 'foo'),
+                      [(ticket['namespace'], ticket['repo'])
+                       for ticket in self.tickets])
+
+    def test_rejected_repo_request(self):
+        self.wait_for_issue.side_effect = rpkgError('closed as Invalid')
+
+        results = self.onboarding().run([('foo', 1)])
+
+        self.assertEqual('repository request failed: closed as Invalid',
+                         results[0]['error'])
+        self.assertEqual(ISSUE_URL.format(1), results[0]['repo_ticket'])
+        self.assertEqual([], self.cloned)
+        self.assertEqual(1, len(self.tickets))
+
+    def test_failed_clone_still_requests_branches(self):
+        results = self.onboarding().run([('broken', 1)])
+
+        self.assertEqual('clone and branch requests failed: '
+                         'Connection refused', results[0]['error'])
+        self.assertFalse(results[0]['cloned'])
+        self.assertEqual(3, len(results[0]['branch_tickets']))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import koji
+import six
+from mock import Mock, patch
+
+from fedpkg.rebuild import (RebuildScheduler, RebuildState, build_order,
+                            dependency_names)
+from pyrpkg import rpkgError
+from utils import unittest
+
+
+class TestDependencyNames(unittest.TestCase):
+    """Test dependency_names"""
+
+    def test_plain(self):
+        self.assertEqual(['libfoo-devel'], dependency_names('libfoo-devel'))
+
+    def test_versioned(self):
+        self.assertEqual(['pkgconfig(foo)'],
+                         dependency_names('pkgconfig(foo) >= 1.2'))
+
+    def test_rich(self):
+        self.assertEqual(
+            ['foo', 'pkgconfig(bar)', 'baz'],
+            dependency_names('(foo >= 1.0 or (pkgconfig(bar) if baz))'))
+
+
+class TestBuildOrder(unittest.TestCase):
+    """Test build_order"""
+
+    def test_waves(self):
+        packages = {
+            'lib': {'provides': ['lib = 2.0', 'lib-devel = 2.0'],
+                    'buildrequires': ['gcc']},
+            'app': {'provides': ['app = 1.0'],
+                    'buildrequires': ['lib-devel >= 2.0', 'plugin']},
+            'plugin': {'provides': ['plugin = 1.0'],
+                       'buildrequires': ['(lib-devel or other)']},
+            'tool': {'provides': ['tool = 1.0'],
+                     'buildrequires': ['make']},
+        }
+
+        self.assertEqual([['lib', 'tool'], ['plugin'], ['app']],
+                         build_order(packages))
+
+    def test_self_dependency(self):
+        packages = {'gcc': {'provides': ['gcc'], 'buildrequires': ['gcc']}}
+
+        self.assertEqual([['gcc']], build_order(packages))
+
+    def test_cycle(self):
+        packages = {
+            'a': {'provides': ['a'], 'buildrequires': ['b']},
+            'b': {'provides': ['b'], 'buildrequires': ['a']},
+            'c': {'provides': ['c'], 'buildrequires': []},
+        }
+
+        six.assertRaisesRegex(self, rpkgError, 'cycle, cannot order: a, b',
+                              build_order, packages)
+
+
+class RebuildTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-rebuild-')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.state_file = os.path.join(self.tmpdir, 'state.json')
+
+
+class TestRebuildState(RebuildTestCase):
+    """Test RebuildState"""
+
+    def test_save_and_load(self):
+        state = RebuildState(self.state_file)
+        state.waves = [['/ws/lib'], ['/ws/app']]
+        state.packages = {'/ws/lib': {'nvr': 'lib-2.0-1.fc33'}}
+        state.ready_waves = 1
+        state.save()
+
+        loaded = RebuildState.load(self.state_file)
+        self.assertEqual(state.waves, loaded.waves)
+        self.assertEqual(state.packages, loaded.packages)
+        self.assertEqual(1, loaded.ready_waves)
+        self.assertEqual(['state.json'], os.listdir(self.tmpdir))
+
+    def test_load_missing(self):
+        self.assertIsNone(RebuildState.load(self.state_file))
+
+    def test_load_unknown_format(self):
+        with open(self.state_file, 'w') as f:
+            json.dump({'format': 0}, f)
+
+        six.assertRaisesRegex(self, rpkgError, 'unknown format',
+                              RebuildState.load, self.state_file)
+
+
+class FakeKoji(object):
+    """Koji session building everything in one poll"""
+
+    def __init__(self):
+        self.tasks = {}
+        self.tagged = {}
+        self.event = 100
+        self.failing = set()
+
+    def submit(self, nvr):
+        task_id = len(self.tasks) + 1
+        self.tasks[task_id] = [nvr, koji.TASK_STATES['OPEN']]
+        return task_id
+
+    def getBuild(self, nvr):
+        return None
+
+    def getTaskInfo(self, task_id):
+        task = self.tasks[task_id]
+        if task[1] == koji.TASK_STATES['OPEN']:
+            # Finish the task and tag the build, repo comes with next event
+            failed = task[0] in self.failing
+            task[1] = koji.TASK_STATES['FAILED' if failed else 'CLOSED']
+            if not failed:
+                self.event += 1
+                self.tagged[task[0].rsplit('-', 2)[0]] = {
+                    'nvr': task[0], 'create_event': self.event}
+        return {'state': task[1]}
+
+    def getBuildTarget(self, target):
+        return {'build_tag_name': target + '-build'}
+
+    def getRepo(self, tag):
+        self.event += 1
+        return {'create_event': self.event}
+
+    def listTagged(self, tag, package, latest, inherit):
+        return [self.tagged[package]] if package in self.tagged else []
+
+
+class TestRebuildScheduler(RebuildTestCase):
+    """Test RebuildScheduler"""
+
+    deps = {
+        'lib': {'provides': ['lib-devel = 2.0'], 'buildrequires': []},
+        'app': {'provides': ['app = 1.0'], 'buildrequires': ['lib-devel']},
+        'tool': {'provides': ['tool = 1.0'], 'buildrequires': []},
+    }
+
+    def setUp(self):
+        super(TestRebuildScheduler, self).setUp()
+        self.session = FakeKoji()
+        self.built = []
+        self.messages = []
+        self.override = Mock()
+
+    def commands(self, path):
+        name = os.path.basename(path)
+        cmd = Mock(repo_name=name, nvr='{0}-1.0-1.fc33'.format(name),
+                   target='f33-candidate', path=path, rpmdefines=[])
+        # Keyword spec would be taken by Mock itself
+        cmd.spec = name + '.spec'
+        cmd._spec_dependencies.return_value = self.deps[name]
+
+        def build(nvr_check):
+            self.built.append(name)
+            return self.session.submit(cmd.nvr)
+
+        cmd.build.side_effect = build
+        return cmd
+
+    def make_scheduler(self, state=None, **kwargs):
+        # Builds are submitted in order of waves by a single worker
+        kwargs.setdefault('workers', 1)
+        return RebuildScheduler(
+            self.session, self.commands, state or RebuildState(self.state_file),
+            poll_interval=0, report=self.messages.append, **kwargs)
+
+    def test_plan(self):
+        scheduler = self.make_scheduler()
+        scheduler.plan(['/ws/app', '/ws/lib', '/ws/tool'], workers=2)
+
+        state = RebuildState.load(self.state_file)
+        self.assertEqual([['/ws/lib', '/ws/tool'], ['/ws/app']], state.waves)
+        self.assertEqual('pending', state.packages['/ws/app']['state'])
+        self.assertEqual('app-1.0-1.fc33', state.packages['/ws/app']['nvr'])
+
+    def test_run(self):
+        scheduler = self.make_scheduler(override=self.override)
+        scheduler.plan(['/ws/app', '/ws/lib', '/ws/tool'])
+        scheduler.run()
+
+        self.assertEqual(['lib', 'tool', 'app'], self.built)
+        self.override.assert_any_call('lib-1.0-1.fc33')
+        self.assertEqual(2, self.override.call_count)
+        state = RebuildState.load(self.state_file)
+        self.assertEqual(2, state.ready_waves)
+        self.assertEqual(['built'] * 3, [info['state'] for info in
+                                         state.packages.values()])
+        self.assertIn('Waiting for repo of f33-candidate-build',
+                      self.messages)
+
+    def test_submit_wave_concurrently(self):
+        started = {'lib': threading.Event(), 'tool': threading.Event()}
+        overlapped = []
+        lock = threading.Lock()
+
+        def commands(path):
+            cmd = self.commands(path)
+            build = cmd.build.side_effect
+
+            def wait_for_other(nvr_check):
+                started[cmd.repo_name].set()
+                other = 'tool' if cmd.repo_name == 'lib' else 'lib'
+                overlapped.append(started[other].wait(5))
+                with lock:
+                    return build(nvr_check)
+
+            cmd.build.side_effect = wait_for_other
+            return cmd
+
+        scheduler = self.make_scheduler(workers=2)
+        scheduler.commands_factory = commands
+        scheduler.plan(['/ws/lib', '/ws/tool'])
+        scheduler.run()
+
+        self.assertEqual([True, True], overlapped)
+        self.assertEqual(['lib', 'tool'], sorted(self.built))
+        state = RebuildState.load(self.state_file)
+        self.assertEqual(['built', 'built'], [info['state'] for info in
+                                              state.packages.values()])
+        self.assertEqual([1, 2], sorted(info['task_id'] for info in
+                                        state.packages.values()))
+
+    def test_side_tag(self):
+        targets = []
+
+        def commands(path):
+            cmd = self.commands(path)
+            targets.append(cmd)
+            return cmd
+
+        scheduler = self.make_scheduler(side_tag='f33-build-side-1')
+        scheduler.commands_factory = commands
+        scheduler.plan(['/ws/lib'])
+
+        self.assertEqual('f33-build-side-1', targets[0].target)
+
+    def test_stop_at_failure_and_resume(self):
+        self.session.failing.add('lib-1.0-1.fc33')
+        scheduler = self.make_scheduler()
+        scheduler.plan(['/ws/app', '/ws/lib', '/ws/tool'])
+
+        six.assertRaisesRegex(self, rpkgError, 'Builds failed: lib-1.0-1.fc33',
+                              scheduler.run)
+        self.assertEqual(['lib', 'tool'], self.built)
+
+        self.session.failing.clear()
+        scheduler = self.make_scheduler(RebuildState.load(self.state_file))
+        scheduler.run()
+
+        # Only the failed build is submitted again
+        self.assertEqual(['lib', 'tool', 'lib', 'app'], self.built)
+
+    def test_skip_existing_builds(self):
+        scheduler = self.make_scheduler()
+        scheduler.plan(['/ws/tool'])
+        with patch.object(self.session, 'getBuild',
+                          return_value={'state': koji.BUILD_STATES['COMPLETE'],
+                                        'task_id': 42}):
+            scheduler.run()
+
+        self.assertEqual([], self.built)
+        self.assertEqual(42, scheduler.state.packages['/ws/tool']['task_id'])
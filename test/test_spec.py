@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from fedpkg.spec import SpecCache, macros_digest
+from utils import unittest
+
+
+class TestSpecCache(unittest.TestCase):
+    """Test SpecCache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-spec-cache-')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.spec_file = os.path.join(self.tmpdir, 'pkg.spec')
+        with open(self.spec_file, 'w') as f:
+            f.write('Name: pkg\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_depends_on_content_and_defines(self):
+        key = SpecCache.make_key(self.spec_file, ["--define 'dist .fc30'"])
+
+        self.assertEqual(
+            key, SpecCache.make_key(self.spec_file, ["--define 'dist .fc30'"]))
+        self.assertNotEqual(
+            key, SpecCache.make_key(self.spec_file, ["--define 'dist .fc31'"]))
+
+        with open(self.spec_file, 'a') as f:
+            f.write('Version: 1.0\n')
+        self.assertNotEqual(
+            key, SpecCache.make_key(self.spec_file, ["--define 'dist .fc30'"]))
+
+    def test_key_depends_on_macro_files(self):
+        macros_dir = os.path.join(self.tmpdir, 'macros.d')
+        os.mkdir(macros_dir)
+        with open(os.path.join(macros_dir, 'macros.dist'), 'w') as f:
+            f.write('%dist .fc30\n')
+
+        with patch('fedpkg.spec.MACRO_PATHS', new=[macros_dir]):
+            key = SpecCache.make_key(self.spec_file, [])
+            with open(os.path.join(macros_dir, 'macros.dist'), 'w') as f:
+                f.write('%dist .fc31\n')
+            self.assertNotEqual(key, SpecCache.make_key(self.spec_file, []))
+
+    def test_macros_digest(self):
+        macros = os.path.join(self.tmpdir, 'macros')
+        with open(macros, 'w') as f:
+            f.write('%dist .fc30\n')
+        missing = os.path.join(self.tmpdir, 'missing')
+
+        digest = macros_digest([macros, missing])
+        self.assertEqual(digest, macros_digest([macros]))
+        with open(macros, 'w') as f:
+            f.write('%dist .fc31\n')
+        self.assertNotEqual(digest, macros_digest([macros]))
+
+    def test_persist_between_instances(self):
+        SpecCache(self.cache_dir).set('abc', {'name': 'pkg'})
+
+        self.assertEqual({'name': 'pkg'}, SpecCache(self.cache_dir).get('abc'))
+        self.assertIsNone(SpecCache(self.cache_dir).get('def'))
+
+    def test_memory_only_cache(self):
+        cache = SpecCache()
+        cache.set('abc', {'name': 'pkg'})
+
+        self.assertEqual({'name': 'pkg'}, cache.get('abc'))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_ignore_corrupted_entry(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, 'abc.json'), 'w') as f:
+            f.write('{')
+
+        self.assertIsNone(SpecCache(self.cache_dir).get('abc'))
+
+    def test_do_not_cache_specs_depending_on_other_files(self):
+        for line in ('%include common.inc\n',
+                     'Version: %(cat VERSION)\n',
+                     'Release: %{lua: print(1)}\n',
+                     'Release: %autorelease\n',
+                     '%{expand:%%global v %%(cat VERSION)}\n'):
+            with open(self.spec_file, 'w') as f:
+                f.write('Name: pkg\n' + line)
+            self.assertIsNone(SpecCache.make_key(self.spec_file, []))
+
+    def test_evict_least_recently_used(self):
+        cache = SpecCache(self.cache_dir, max_entries=2)
+        cache.set('a', {'name': 'a'})
+        cache.set('b', {'name': 'b'})
+        os.utime(os.path.join(self.cache_dir, 'a.json'), (1, 1))
+        os.utime(os.path.join(self.cache_dir, 'b.json'), (2, 2))
+        # Reading an entry makes it recently used
+        SpecCache(self.cache_dir).get('a')
+        cache.set('c', {'name': 'c'})
+
+        self.assertEqual(['a.json', 'c.json'],
+                         sorted(os.listdir(self.cache_dir)))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os
+import shutil
+import tempfile
+import time
+
+from fedpkg.srpm import SRPMCache
+from utils import unittest
+
+
+class TestSRPMCache(unittest.TestCase):
+    """Test SRPMCache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-srpm-cache-')
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.cache = SRPMCache(self.cache_dir, max_size=100, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_file(self, filename, content):
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_key_depends_on_files_and_values(self):
+        spec = self.make_file('pkg.spec', 'Name: pkg\n')
+        key = SRPMCache.make_key([spec], ['dist .fc30'])
+
+        self.assertEqual(key, SRPMCache.make_key([spec], ['dist .fc30']))
+        self.assertNotEqual(key, SRPMCache.make_key([spec], ['dist .fc31']))
+        self.make_file('pkg.spec', 'Name: pkg2\n')
+        self.assertNotEqual(key, SRPMCache.make_key([spec], ['dist .fc30']))
+
+    def test_put_and_get(self):
+        srpm = self.make_file('pkg-1.0-1.fc30.src.rpm', 'srpm')
+        self.cache.put('abc', srpm)
+
+        cached = self.cache.get('abc', 'pkg-1.0-1.fc30.src.rpm')
+        self.assertEqual(os.path.join(self.cache_dir, 'abc',
+                                      'pkg-1.0-1.fc30.src.rpm'), cached)
+        with open(cached) as f:
+            self.assertEqual('srpm', f.read())
+        self.assertIsNone(self.cache.get('def', 'pkg-1.0-1.fc30.src.rpm'))
+
+    def test_evict_old_entries(self):
+        self.cache.put('abc', self.make_file('old.src.rpm', 'old'))
+        old_time = time.time() - 7200
+        os.utime(os.path.join(self.cache_dir, 'abc', 'old.src.rpm'),
+                 (old_time, old_time))
+
+        self.cache.put('def', self.make_file('new.src.rpm', 'new'))
+
+        self.assertIsNone(self.cache.get('abc', 'old.src.rpm'))
+        self.assertIsNotNone(self.cache.get('def', 'new.src.rpm'))
+
+    def test_evict_least_recently_used_over_size(self):
+        self.cache.put('abc', self.make_file('a.src.rpm', 'a' * 60))
+        past = time.time() - 60
+        os.utime(os.path.join(self.cache_dir, 'abc', 'a.src.rpm'),
+                 (past, past))
+
+        self.cache.put('def', self.make_file('b.src.rpm', 'b' * 60))
+
+        self.assertIsNone(self.cache.get('abc', 'a.src.rpm'))
+        self.assertIsNotNone(self.cache.get('def', 'b.src.rpm'))
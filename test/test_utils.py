@@ -19,7 +19,7 @@ from six.moves.configparser import NoOptionError, NoSectionError
 
 from fedpkg import utils
 from freezegun import freeze_time
-from pyrpkg.errors import rpkgError
+from pyrpkg.errors import MalformedLineError, rpkgError
 from utils import unittest
 
 
@@ -428,6 +428,36 @@ class TestNewPagureIssue(unittest.TestCase):
         )
 
 
+@patch('requests.get')
+class TestGetPagureIssue(unittest.TestCase):
+    """Test get_pagure_issue"""
+
+    def test_get_issue(self, get):
+        get.return_value = Mock(ok=True)
+        get.return_value.json.return_value = {'id': 2, 'status': 'Open'}
+
+        issue = utils.get_pagure_issue('https://pagure.io/', '2')
+
+        self.assertEqual({'id': 2, 'status': 'Open'}, issue)
+        get.assert_called_once_with(
+            'https://pagure.io/api/0/releng/fedora-scm-requests/issue/2',
+            timeout=60)
+
+    def test_connection_error(self, get):
+        get.side_effect = ConnectionError
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'The connection to Pagure failed',
+            utils.get_pagure_issue, 'https://pagure.io', 2)
+
+    def test_api_error(self, get):
+        get.return_value = Mock(ok=False, text='Issue not found')
+
+        six.assertRaisesRegex(
+            self, rpkgError, 'getting issue 2 from Pagure: Issue not found',
+            utils.get_pagure_issue, 'https://pagure.io', 2)
+
+
 @patch('requests.get')
 class TestQueryPDC(unittest.TestCase):
     """Test utils.query_pdc"""
@@ -519,6 +549,29 @@ class TestExpandRelease(unittest.TestCase):
         self.assertEqual(None, result)
 
 
+class TestParseSourcesLine(unittest.TestCase):
+    """Test parse_sources_line"""
+
+    def test_bsd_format(self):
+        entry = utils.parse_sources_line(
+            'SHA512 (pkg-1.0.tar.gz) = 123abc\n')
+        self.assertEqual(('sha512', 'pkg-1.0.tar.gz', '123abc'),
+                         (entry.hashtype, entry.file, entry.hash))
+        self.assertEqual('SHA512 (pkg-1.0.tar.gz) = 123abc\n', str(entry))
+
+    def test_old_format(self):
+        entry = utils.parse_sources_line('123abc  pkg 1.0.tar.gz')
+        self.assertEqual(('md5', 'pkg 1.0.tar.gz', '123abc'),
+                         (entry.hashtype, entry.file, entry.hash))
+
+    def test_blank_line(self):
+        self.assertIsNone(utils.parse_sources_line('  \n'))
+
+    def test_malformed_line(self):
+        self.assertRaises(MalformedLineError, utils.parse_sources_line,
+                          'garbage')
+
+
 class TestGetFedoraReleaseState(unittest.TestCase):
 
     @patch('requests.get')
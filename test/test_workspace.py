@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# fedpkg - a Python library for RPM Packagers
+#
+# Copyright (C) 2020 Red Hat Inc.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.  See http://www.gnu.org/copyleft/gpl.html for
+# the full text of the license.
+
+import os
+import shutil
+import tempfile
+import time
+
+from mock import Mock
+
+from fedpkg.workspace import WorkspaceIndex, find_checkouts, refs_stamp
+from pyrpkg import rpkgError
+from utils import unittest
+
+
+class WorkspaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='fedpkg-test-workspace-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_checkout(self, *names):
+        path = os.path.join(self.tmpdir, *names)
+        os.makedirs(os.path.join(path, '.git'))
+        return path
+
+
+class TestFindCheckouts(WorkspaceTestCase):
+    """Test find_checkouts"""
+
+    def test_find_checkouts(self):
+        expected = [self.make_checkout('pkg'),
+                    self.make_checkout('rpms', 'other')]
+        os.makedirs(os.path.join(self.tmpdir, 'empty'))
+
+        self.assertEqual(sorted(expected), find_checkouts(self.tmpdir))
+
+    def test_root_is_checkout(self):
+        path = self.make_checkout('pkg')
+
+        self.assertEqual([path], find_checkouts(path))
+
+    def test_do_not_search_inside_checkouts(self):
+        path = self.make_checkout('pkg')
+        self.make_checkout('pkg', 'subproject')
+
+        self.assertEqual([path], find_checkouts(self.tmpdir))
+
+    def test_worktree_with_git_file(self):
+        path = os.path.join(self.tmpdir, 'worktree')
+        os.makedirs(path)
+        with open(os.path.join(path, '.git'), 'w') as f:
+            f.write('gitdir: /elsewhere\n')
+
+        self.assertEqual([path], find_checkouts(self.tmpdir))
+
+    def test_max_depth(self):
+        path = self.make_checkout('pkg')
+        self.make_checkout('a', 'b', 'deep')
+
+        self.assertEqual([path], find_checkouts(self.tmpdir, max_depth=2))
+
+    def test_skip_hidden_directories(self):
+        self.make_checkout('.cache', 'pkg')
+
+        self.assertEqual([], find_checkouts(self.tmpdir))
+
+
+class FakeCheckout(object):
+    """Checkout with loose refs only, and Commands working on it"""
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.heads = {}
+        self.head_branch = 'master'
+        self.evaluated = []
+        self.writes = 0
+        os.makedirs(os.path.join(path, '.git', 'refs', 'heads'))
+        self.write('HEAD', 'ref: refs/heads/master\n')
+
+    def write(self, name, content):
+        filename = os.path.join(self.path, '.git', name)
+        with open(filename, 'w') as f:
+            f.write(content)
+        # Make every change visible even on filesystems with coarse mtimes
+        self.writes += 1
+        mtime = time.time() + self.writes
+        os.utime(filename, (mtime, mtime))
+
+    def commit(self, branch, sha):
+        self.heads[branch] = sha
+        self.write(os.path.join('refs', 'heads', branch), sha + '\n')
+
+    def branches_report(self, branches, workers, local):
+        self.evaluated.extend(branches)
+        return [{'branch': branch,
+                 'nvr': '{0}-1.0-{1}'.format(self.name, self.heads[branch][:3]),
+                 'error': None,
+                 'entries': [['sha512', 'a.tar.gz', 'hash-' + branch]]}
+                for branch in branches]
+
+    def commands(self):
+        cmd = Mock(repo_name=self.name, ns='rpms')
+        cmd.repo.git.for_each_ref.return_value = '\n'.join(
+            '{0} refs/heads/{1}'.format(sha, branch)
+            for branch, sha in sorted(self.heads.items()))
+        cmd.repo.active_branch.name = self.head_branch
+        cmd.branches_report.side_effect = self.branches_report
+        return cmd
+
+
+class TestWorkspaceIndex(WorkspaceTestCase):
+    """Test WorkspaceIndex"""
+
+    def setUp(self):
+        super(TestWorkspaceIndex, self).setUp()
+        self.index = WorkspaceIndex(os.path.join(self.tmpdir, 'ws.sqlite'))
+        self.addCleanup(self.index.close)
+        self.root = os.path.join(self.tmpdir, 'checkouts')
+        self.checkouts = {}
+        for name in ('pkg', 'other'):
+            checkout = FakeCheckout(os.path.join(self.root, name), name)
+            checkout.commit('master', 'aaa111')
+            checkout.commit('f32', 'bbb222')
+            self.checkouts[checkout.path] = checkout
+
+    def commands_factory(self, path):
+        return self.checkouts[path].commands()
+
+    def update(self):
+        return self.index.update(self.root, sorted(self.checkouts),
+                                 self.commands_factory, workers=2)
+
+    def test_update_and_query(self):
+        self.assertEqual((2, 0, 0, 0), self.update())
+
+        rows = self.index.query(name='pkg')
+        self.assertEqual(['f32', 'master'], [row['branch'] for row in rows])
+        self.assertEqual(['pkg-1.0-bbb', 'pkg-1.0-aaa'],
+                         [row['nvr'] for row in rows])
+        self.assertEqual([False, True], [row['head'] for row in rows])
+        self.assertEqual('rpms', rows[0]['namespace'])
+        self.assertEqual([['sha512', 'a.tar.gz', 'hash-f32']],
+                         rows[0]['sources'])
+
+    def test_query_filters(self):
+        self.update()
+
+        self.assertEqual(2, len(self.index.query(branch='f3*')))
+        self.assertEqual(2, len(self.index.query(head_only=True)))
+        self.assertEqual(['other-1.0-aaa'],
+                         [row['nvr'] for row in self.index.query(nvr='oth*-aaa')])
+        self.assertEqual(['f32', 'f32'],
+                         [row['branch'] for row in self.index.query(hash='hash-f32')])
+        self.assertEqual([], self.index.query(namespace='modules'))
+
+    def test_skip_unchanged_checkouts(self):
+        self.update()
+
+        self.assertEqual((0, 2, 0, 0), self.update())
+
+    def test_evaluate_changed_branches_only(self):
+        self.update()
+        checkout = self.checkouts[os.path.join(self.root, 'pkg')]
+        checkout.evaluated = []
+        checkout.commit('f32', 'ccc333')
+        checkout.commit('f33', 'ddd444')
+
+        self.assertEqual((1, 1, 0, 0), self.update())
+        self.assertEqual(['f32', 'f33'], checkout.evaluated)
+        self.assertEqual(['pkg-1.0-ccc', 'pkg-1.0-ddd', 'pkg-1.0-aaa'],
+                         [row['nvr'] for row in self.index.query(name='pkg')])
+
+    def test_forget_deleted_branches(self):
+        self.update()
+        checkout = self.checkouts[os.path.join(self.root, 'pkg')]
+        del checkout.heads['f32']
+        os.remove(os.path.join(checkout.path, '.git', 'refs', 'heads', 'f32'))
+        checkout.write('HEAD', 'ref: refs/heads/master\n')
+
+        self.update()
+        self.assertEqual(['master'],
+                         [row['branch'] for row in self.index.query(name='pkg')])
+        self.assertEqual([], self.index.query(name='pkg', hash='hash-f32'))
+
+    def test_remove_missing_checkouts(self):
+        self.update()
+        del self.checkouts[os.path.join(self.root, 'other')]
+
+        self.assertEqual((0, 1, 0, 1), self.update())
+        self.assertEqual([], self.index.query(name='other'))
+
+    def test_failed_checkout_is_tried_again(self):
+        path = os.path.join(self.root, 'pkg')
+        self.checkouts[path].commands = Mock(side_effect=rpkgError('broken'))
+
+        self.assertEqual((1, 0, 1, 0), self.update())
+        self.assertEqual([], self.index.query(name='pkg'))
+
+        del self.checkouts[path].commands
+        self.assertEqual((1, 1, 0, 0), self.update())
+
+    def test_stamp_changes_with_head(self):
+        checkout = self.checkouts[os.path.join(self.root, 'pkg')]
+        stamp = refs_stamp(checkout.path)
+        checkout.write('HEAD', 'ref: refs/heads/f32\n')
+
+        self.assertNotEqual(stamp, refs_stamp(checkout.path))